@@ -0,0 +1,255 @@
+import argparse
+import asyncio
+import datetime as dt
+import json
+import os
+import sys
+
+import httpx
+from fakeredis.aioredis import FakeRedis
+from stock_market.core import StockMarket, StockUpdater, Ticker
+
+from stock_market_engine.common import (
+    get_signal_detector_factory,
+    get_stock_updater_factory,
+)
+from stock_market_engine.config import get_settings
+from stock_market_engine.engine import Engine, add_ticker, remove_ticker
+from stock_market_engine.engine_cache import get_engine_cache
+from stock_market_engine.engine_store import get_engine, store_engine
+from stock_market_engine.fetcher import CsvOHLCFetcher
+from stock_market_engine.main import app
+from stock_market_engine.ohlc_cache import get_ohlc_fetch_cache
+
+from .runner import compare, load_results, measure, report, save_results
+
+"""
+Benchmarks of the engine hot paths on the bundled CSV data, with Redis replaced by
+fakeredis. Run with 'python -m benchmarks', see --help for the options.
+"""
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), os.pardir, "data")
+BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+# Tickers ordered by the length of their history
+TICKERS = [
+    "SPY",
+    "DIA",
+    "QQQ",
+    "IWD",
+    "IWF",
+    "IWM",
+    "SH",
+    "EUE.MI",
+    "EXSA.DE",
+    "PHYS",
+    "VOO",
+]
+END_DATE = dt.date(2021, 9, 17)
+# (tickers, signal detectors, years), scaling one dimension at a time
+SCALES = [
+    (1, 1, 1),
+    (4, 1, 1),
+    (11, 1, 1),
+    (1, 10, 1),
+    (1, 50, 1),
+    (1, 1, 10),
+    (1, 1, 28),
+    (11, 50, 28),
+]
+QUICK_SCALES = [(1, 1, 1), (4, 10, 10)]
+
+
+def signal_detector_configs(count, tickers):
+    configs = []
+    for i in range(count):
+        ticker = tickers[i % len(tickers)].to_json()
+        configs.append(
+            [
+                ("Monthly", json.dumps(i)),
+                ("Bi-monthly", json.dumps(i)),
+                ("Golden cross", json.dumps({"id": i, "ticker": ticker})),
+                ("Death cross", json.dumps({"id": i, "ticker": ticker})),
+            ][i % 4]
+        )
+    return configs
+
+
+class Scale:
+    def __init__(self, tickers, detectors, years):
+        self.tickers = [Ticker(symbol) for symbol in TICKERS[:tickers]]
+        self.detectors = signal_detector_configs(detectors, self.tickers)
+        self.start_date = END_DATE - dt.timedelta(days=365 * years)
+        self.name = f"t{tickers}-d{detectors}-y{years}"
+
+    def engine(self):
+        factory = get_signal_detector_factory()
+        return Engine(
+            StockMarket(self.start_date, self.tickers),
+            StockUpdater(CsvOHLCFetcher(DATA_DIR)),
+            [factory.create(name, config) for name, config in self.detectors],
+        )
+
+    def engine_config(self):
+        return {
+            "stock_market": {
+                "start_date": self.start_date.isoformat(),
+                "tickers": [{"symbol": t.symbol} for t in self.tickers],
+            },
+            "signal_detectors": [
+                {"static_name": name, "config": config}
+                for name, config in self.detectors
+            ],
+        }
+
+
+async def __nothing():
+    pass
+
+
+async def engine_cases(scale):
+    engine = scale.engine()
+    updated = await engine.update(END_DATE)
+    json_str = updated.to_json()
+    redis = FakeRedis()
+    factory = get_signal_detector_factory()
+    stock_updater_factory = get_stock_updater_factory()
+
+    async def update():
+        await engine.update(END_DATE)
+
+    async def to_json():
+        updated.to_json()
+
+    async def from_json():
+        Engine.from_json(json_str, stock_updater_factory, factory)
+
+    async def reset_redis():
+        await redis.flushall()
+        get_engine_cache().clear()
+
+    async def store():
+        await store_engine(updated, redis)
+
+    stored = {}
+
+    async def store_and_forget():
+        await reset_redis()
+        stored["id"] = await store_engine(updated, redis)
+        get_engine_cache().clear()
+
+    async def get():
+        await get_engine(stored["id"], redis)
+
+    # Adds back the removed ticker
+    removed_ticker = scale.tickers[-1]
+    without_ticker = await remove_ticker(updated, removed_ticker)
+
+    async def add():
+        await add_ticker(without_ticker, removed_ticker)
+
+    async def remove():
+        await remove_ticker(updated, removed_ticker)
+
+    return {
+        "update": (__nothing, update),
+        "to_json": (__nothing, to_json),
+        "from_json": (__nothing, from_json),
+        "store_engine": (reset_redis, store),
+        "get_engine": (store_and_forget, get),
+        "add_ticker": (__nothing, add),
+        "remove_ticker": (__nothing, remove),
+    }
+
+
+async def api_cases(scale):
+    settings = get_settings()
+    settings.stock_updater = "csv"
+    settings.stock_updater_config = json.dumps(DATA_DIR)
+    redis = FakeRedis()
+    app.state.redis = redis
+    client = httpx.AsyncClient(app=app, base_url="http://benchmark")
+
+    async def reset():
+        await redis.flushall()
+        get_engine_cache().clear()
+        get_ohlc_fetch_cache.cache_clear()
+        get_ohlc_fetch_cache().bind_redis(lambda: redis)
+
+    async def round_trip():
+        response = await client.post("/create", json=scale.engine_config())
+        engine_id = response.json()
+        response = await client.post(
+            f"/update/{engine_id}", params={"date": END_DATE.isoformat()}
+        )
+        engine_id = response.json()
+        await client.get(f"/signals/{engine_id}")
+        for ticker in scale.tickers:
+            await client.get(f"/ticker/{engine_id}/{ticker.symbol}")
+
+    return {"api": (reset, round_trip)}
+
+
+async def run(scales, iterations, case_filter):
+    results = {}
+    for scale in map(lambda s: Scale(*s), scales):
+        cases = {**await engine_cases(scale), **await api_cases(scale)}
+        for case, (setup, work) in cases.items():
+            name = f"{case}[{scale.name}]"
+            if case_filter and case_filter not in name:
+                continue
+            print(f"Running {name}...", file=sys.stderr)
+            results[name] = await measure(setup, work, iterations)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks", description="Benchmarks the engine hot paths."
+    )
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument(
+        "--quick", action="store_true", help="Only run a small and a medium scale."
+    )
+    parser.add_argument("--filter", help="Only run benchmarks containing the text.")
+    parser.add_argument(
+        "--baseline",
+        default=BASELINE,
+        help="Results saved on this machine with --save-baseline, if any.",
+    )
+    parser.add_argument(
+        "--save-baseline", action="store_true", help="Save the results as baseline."
+    )
+    parser.add_argument("--output", help="Save the results as json to the path.")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=1.25,
+        help="Median latency ratio to the baseline considered a regression.",
+    )
+    args = parser.parse_args()
+
+    scales = QUICK_SCALES if args.quick else SCALES
+    results = asyncio.run(run(scales, args.iterations, args.filter))
+
+    baseline = None
+    if not args.save_baseline and os.path.isfile(args.baseline):
+        baseline = load_results(args.baseline)
+    print(report(results, baseline))
+    if args.output:
+        save_results(results, args.output)
+    if args.save_baseline:
+        save_results({**load_baseline(args.baseline), **results}, args.baseline)
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold)
+        for name, ratio in regressions:
+            print(f"Regression: {name} is {ratio:.2f}x slower", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+def load_baseline(path):
+    return load_results(path) if os.path.isfile(path) else {}
+
+
+if __name__ == "__main__":
+    sys.exit(main())
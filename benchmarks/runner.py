@@ -0,0 +1,91 @@
+import gc
+import json
+import time
+import tracemalloc
+
+import numpy as np
+
+"""
+Measures benchmark cases and compares the results with a saved baseline.
+A case is a (setup, run) pair of coroutine functions, setup runs before every
+iteration and isn't measured.
+"""
+
+PERCENTILES = [50, 90, 99]
+
+
+async def measure(setup, run, iterations):
+    """Returns the latency statistics (in seconds) and the peak traced memory (in
+    bytes) of running the case."""
+    latencies = []
+    for _ in range(iterations):
+        await setup()
+        gc.collect()
+        start = time.perf_counter()
+        await run()
+        latencies.append(time.perf_counter() - start)
+
+    # Tracing slows down the case, measure the memory in a separate run
+    await setup()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        await run()
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    result = {
+        f"p{p}": float(v)
+        for p, v in zip(PERCENTILES, np.percentile(latencies, PERCENTILES))
+    }
+    result["mean"] = float(np.mean(latencies))
+    result["throughput"] = 1 / result["mean"] if result["mean"] > 0 else float("inf")
+    result["peak_memory"] = peak_memory
+    result["iterations"] = iterations
+    return result
+
+
+def compare(results, baseline, threshold):
+    """Returns the (name, ratio) of the results of which the median latency regressed
+    by more than the threshold ratio compared to the baseline."""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None or base["p50"] <= 0:
+            continue
+        ratio = result["p50"] / base["p50"]
+        if ratio > threshold:
+            regressions.append((name, ratio))
+    return regressions
+
+
+def report(results, baseline=None):
+    header = f"{'benchmark':<48} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9}"
+    header += f" {'ops/s':>9} {'peak MB':>9}"
+    if baseline is not None:
+        header += f" {'vs base':>8}"
+    lines = [header]
+    for name, result in results.items():
+        line = f"{name:<48}"
+        line += "".join(f" {result[f'p{p}'] * 1000:>9.2f}" for p in PERCENTILES)
+        line += f" {result['throughput']:>9.2f} {result['peak_memory'] / 2**20:>9.2f}"
+        if baseline is not None:
+            base = baseline.get(name)
+            ratio = "-"
+            if base is not None and base["p50"] > 0:
+                ratio = f"{result['p50'] / base['p50']:.2f}x"
+            line += f" {ratio:>8}"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_results(results, path):
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write("\n")
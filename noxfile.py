@@ -41,3 +41,9 @@ def lint(session):
 def test(session):
     session.install(".[dev]")
     session.run("python", "-m", "unittest")
+
+
+@nox.session(python="3.10", reuse_venv=REUSE_VENV)
+def benchmark(session):
+    session.install(".[dev]")
+    session.run("python", "-m", "benchmarks", *session.posargs)
@@ -1,4 +1,9 @@
+from .batch import *  # noqa
+from .caching import *  # noqa
 from .indicator import *  # noqa
+from .jobs import *  # noqa
+from .lineage import *  # noqa
 from .models import *  # noqa
+from .scheduler import *  # noqa
 from .signal import *  # noqa
 from .stock_market import *  # noqa
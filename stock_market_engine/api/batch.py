@@ -0,0 +1,102 @@
+import asyncio
+from http import HTTPStatus
+from typing import List
+
+from fastapi import HTTPException
+
+from stock_market_engine.api.models import (
+    EngineBatchModel,
+    EngineBatchUpdateModel,
+    EngineModel,
+    SignalDetectorWithNameModel,
+)
+from stock_market_engine.common import (
+    get_redis,
+    get_signal_detector_factory,
+    get_stock_updater_factory,
+)
+from stock_market_engine.engine_store import (
+    get_engine_hash,
+    get_engine_views,
+    get_or_create_engine,
+    store_engines,
+)
+
+
+async def __get_field(view, field):
+    if field == "date":
+        return view.date
+    if field == "start_date":
+        return view.start_date
+    if field == "tickers":
+        return [ticker.symbol for ticker in view.tickers]
+    if field == "signal_detectors":
+        return [
+            SignalDetectorWithNameModel(
+                static_name=d.NAME(), name=d.name, config=d.to_json()
+            )
+            for d in view.signal_detectors
+        ]
+    assert field == "signals", field
+    return (await view.signals()).to_json()
+
+
+async def __get_fields(view, fields):
+    if view is None:
+        return None
+    return {field: await __get_field(view, field) for field in fields}
+
+
+def register_batch_api(app):
+    @app.post("/engines/batch")
+    async def get_engines(batch: EngineBatchModel):
+        """Returns the requested fields of each engine, null for unknown engines."""
+        views = await get_engine_views(
+            batch.engine_ids, get_redis(app), "signals" in batch.fields
+        )
+        return [await __get_fields(view, batch.fields) for view in views]
+
+    @app.post("/engines/create")
+    async def create_engines(engine_configs: List[EngineModel]):
+        engines = [
+            engine_config.create(
+                get_stock_updater_factory(), get_signal_detector_factory()
+            )
+            for engine_config in engine_configs
+        ]
+        if any(engine is None for engine in engines):
+            raise HTTPException(
+                status_code=HTTPStatus.BAD_REQUEST,
+                detail="Incorrect engine configuration!",
+            )
+
+        engine_ids = await store_engines(engines, get_redis(app))
+        return [str(engine_id) for engine_id in engine_ids]
+
+    @app.post("/engines/update")
+    async def update_engines(batch: EngineBatchUpdateModel):
+        """Updates each engine to the date, returns null for unknown engines."""
+        redis = get_redis(app)
+
+        async def update_view(engine_id, view):
+            if view is None:
+                return None
+
+            async def update():
+                engine = await view.engine()
+                return await engine.update(batch.date)
+
+            engine_hash = get_engine_hash(
+                view.start_date, view.tickers, view.signal_detectors, batch.date
+            )
+            return str(
+                await get_or_create_engine(engine_hash, update, redis, engine_id)
+            )
+
+        views = await get_engine_views(batch.engine_ids, redis)
+        return await asyncio.gather(
+            *[
+                update_view(engine_id, view)
+                for engine_id, view in zip(batch.engine_ids, views)
+            ]
+        )
@@ -0,0 +1,74 @@
+import hashlib
+import json
+import uuid
+from http import HTTPStatus
+
+from fastapi import HTTPException, Request, Response
+from fastapi.encoders import jsonable_encoder
+
+from stock_market_engine.common import get_redis
+
+"""
+HTTP caching of the read endpoints. An engine id is never overwritten once stored,
+hence every representation of an engine is immutable until the engine expires: it
+is identified by a strong ETag derived from the request URL, and may be cached for
+the remaining lifetime of the engine. Requests with a matching If-None-Match header
+are answered with 304 without loading the engine.
+"""
+
+# Responses of engines which don't expire are cached for at most a year
+MAX_AGE = 365 * 24 * 60 * 60
+# The schemas only change with a new release
+SCHEMA_MAX_AGE = 24 * 60 * 60
+
+
+def __etag(*parts):
+    return '"' + hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest() + '"'
+
+
+def __is_not_modified(request, etag):
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is None:
+        return False
+    etags = [e.strip().removeprefix("W/") for e in if_none_match.split(",")]
+    return "*" in etags or etag in etags
+
+
+def __cache(request, response, etag, cache_control):
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if __is_not_modified(request, etag):
+        raise HTTPException(status_code=HTTPStatus.NOT_MODIFIED, headers=headers)
+    response.headers.update(headers)
+
+
+async def immutable_engine(engine_id: uuid.UUID, request: Request, response: Response):
+    """
+    Dependency of the engine read endpoints, answers 304 if the client has the
+    representation and adds the caching headers otherwise. Endpoints returning a
+    response themselves have to copy the headers of the 'response' parameter.
+    """
+    expiration_time = await get_redis(request.app).ttl(str(engine_id))
+    if expiration_time == -2:
+        # Unknown engine, the endpoint answers with no content
+        return
+    max_age = MAX_AGE if expiration_time < 0 else min(expiration_time, MAX_AGE)
+    query = "&".join(sorted(f"{k}={v}" for k, v in request.query_params.multi_items()))
+    __cache(
+        request,
+        response,
+        __etag(request.url.path, query),
+        f"public, max-age={max_age}, immutable",
+    )
+
+
+def static_content(content):
+    """
+    Returns a dependency for endpoints returning the fixed 'content', which answers
+    304 if the client has the content and adds the caching headers otherwise.
+    """
+    etag = __etag(json.dumps(jsonable_encoder(content), sort_keys=True))
+
+    async def cache(request: Request, response: Response):
+        __cache(request, response, etag, f"public, max-age={SCHEMA_MAX_AGE}")
+
+    return cache
@@ -1,14 +1,20 @@
+from fastapi import Depends
 from stock_market.common.factory import Factory
 from stock_market.ext.indicator import register_indicator_factories
 
+from stock_market_engine.api.caching import static_content
+
 
 def register_indicator_api(app):
     factory = register_indicator_factories(Factory())
 
-    @app.get("/getsupportedindicators")
+    indicators = [
+        {"indicator_name": indicator, "schema": factory.get_schema(indicator)}
+        for indicator in factory.get_registered_names()
+    ]
+
+    @app.get(
+        "/getsupportedindicators", dependencies=[Depends(static_content(indicators))]
+    )
     async def get_supported_indicators():
-        indicators = factory.get_registered_names()
-        return [
-            {"indicator_name": indicator, "schema": factory.get_schema(indicator)}
-            for indicator in indicators
-        ]
+        return indicators
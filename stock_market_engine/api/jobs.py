@@ -0,0 +1,48 @@
+from http import HTTPStatus
+from typing import Literal
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+
+from stock_market_engine.common import get_redis
+from stock_market_engine.engine_store import get_or_create_engine
+from stock_market_engine.jobs import get_job, get_job_queue
+
+"""
+Mutations creating a new engine run synchronously by default. In 'async' mode they
+are queued as a job and respond with the job id right away, the job's status holds
+the id of the new engine once done. A job is identified by the hash of the engine it
+creates, so identical mutations share the same job.
+"""
+
+Mode = Literal["sync", "async"]
+
+
+async def run_mutation(app, engine_id, engine_hash, create_engine, mode):
+    """Creates the engine derived from the engine with the given id."""
+    redis = get_redis(app)
+
+    async def work():
+        return str(
+            await get_or_create_engine(engine_hash, create_engine, redis, engine_id)
+        )
+
+    if mode == "async":
+        job_id = await get_job_queue().submit(engine_hash, work, redis)
+        return JSONResponse({"job_id": job_id}, status_code=HTTPStatus.ACCEPTED.value)
+    return await work()
+
+
+def register_job_api(app):
+    @app.on_event("shutdown")
+    async def stop_jobs():
+        get_job_queue().stop()
+
+    @app.get("/jobs/{job_id}")
+    async def get_job_status(job_id: str):
+        """Returns the status (queued, running, done or failed) of the job, with the
+        id of the created engine as result when done."""
+        job = await get_job(job_id, get_redis(app))
+        if job is None:
+            raise HTTPException(status_code=HTTPStatus.NOT_FOUND, detail="Unknown job!")
+        return job
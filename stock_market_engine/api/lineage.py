@@ -0,0 +1,55 @@
+import json
+import uuid
+from http import HTTPStatus
+
+from fastapi import Response
+from fastapi.responses import StreamingResponse
+
+from stock_market_engine.common import get_redis
+from stock_market_engine.engine_store import get_engine_view, get_engine_views
+from stock_market_engine.engine_view import added_signals
+from stock_market_engine.lineage import get_lineage, lineage_events
+
+"""
+Server-Sent Events of the engines derived within a lineage. Each event holds the id
+of the new engine, the id of its parent, its date and the signals it added compared
+to its parent.
+"""
+
+EVENT_STREAM_MEDIA_TYPE = "text/event-stream"
+
+
+async def __engine_events(root_id, redis):
+    async for event in lineage_events(root_id, redis):
+        if event is None:
+            yield ": keepalive\n\n"
+            continue
+        # Only the metadata of the engines and their signals after the detection
+        # dates of the parent are read
+        parent, engine = await get_engine_views(
+            [uuid.UUID(event["parent_id"]), uuid.UUID(event["engine_id"])],
+            redis,
+            cache=False,
+        )
+        if engine is None:
+            continue
+        event["date"] = engine.date.isoformat()
+        event["signals"] = (await added_signals(parent, engine)).to_json()
+        yield f"id: {event['engine_id']}\nevent: engine\ndata: {json.dumps(event)}\n\n"
+
+
+def register_lineage_api(app):
+    @app.get("/events/{engine_id}")
+    async def get_engine_events(engine_id: uuid.UUID):
+        """
+        Streams the engines derived from the engine, or from any other engine of its
+        lineage, as Server-Sent Events.
+        """
+        redis = get_redis(app)
+        if not await get_engine_view(engine_id, redis):
+            return Response(status_code=HTTPStatus.NO_CONTENT.value)
+        engine_lineage = await get_lineage(engine_id, redis)
+        return StreamingResponse(
+            __engine_events(engine_lineage["root"], redis),
+            media_type=EVENT_STREAM_MEDIA_TYPE,
+        )
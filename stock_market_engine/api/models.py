@@ -1,7 +1,9 @@
 import datetime
 import json
-from typing import List
+import uuid
+from typing import List, Literal, Optional
 
+import pandas as pd
 from pydantic import BaseModel, Json, constr
 from stock_market.core import StockMarket, Ticker
 
@@ -54,3 +56,65 @@ class EngineModel(BaseModel):
             get_settings().stock_updater, get_settings().stock_updater_config
         )
         return Engine(sm, stock_updater, signal_detectors)
+
+
+class StepModel(BaseModel):
+    """
+    The dates to step an engine through: the given dates and/or every business day
+    from start_date up to and including end_date. Only the engines at the
+    checkpoint dates and at the last date are stored, all are when no checkpoints
+    are given.
+    """
+
+    dates: List[datetime.date] = []
+    start_date: Optional[datetime.date] = None
+    end_date: Optional[datetime.date] = None
+    checkpoints: Optional[List[datetime.date]] = None
+
+    def get_dates(self):
+        dates = set(self.dates)
+        if self.start_date is not None and self.end_date is not None:
+            dates.update(
+                d.date() for d in pd.bdate_range(self.start_date, self.end_date)
+            )
+        return sorted(dates)
+
+    def is_checkpoint(self, date):
+        return self.checkpoints is None or date in self.checkpoints
+
+
+class SweepModel(BaseModel):
+    """Signal detector configurations to run on the same stock market up to a date."""
+
+    stock_market: StockMarketModel
+    signal_detectors: List[SignalDetectorModel]
+    date: datetime.date
+    store_engines: bool = False
+
+    def create_signal_detectors(self, signal_detector_factory):
+        names = signal_detector_factory.get_registered_names()
+        return [
+            (
+                detector_config.create(signal_detector_factory)
+                if detector_config.static_name in names
+                else None
+            )
+            for detector_config in self.signal_detectors
+        ]
+
+    def create_stock_updater(self, stock_updater_factory):
+        return stock_updater_factory.create(
+            get_settings().stock_updater, get_settings().stock_updater_config
+        )
+
+
+class EngineBatchModel(BaseModel):
+    engine_ids: List[uuid.UUID]
+    fields: List[
+        Literal["date", "start_date", "tickers", "signal_detectors", "signals"]
+    ] = ["date"]
+
+
+class EngineBatchUpdateModel(BaseModel):
+    engine_ids: List[uuid.UUID]
+    date: datetime.date
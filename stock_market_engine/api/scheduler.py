@@ -0,0 +1,66 @@
+import datetime
+import uuid
+from http import HTTPStatus
+
+from fastapi import HTTPException, Response
+
+from stock_market_engine.common import get_redis
+from stock_market_engine.config import get_settings
+from stock_market_engine.engine_store import get_engine_view
+from stock_market_engine.scheduler import (
+    get_scheduler,
+    get_subscription,
+    subscribe,
+    unsubscribe,
+)
+
+
+def register_scheduler_api(app):
+    @app.on_event("startup")
+    async def start_scheduler():
+        if get_settings().scheduler_enabled:
+            get_scheduler().start(lambda: get_redis(app))
+
+    @app.on_event("shutdown")
+    async def stop_scheduler():
+        get_scheduler().stop()
+
+    @app.post("/subscribe/{engine_id}")
+    async def subscribe_engine(engine_id: uuid.UUID):
+        """Registers the engine to be advanced daily, returns the subscription id."""
+        redis = get_redis(app)
+        if not await get_engine_view(engine_id, redis):
+            return Response(status_code=HTTPStatus.NO_CONTENT.value)
+        return await subscribe(engine_id, redis)
+
+    @app.post("/unsubscribe/{subscription_id}")
+    async def unsubscribe_engine(subscription_id: uuid.UUID):
+        if not await unsubscribe(str(subscription_id), get_redis(app)):
+            raise HTTPException(
+                status_code=HTTPStatus.NOT_FOUND, detail="Unknown subscription!"
+            )
+
+    @app.get("/subscriptions/{subscription_id}")
+    async def get_subscribed_engine(subscription_id: uuid.UUID):
+        """Returns the id of the latest engine of the subscription."""
+        engine_id = await get_subscription(str(subscription_id), get_redis(app))
+        if engine_id is None:
+            raise HTTPException(
+                status_code=HTTPStatus.NOT_FOUND, detail="Unknown subscription!"
+            )
+        return engine_id
+
+    @app.post("/scheduler/run")
+    async def run_scheduler(date: datetime.date):
+        """
+        Advances the subscribed engines to the date right away, returns the new engine
+        id per subscription id. Fails when the engines are already advanced to the
+        date.
+        """
+        advanced = await get_scheduler().run(date, get_redis(app))
+        if advanced is None:
+            raise HTTPException(
+                status_code=HTTPStatus.CONFLICT,
+                detail="Engines are already advanced to the date!",
+            )
+        return advanced
@@ -1,35 +1,53 @@
+import datetime
 import json
 import uuid
 from http import HTTPStatus
+from typing import List, Literal, Optional
 
-from fastapi import Response
+from fastapi import Depends, HTTPException, Query, Response
 from stock_market.common.factory import Factory
+from stock_market.core import Sentiment
 from stock_market.ext.signal import register_signal_detector_factories
 
 import stock_market_engine.engine as eng
+from stock_market_engine.api.caching import immutable_engine, static_content
+from stock_market_engine.api.jobs import Mode, run_mutation
 from stock_market_engine.api.models import (
     SignalDetectorModel,
     SignalDetectorWithNameModel,
 )
 from stock_market_engine.common import get_redis
-from stock_market_engine.engine_store import get_engine, store_engine
+from stock_market_engine.engine_store import (
+    get_engine_hash,
+    get_engine_view,
+    get_or_create_engine,
+)
+from stock_market_engine.signal_index import (
+    SignalQuery,
+    signals_on_date,
+    signals_on_ticker,
+)
 
 
 def register_signal_api(app):
     factory = register_signal_detector_factories(Factory())
 
-    @app.get("/getsupportedsignaldetectors")
+    signal_detectors = [
+        {"detector_name": sd, "schema": factory.get_schema(sd)}
+        for sd in factory.get_registered_names()
+    ]
+
+    @app.get(
+        "/getsupportedsignaldetectors",
+        dependencies=[Depends(static_content(signal_detectors))],
+    )
     async def get_supported_signal_detectors():
-        signal_detectors = factory.get_registered_names()
-        return [
-            {"detector_name": sd, "schema": factory.get_schema(sd)}
-            for sd in signal_detectors
-        ]
+        return signal_detectors
 
-    @app.get("/signaldetectors/{engine_id}")
+    @app.get("/signaldetectors/{engine_id}", dependencies=[Depends(immutable_engine)])
     async def get_signal_detectors(engine_id: uuid.UUID):
         redis = get_redis(app)
-        engine = await get_engine(engine_id, redis)
+        engine = await get_engine_view(engine_id, redis)
         if engine is None:
             return []
 
@@ -43,47 +61,128 @@ def register_signal_api(app):
 
     @app.post("/addsignaldetector/{engine_id}")
     async def add_signal_detector(
-        engine_id: uuid.UUID, signal_detector: SignalDetectorModel
+        engine_id: uuid.UUID, signal_detector: SignalDetectorModel, mode: Mode = "sync"
     ):
         if signal_detector.static_name not in factory.get_registered_names():
             return Response(status_code=HTTPStatus.NO_CONTENT.value)
 
         redis = get_redis(app)
-        engine = await get_engine(engine_id, redis)
-        if engine is None:
+        view = await get_engine_view(engine_id, redis)
+        if view is None:
             return engine_id
 
-        engine = await eng.add_signal_detector(
-            engine,
-            factory.create(
-                signal_detector.static_name, json.dumps(signal_detector.config)
-            ),
+        detector = factory.create(
+            signal_detector.static_name, json.dumps(signal_detector.config)
         )
-        if engine is None:
+        if detector in view.signal_detectors:
+            return engine_id
+        if detector.id in [d.id for d in view.signal_detectors]:
             return engine_id
 
-        new_engine_id = await store_engine(engine, redis)
-        return str(new_engine_id)
+        async def add():
+            return await eng.add_signal_detector(await view.engine(), detector)
+
+        engine_hash = get_engine_hash(
+            view.start_date,
+            view.tickers,
+            view.signal_detectors + [detector],
+            view.date,
+        )
+        return await run_mutation(app, engine_id, engine_hash, add, mode)
 
     @app.post("/removesignaldetector/{engine_id}/{detector_id}")
     async def remove_signal_detector(engine_id: uuid.UUID, detector_id: int):
         redis = get_redis(app)
-        engine = await get_engine(engine_id, redis)
-        if engine is None:
+        view = await get_engine_view(engine_id, redis)
+        if view is None:
             return engine_id
-
-        engine = await eng.remove_signal_detector(engine, detector_id)
-        if engine is None:
+        if detector_id not in [d.id for d in view.signal_detectors]:
             return engine_id
 
-        new_engine_id = await store_engine(engine, redis)
+        async def remove():
+            return await eng.remove_signal_detector(await view.engine(), detector_id)
+
+        engine_hash = get_engine_hash(
+            view.start_date,
+            view.tickers,
+            [d for d in view.signal_detectors if d.id != detector_id],
+            view.date,
+        )
+        new_engine_id = await get_or_create_engine(
+            engine_hash, remove, redis, engine_id
+        )
         return str(new_engine_id)
 
-    @app.get("/signals/{engine_id}")
-    async def get_signals_id(engine_id: uuid.UUID):
+    @app.get("/signals/{engine_id}", dependencies=[Depends(immutable_engine)])
+    async def get_signals_id(
+        engine_id: uuid.UUID,
+        response: Response,
+        start: Optional[datetime.date] = None,
+        end: Optional[datetime.date] = None,
+        detector_id: Optional[List[int]] = Query(None),
+        sentiment: Optional[Literal["NEUTRAL", "BULLISH", "BEARISH"]] = None,
+        ticker: Optional[str] = None,
+        limit: Optional[int] = Query(None, gt=0),
+        cursor: Optional[str] = None,
+    ):
+        """
+        Returns the signals, optionally only those at or after the start date and
+        before the end date, of the given signal detectors, with the sentiment or on
+        the ticker. With a limit the signals are paged, the cursor of the next page
+        is returned in the X-Next-Cursor header.
+        """
+        try:
+            query = SignalQuery(
+                start,
+                end,
+                detector_id,
+                None if sentiment is None else Sentiment(sentiment),
+                ticker,
+                limit,
+                cursor,
+            )
+        except ValueError:
+            raise HTTPException(
+                status_code=HTTPStatus.BAD_REQUEST, detail="Invalid cursor!"
+            )
+
         redis = get_redis(app)
-        engine = await get_engine(engine_id, redis)
+        # Queries are answered by the signal index, without loading the engine
+        engine = await get_engine_view(engine_id, redis, cache=query.is_empty)
         if engine is None:
             return Response(status_code=HTTPStatus.NO_CONTENT.value)
 
-        return engine.signals.to_json()
+        if query.is_empty:
+            return (await engine.signals()).to_json()
+        signals, next_cursor = await engine.query_signals(query)
+        if next_cursor is not None:
+            response.headers["X-Next-Cursor"] = next_cursor
+        return signals.to_json()
+
+    @app.get("/signals/date/{date}")
+    async def get_signals_on_date(
+        date: datetime.date, limit: Optional[int] = Query(None, gt=0)
+    ):
+        """Returns the engines which added signals on the date, with those signals."""
+        return [
+            {"engine_id": engine_id, "signals": signals.to_json()}
+            for engine_id, signals in await signals_on_date(date, get_redis(app), limit)
+        ]
+
+    @app.get("/signals/ticker/{ticker_id}")
+    async def get_signals_on_ticker(
+        ticker_id: str,
+        start: Optional[datetime.date] = None,
+        end: Optional[datetime.date] = None,
+        limit: Optional[int] = Query(None, gt=0),
+    ):
+        """
+        Returns the engines which added signals on the ticker, optionally only at or
+        after the start date and before the end date, with those signals.
+        """
+        return [
+            {"engine_id": engine_id, "signals": signals.to_json()}
+            for engine_id, signals in await signals_on_ticker(
+                ticker_id, get_redis(app), start, end, limit
+            )
+        ]
@@ -1,80 +1,152 @@
+import datetime
 import uuid
 from http import HTTPStatus
+from typing import Literal, Optional
 
-from fastapi import Response
-from stock_market.core.ticker import Ticker
+from fastapi import Depends, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
+from stock_market.core import StockMarket, Ticker
 
 import stock_market_engine.engine as eng
+from stock_market_engine.api.caching import immutable_engine
+from stock_market_engine.api.jobs import Mode, run_mutation
 from stock_market_engine.common import get_redis
-from stock_market_engine.engine_store import get_engine, store_engine
+from stock_market_engine.engine_store import (
+    get_engine_hash,
+    get_engine_view,
+    get_or_create_engine,
+)
+from stock_market_engine.engine_view import trim_ohlc
+from stock_market_engine.ohlc_format import (
+    ARROW_MEDIA_TYPE,
+    NDJSON_MEDIA_TYPE,
+    has_arrow,
+    ohlc_arrow,
+    ohlc_ndjson,
+)
+
+
+async def __prepend(first, chunks):
+    yield first
+    async for columns in chunks:
+        yield columns
 
 
 def register_stock_market_api(app):
-    @app.get("/getdate/{engine_id}")
+    @app.get("/getdate/{engine_id}", dependencies=[Depends(immutable_engine)])
     async def get_date(engine_id: uuid.UUID):
-        engine = await get_engine(engine_id, get_redis(app))
+        engine = await get_engine_view(engine_id, get_redis(app))
         if not engine:
             return Response(status_code=HTTPStatus.NO_CONTENT.value)
         return engine.date
 
-    @app.get("/getstartdate/{engine_id}")
+    @app.get("/getstartdate/{engine_id}", dependencies=[Depends(immutable_engine)])
     async def get_start_date(engine_id: uuid.UUID):
-        engine = await get_engine(engine_id, get_redis(app))
+        engine = await get_engine_view(engine_id, get_redis(app))
         if not engine:
             return Response(status_code=HTTPStatus.NO_CONTENT.value)
-        return engine.stock_market.start_date
+        return engine.start_date
 
-    @app.get("/tickers/{engine_id}")
+    @app.get("/tickers/{engine_id}", dependencies=[Depends(immutable_engine)])
     async def get_tickers(engine_id: uuid.UUID):
-        engine = await get_engine(engine_id, get_redis(app))
+        engine = await get_engine_view(engine_id, get_redis(app))
         if not engine:
             return Response(status_code=HTTPStatus.NO_CONTENT.value)
-        return [ticker.symbol for ticker in engine.stock_market.tickers]
+        return [ticker.symbol for ticker in engine.tickers]
+
+    @app.get(
+        "/ticker/{engine_id}/{ticker_id}", dependencies=[Depends(immutable_engine)]
+    )
+    async def get_ticker_ohlc(
+        engine_id: uuid.UUID,
+        ticker_id: str,
+        response: Response,
+        start: Optional[datetime.date] = None,
+        end: Optional[datetime.date] = None,
+        limit: Optional[int] = Query(None, gt=0),
+        format: Literal["json", "ndjson", "arrow"] = "json",
+    ):
+        """
+        Returns the OHLC of the ticker, optionally only the first 'limit' values at
+        or after the start date and before the end date. The 'ndjson' and 'arrow'
+        formats stream the values in batches.
+        """
+        if format == "arrow" and not has_arrow():
+            raise HTTPException(
+                status_code=HTTPStatus.NOT_IMPLEMENTED,
+                detail="The arrow format requires pyarrow!",
+            )
 
-    @app.get("/ticker/{engine_id}/{ticker_id}")
-    async def get_ticker_ohlc(engine_id: uuid.UUID, ticker_id: str):
         redis = get_redis(app)
-        engine = await get_engine(engine_id, redis)
+        # Only the OHLC chunks in the range are loaded, unless the engine is cached
+        engine = await get_engine_view(engine_id, redis, cache=False)
 
         if not engine:
             return Response(status_code=HTTPStatus.NO_CONTENT.value)
-        ohlc = engine.stock_market.ohlc(Ticker(ticker_id))
+        if format != "json":
+            # The chunks are streamed one at a time, only the first one is loaded
+            # before responding
+            chunks = engine.ohlc_columns(Ticker(ticker_id), start, end, limit)
+            async for columns in chunks:
+                break
+            else:
+                return Response(status_code=HTTPStatus.NO_CONTENT.value)
+            encode = ohlc_ndjson if format == "ndjson" else ohlc_arrow
+            return StreamingResponse(
+                encode(__prepend(columns, chunks)),
+                media_type=(
+                    NDJSON_MEDIA_TYPE if format == "ndjson" else ARROW_MEDIA_TYPE
+                ),
+                headers=dict(response.headers),
+            )
+
+        ohlc = await engine.ohlc(Ticker(ticker_id), start, end)
+        if ohlc is not None and limit is not None and len(ohlc.dates) > limit:
+            ohlc = trim_ohlc(ohlc, end=ohlc.dates.iloc[limit])
         if ohlc is None:
             return Response(status_code=HTTPStatus.NO_CONTENT.value)
         return ohlc.to_json()
 
-    @app.get("/signals/{engine_id}")
-    async def get_signals(engine_id: uuid.UUID):
-        redis = get_redis(app)
-        engine = await get_engine(engine_id, redis)
-        if not engine:
-            return Response(status_code=HTTPStatus.NO_CONTENT.value)
-        return engine.signals.to_json()
-
     @app.post("/addticker/{engine_id}/{ticker_id}")
-    async def add_ticker(engine_id: uuid.UUID, ticker_id: str):
+    async def add_ticker(engine_id: uuid.UUID, ticker_id: str, mode: Mode = "sync"):
         redis = get_redis(app)
-        engine = await get_engine(engine_id, redis)
-        if not engine:
+        view = await get_engine_view(engine_id, redis)
+        if not view:
             return Response(status_code=HTTPStatus.NO_CONTENT.value)
         ticker = Ticker(ticker_id)
-        if ticker in engine.stock_market.tickers:
+        if ticker in view.tickers:
             return engine_id
 
-        engine = await eng.add_ticker(engine, ticker)
-        new_engine_id = await store_engine(engine, redis)
-        return str(new_engine_id)
+        async def add():
+            return await eng.add_ticker(await view.engine(), ticker)
+
+        engine_hash = get_engine_hash(
+            view.start_date, view.tickers + [ticker], view.signal_detectors, view.date
+        )
+        return await run_mutation(app, engine_id, engine_hash, add, mode)
 
     @app.post("/removeticker/{engine_id}/{ticker_id}")
     async def remove_ticker(engine_id: uuid.UUID, ticker_id: str):
         redis = get_redis(app)
-        engine = await get_engine(engine_id, redis)
-        if not engine:
+        view = await get_engine_view(engine_id, redis)
+        if not view:
             return Response(status_code=HTTPStatus.NO_CONTENT.value)
         ticker = Ticker(ticker_id)
-        if ticker not in engine.stock_market.tickers:
+        if ticker not in view.tickers:
             return engine_id
 
-        engine = await eng.remove_ticker(engine, ticker)
-        new_engine_id = await store_engine(engine, redis)
+        async def remove():
+            return await eng.remove_ticker(await view.engine(), ticker)
+
+        tickers = [t for t in view.tickers if t != ticker]
+        stock_market = StockMarket(view.start_date, tickers)
+        engine_hash = get_engine_hash(
+            view.start_date,
+            tickers,
+            [sd for sd in view.signal_detectors if sd.is_valid(stock_market)],
+            view.date,
+        )
+        new_engine_id = await get_or_create_engine(
+            engine_hash, remove, redis, engine_id
+        )
         return str(new_engine_id)
@@ -0,0 +1,167 @@
+import datetime as dt
+import weakref
+from collections.abc import Mapping
+
+import numpy as np
+from stock_market.core import StockMarket
+
+from .serialization import ohlc_from_columns, ohlc_to_columns
+
+"""
+Compact in-memory stock market. A pandas OHLC holds its dates as python objects in
+each of its four time series, a ColumnarMarket holds the dates (as days since epoch)
+and the values of each ticker as contiguous numpy arrays instead, see
+serialization.ohlc_to_columns. Tickers with the same dates share a single date
+array, and the arrays may be views on a packed buffer or memory-mapped files.
+
+Signal detectors and stock updaters use the StockMarket interface: the OHLC of a
+ticker is created from its columns on access, and shared while it is referenced.
+"""
+
+EPOCH = dt.date(1970, 1, 1)
+
+
+class OHLCColumns(Mapping):
+    """Read-only mapping of ticker to OHLC, over the OHLC columns of each ticker."""
+
+    def __init__(self, columns):
+        self.__columns = columns
+        self.__ohlcs = weakref.WeakValueDictionary()
+
+    def __getitem__(self, ticker):
+        ohlc = self.__ohlcs.get(ticker)
+        if ohlc is None:
+            ohlc = ohlc_from_columns(self.__columns[ticker])
+            self.__ohlcs[ticker] = ohlc
+        return ohlc
+
+    def __contains__(self, ticker):
+        return ticker in self.__columns
+
+    def __iter__(self):
+        return iter(self.__columns)
+
+    def __len__(self):
+        return len(self.__columns)
+
+    def copy(self):
+        return dict(self.items())
+
+    def __reduce__(self):
+        # The OHLC cache can't be pickled, it is created again on access
+        return OHLCColumns, (self.__columns,)
+
+
+class ColumnarMarket(StockMarket):
+    """
+    Stock market holding the OHLC data of each ticker as numpy columns, given as a
+    dict of ticker to [dates, open, high, low, close]. The values are converted to
+    the dtype when given, float32 halves their size at the cost of precision.
+    """
+
+    def __init__(self, start_date, tickers, ticker_columns=None, dtype=None):
+        self.__dtype = None if dtype is None else np.dtype(dtype)
+        self.__columns = {}
+        for ticker, columns in (
+            {} if ticker_columns is None else ticker_columns
+        ).items():
+            self.__columns[ticker] = self.__compact(columns)
+        super().__init__(start_date, tickers, OHLCColumns(self.__columns))
+
+    @staticmethod
+    def from_stock_market(stock_market, dtype=None):
+        if isinstance(stock_market, ColumnarMarket) and stock_market.dtype == dtype:
+            return stock_market
+        return ColumnarMarket(
+            stock_market.start_date,
+            stock_market.tickers,
+            {
+                t: market_columns(stock_market, t)
+                for t in stock_market.tickers
+                if has_ohlc(stock_market, t)
+            },
+            dtype,
+        )
+
+    @property
+    def dtype(self):
+        return self.__dtype
+
+    @property
+    def nbytes(self):
+        """The bytes of the columns, shared date arrays counted once."""
+        arrays = {id(c): c for columns in self.__columns.values() for c in columns}
+        return sum(c.nbytes for c in arrays.values())
+
+    def columns(self, ticker):
+        """Returns the OHLC columns of the ticker, None if it has no OHLC data."""
+        return self.__columns.get(ticker)
+
+    @property
+    def date(self):
+        if not self.__columns:
+            return self.start_date
+        days = max(int(columns[0][-1]) for columns in self.__columns.values())
+        return EPOCH + dt.timedelta(days=days)
+
+    def add_ticker(self, ticker):
+        assert ticker not in self.tickers
+        return self.__derive(self.tickers + [ticker], self.__columns)
+
+    def remove_ticker(self, ticker):
+        if ticker not in self.tickers:
+            return self
+        return self.__derive(
+            [t for t in self.tickers if t != ticker],
+            {t: c for t, c in self.__columns.items() if t != ticker},
+        )
+
+    def update_ticker(self, ticker_OHLC):
+        assert ticker_OHLC.ticker in self.tickers
+        columns = ohlc_to_columns(ticker_OHLC.ohlc)
+        begin = np.searchsorted(columns[0], (self.start_date - EPOCH).days)
+        if begin == len(columns[0]):
+            return self
+        return self.__derive(
+            self.tickers,
+            {**self.__columns, ticker_OHLC.ticker: [c[begin:] for c in columns]},
+        )
+
+    def __derive(self, tickers, columns):
+        return ColumnarMarket(self.start_date, tickers, columns, self.__dtype)
+
+    def __compact(self, columns):
+        dates, *values = columns
+        for other in self.__columns.values():
+            if other[0] is not dates and np.array_equal(other[0], dates):
+                dates = other[0]
+                break
+        if self.__dtype is not None:
+            values = [np.asarray(v, dtype=self.__dtype) for v in values]
+        return [dates, *values]
+
+
+def has_ohlc(stock_market, ticker):
+    """Returns whether the market has OHLC data of the ticker, without creating the
+    OHLC of a columnar market."""
+    if isinstance(stock_market, ColumnarMarket):
+        return stock_market.columns(ticker) is not None
+    return stock_market.ohlc(ticker) is not None
+
+
+def ohlc_end(stock_market, ticker):
+    """Returns the date of the last OHLC value of the ticker, None if the market has
+    no OHLC data of the ticker, without creating the OHLC of a columnar market."""
+    columns = market_columns(stock_market, ticker)
+    if columns is None or len(columns[0]) == 0:
+        return None
+    return EPOCH + dt.timedelta(days=int(columns[0][-1]))
+
+
+def market_columns(stock_market, ticker):
+    """Returns the OHLC columns of the ticker, None if the market has no OHLC data of
+    the ticker. The columns of a columnar market are returned without copying."""
+    if isinstance(stock_market, ColumnarMarket):
+        return stock_market.columns(ticker)
+    ohlc = stock_market.ohlc(ticker)
+    return None if ohlc is None else ohlc_to_columns(ohlc)
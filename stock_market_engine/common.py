@@ -1,7 +1,9 @@
 from stock_market.common.factory import Factory
-from stock_market.ext.fetcher import register_stock_updater_factories
 from stock_market.ext.signal import register_signal_detector_factories
 
+from .fetcher import register_stock_updater_factories
+from .ohlc_cache import get_ohlc_fetch_cache
+
 
 def get_redis(app):
     return app.state.redis
@@ -12,4 +14,4 @@ def get_signal_detector_factory():
 
 
 def get_stock_updater_factory():
-    return register_stock_updater_factories(Factory())
+    return register_stock_updater_factories(Factory(), get_ohlc_fetch_cache())
@@ -1,6 +1,7 @@
 import datetime as dt
 import os
 from functools import cache
+from typing import Optional
 
 from pydantic import AnyUrl, BaseSettings
 from simputils.logging import get_logger
@@ -15,9 +16,40 @@ class Settings(BaseSettings):
     redis_engine_expiration_time: dt.timedelta = dt.timedelta(
         days=os.getenv("REDIS_ENGINE_EXPIRATION_DAYS", 30)
     )
+    redis_compression: bool = os.getenv("REDIS_COMPRESSION", False)
+    redis_snapshot_interval: int = os.getenv("REDIS_SNAPSHOT_INTERVAL", 32)
     stock_updater: str = os.getenv("STOCK_UPDATER", "yahoo")
     stock_updater_config: str = os.getenv("STOCK_UPDATER_CONFIG", '""')
     max_ticker_symbol_length: int = os.getenv("MAX_TICKER_SYMBOL_LENGTH", 10)
+    metrics_server_timing: bool = os.getenv("METRICS_SERVER_TIMING", False)
+    executor: str = os.getenv("EXECUTOR", "thread")
+    executor_workers: Optional[int] = os.getenv("EXECUTOR_WORKERS")
+    engine_cache_size_mb: int = os.getenv("ENGINE_CACHE_SIZE_MB", 128)
+    engine_cache_columnar: bool = os.getenv("ENGINE_CACHE_COLUMNAR", True)
+    single_flight_timeout: dt.timedelta = dt.timedelta(
+        seconds=int(os.getenv("SINGLE_FLIGHT_TIMEOUT_SECONDS", 120))
+    )
+    single_flight_poll_interval: float = os.getenv("SINGLE_FLIGHT_POLL_INTERVAL", 0.05)
+    job_workers: int = os.getenv("JOB_WORKERS", 4)
+    job_expiration_time: dt.timedelta = dt.timedelta(
+        hours=int(os.getenv("JOB_EXPIRATION_HOURS", 24))
+    )
+    scheduler_enabled: bool = os.getenv("SCHEDULER_ENABLED", False)
+    scheduler_time: dt.time = dt.time.fromisoformat(
+        os.getenv("SCHEDULER_TIME", "22:30")
+    )
+    scheduler_concurrency: int = os.getenv("SCHEDULER_CONCURRENCY", 8)
+    scheduler_batch_size: int = os.getenv("SCHEDULER_BATCH_SIZE", 32)
+    scheduler_lock_timeout: dt.timedelta = dt.timedelta(
+        seconds=int(os.getenv("SCHEDULER_LOCK_TIMEOUT_SECONDS", 3600))
+    )
+    ohlc_fetch_cache_size_mb: int = os.getenv("OHLC_FETCH_CACHE_SIZE_MB", 64)
+    ohlc_fetch_cache_expiration_time: dt.timedelta = dt.timedelta(
+        hours=int(os.getenv("OHLC_FETCH_CACHE_EXPIRATION_HOURS", 24))
+    )
+    ohlc_fetch_cache_recent_expiration_time: dt.timedelta = dt.timedelta(
+        minutes=int(os.getenv("OHLC_FETCH_CACHE_RECENT_EXPIRATION_MINUTES", 15))
+    )
 
 
 @cache
@@ -1,7 +1,12 @@
+import asyncio
 import datetime as dt
 import json
 
-from stock_market.core import SignalSequence, StockMarket, merge_signals
+from stock_market.core import SignalSequence, StockMarket, TickerOHLC, merge_signals
+
+from .columnar_market import ColumnarMarket, has_ohlc
+from .executor import run_in_executor
+from .metrics import get_metrics, measured, timed
 
 
 class Engine:
@@ -12,33 +17,80 @@ class Engine:
         signal_detectors,
         signal_sequences=None,
         date=None,
+        detection_dates=None,
     ):
         self.__stock_market = stock_market
         self.__stock_market_updater = stock_market_updater
         self.__signal_detectors = signal_detectors
         self.__signal_sequences = signal_sequences
+        self.__detection_dates = detection_dates
 
         if signal_sequences is None:
             self.__signal_sequences = [
                 SignalSequence() for _ in range(len(self.__signal_detectors))
             ]
+        if detection_dates is None:
+            self.__detection_dates = [None] * len(self.__signal_detectors)
         self.__date = stock_market.date if date is None else date
 
+    def __detection_start(self, signal_sequence, detection_date, stock_market):
+        if detection_date is not None:
+            return detection_date + dt.timedelta(days=1)
+        # Engines stored without detection dates
+        if signal_sequence.signals:
+            return signal_sequence.signals[-1].date + dt.timedelta(days=1)
+        return stock_market.start_date
+
     async def update(self, date):
-        new_stock_market = await self.stock_market_updater.update(
-            date, self.stock_market
-        )
-        signal_sequences = []
+        return await self.detect(date, await self.fetch(date))
+
+    async def fetch(self, date):
+        """Returns the stock market of the engine updated up to the given date."""
+        with timed("fetch"):
+            return await self.stock_market_updater.update(date, self.stock_market)
 
-        for detector, signal_sequence in zip(
-            self.signal_detectors, self.signal_sequences
+    async def detect(self, date, new_stock_market):
+        """
+        Returns the engine at the given date, given its stock market updated up to
+        that date. Only detects signals after the detection date of each detector,
+        detectors which already ran detection up to the date aren't run.
+
+        The fetchers don't include the end date, the detection date of the detectors
+        is the last day of market data, at most the day before the date. Signals
+        after the detection date are detected again by the next update, once the
+        market data of their days is complete.
+        """
+        watermark = Engine.__detection_watermark(date, new_stock_market)
+        detections = []
+        detection_dates = []
+
+        for detector, signal_sequence, detection_date in zip(
+            self.signal_detectors, self.signal_sequences, self.detection_dates
         ):
-            from_date = new_stock_market.start_date
-            if signal_sequence.signals:
-                from_date = signal_sequence.signals[-1].date + dt.timedelta(days=1)
-            signal_sequences.append(
-                detector.detect(from_date, date, new_stock_market, signal_sequence)
+            if (
+                detection_date is not None
+                and detection_date >= watermark
+                and self.date >= date
+            ):
+                detections.append(self.__detected(signal_sequence))
+                detection_dates.append(detection_date)
+                continue
+
+            from_date = self.__detection_start(
+                signal_sequence, detection_date, new_stock_market
             )
+            signal_sequence = SignalSequence(
+                [s for s in signal_sequence.signals if s.date < from_date]
+            )
+            # Detectors are independent of each other, run them concurrently
+            detections.append(
+                self.__detect(
+                    detector, from_date, date, new_stock_market, signal_sequence
+                )
+            )
+            detection_dates.append(watermark)
+        with timed("detect"):
+            signal_sequences = list(await asyncio.gather(*detections))
 
         return Engine(
             new_stock_market,
@@ -46,8 +98,28 @@ class Engine:
             self.signal_detectors,
             signal_sequences,
             date,
+            detection_dates,
         )
 
+    @staticmethod
+    def __detection_watermark(date, stock_market):
+        if not any(has_ohlc(stock_market, t) for t in stock_market.tickers):
+            return stock_market.start_date - dt.timedelta(days=1)
+        # The latest day of any ticker, such that a ticker without data for a long
+        # time doesn't hold back detection
+        return min(date - dt.timedelta(days=1), stock_market.date)
+
+    @staticmethod
+    async def __detected(signal_sequence):
+        return signal_sequence
+
+    @staticmethod
+    async def __detect(detector, from_date, to_date, stock_market, signal_sequence):
+        with measured(get_metrics().detector_duration, detector.NAME()):
+            return await run_in_executor(
+                detector.detect, from_date, to_date, stock_market, signal_sequence
+            )
+
     @property
     def date(self):
         return self.__date
@@ -72,16 +144,25 @@ class Engine:
     def signal_sequences(self):
         return self.__signal_sequences
 
-    def to_json(self):
-        stock_market_updater_json = {
-            "name": self.stock_market_updater.name,
-            "config": self.stock_market_updater.to_json(),
-        }
-        signal_detectors_json = [
-            {"name": detector.NAME(), "config": detector.to_json()}
-            for detector in self.signal_detectors
-        ]
+    @property
+    def detection_dates(self):
+        """The date up to which each signal detector has run detection on complete
+        market data."""
+        return self.__detection_dates
+
+    def compact(self):
+        """Returns the engine holding its market data as numpy columns, see
+        columnar_market."""
+        return Engine(
+            ColumnarMarket.from_stock_market(self.stock_market),
+            self.stock_market_updater,
+            self.signal_detectors,
+            self.signal_sequences,
+            self.date,
+            self.detection_dates,
+        )
 
+    def to_json(self):
         return json.dumps(
             {
                 "stock_market": self.stock_market.to_json(),
@@ -89,9 +170,10 @@ class Engine:
                     signal_sequence.to_json()
                     for signal_sequence in self.signal_sequences
                 ],
-                "stock_updater": stock_market_updater_json,
-                "signal_detectors": signal_detectors_json,
+                "stock_updater": stock_updater_to_json(self.stock_market_updater),
+                "signal_detectors": signal_detectors_to_json(self.signal_detectors),
                 "date": json.dumps(self.date, default=dt.date.isoformat),
+                "detection_dates": detection_dates_to_json(self.detection_dates),
             }
         )
 
@@ -100,53 +182,137 @@ class Engine:
         json_obj = json.loads(json_str)
         engine = Engine(
             StockMarket.from_json(json_obj["stock_market"]),
-            stock_updater_factory.create(
-                json_obj["stock_updater"]["name"], json_obj["stock_updater"]["config"]
+            stock_updater_from_json(json_obj["stock_updater"], stock_updater_factory),
+            signal_detectors_from_json(
+                json_obj["signal_detectors"], signal_detector_factory
             ),
-            [
-                signal_detector_factory.create(config["name"], config["config"])
-                for config in json_obj["signal_detectors"]
-            ],
             [
                 SignalSequence.from_json(signal_sequence)
                 for signal_sequence in json_obj["signal_sequences"]
             ],
             dt.date.fromisoformat(json.loads(json_obj["date"])),
+            detection_dates_from_json(json_obj.get("detection_dates")),
         )
         return engine
 
 
+def __stock_market_until(stock_market, date):
+    ohlcs = {}
+    for ticker in stock_market.tickers:
+        ohlc = stock_market.ohlc(ticker)
+        if ohlc is not None and ohlc.start < date:
+            ohlcs[ticker] = ohlc.trim(ohlc.start, date)
+    return StockMarket(stock_market.start_date, stock_market.tickers, ohlcs)
+
+
+async def step(engine, dates):
+    """
+    Advances the engine through the given ascending dates, yielding the engine at
+    each date. The market data for all dates is fetched at once, each step only
+    detects signals on the days since the previous step. As the fetchers don't
+    include the requested end date, every step sees the market data an update
+    to its date would have fetched, and the signals on its date are detected by the
+    next step.
+    """
+    assert dates == sorted(dates), dates
+    if not dates:
+        return
+    stock_market = await engine.fetch(dates[-1])
+    for date in dates[:-1]:
+        engine = await engine.detect(date, __stock_market_until(stock_market, date))
+        yield engine
+    yield await engine.detect(dates[-1], stock_market)
+
+
+async def sweep(stock_market, stock_updater, signal_detectors, date):
+    """
+    Returns an engine at the given date for each of the signal detectors. The market
+    data is fetched once and shared, the detectors run concurrently.
+    """
+    new_stock_market = await stock_updater.update(date, stock_market)
+    return await asyncio.gather(
+        *[
+            Engine(stock_market, stock_updater, [detector]).detect(
+                date, new_stock_market
+            )
+            for detector in signal_detectors
+        ]
+    )
+
+
+def detection_dates_to_json(detection_dates):
+    return [None if d is None else d.isoformat() for d in detection_dates]
+
+
+def detection_dates_from_json(json_list):
+    if json_list is None:
+        return None
+    return [None if d is None else dt.date.fromisoformat(d) for d in json_list]
+
+
+def stock_updater_to_json(stock_updater):
+    return {"name": stock_updater.name, "config": stock_updater.to_json()}
+
+
+def stock_updater_from_json(json_obj, stock_updater_factory):
+    return stock_updater_factory.create(json_obj["name"], json_obj["config"])
+
+
+def signal_detectors_to_json(signal_detectors):
+    return [
+        {"name": detector.NAME(), "config": detector.to_json()}
+        for detector in signal_detectors
+    ]
+
+
+def signal_detectors_from_json(json_list, signal_detector_factory):
+    return [
+        signal_detector_factory.create(config["name"], config["config"])
+        for config in json_list
+    ]
+
+
 async def add_ticker(engine, ticker):
+    """Adds the ticker, only fetching the OHLC data of the added ticker."""
+    stock_market = engine.stock_market
+    fetched = await engine.stock_market_updater.update(
+        engine.date, StockMarket(stock_market.start_date, [ticker])
+    )
+    stock_market = stock_market.add_ticker(ticker)
+    if fetched.ohlc(ticker) is not None:
+        stock_market = stock_market.update_ticker(
+            TickerOHLC(ticker, fetched.ohlc(ticker))
+        )
+
     new_engine = Engine(
-        engine.stock_market.add_ticker(ticker),
+        stock_market,
         engine.stock_market_updater,
         engine.signal_detectors,
         engine.signal_sequences,
         engine.date,
+        engine.detection_dates,
     )
-
-    new_engine = await new_engine.update(engine.date)
-    return new_engine
+    return await new_engine.detect(engine.date, stock_market)
 
 
 async def remove_ticker(engine, ticker):
+    """Removes the ticker and the signal detectors which need it, without fetching
+    or detecting."""
     stock_market = engine.stock_market.remove_ticker(ticker)
+    valid = [sd.is_valid(stock_market) for sd in engine.signal_detectors]
     new_engine = Engine(
         stock_market,
         engine.stock_market_updater,
-        [sd for sd in engine.signal_detectors if sd.is_valid(stock_market)],
-        [
-            ss
-            for i, ss in enumerate(engine.signal_sequences)
-            if engine.signal_detectors[i].is_valid(stock_market)
-        ],
+        [sd for i, sd in enumerate(engine.signal_detectors) if valid[i]],
+        [ss for i, ss in enumerate(engine.signal_sequences) if valid[i]],
         engine.date,
+        [d for i, d in enumerate(engine.detection_dates) if valid[i]],
     )
-    new_engine = await new_engine.update(engine.date)
     return new_engine
 
 
 async def add_signal_detector(engine, detector):
+    """Adds the signal detector and detects its signals, without fetching."""
     assert detector.is_valid(engine.stock_market), (detector, engine.stock_market)
     if detector in engine.signal_detectors:
         return None
@@ -160,12 +326,14 @@ async def add_signal_detector(engine, detector):
         detectors,
         engine.signal_sequences + [SignalSequence()],
         engine.date,
+        engine.detection_dates + [None],
     )
-    new_engine = await new_engine.update(engine.date)
-    return new_engine
+    # Only the added detector detects, on the stock market of the engine
+    return await new_engine.detect(engine.date, engine.stock_market)
 
 
 async def remove_signal_detector(engine, detector_id):
+    """Removes the signal detector, without fetching or detecting."""
     ids = [d.id for d in engine.signal_detectors]
     if detector_id not in ids:
         return None
@@ -174,12 +342,14 @@ async def remove_signal_detector(engine, detector_id):
     del detectors[i]
     sequences = engine.signal_sequences.copy()
     del sequences[i]
+    detection_dates = engine.detection_dates.copy()
+    del detection_dates[i]
     new_engine = Engine(
         engine.stock_market,
         engine.stock_market_updater,
         detectors,
         sequences,
         engine.date,
+        detection_dates,
     )
-    new_engine = await new_engine.update(engine.date)
     return new_engine
@@ -0,0 +1,101 @@
+import time
+from collections import OrderedDict
+from functools import cache
+
+from .columnar_market import ColumnarMarket
+from .config import get_settings
+
+# Measured memory usage of a deserialized OHLC row (four pandas time series)
+OHLC_ROW_SIZE = 240
+SIGNAL_SIZE = 512
+ENGINE_SIZE = 4096
+
+
+def estimate_ohlc_size(ohlc):
+    """Estimates the memory usage in bytes of an OHLC, 0 for None."""
+    return 0 if ohlc is None else len(ohlc.dates) * OHLC_ROW_SIZE
+
+
+def estimate_engine_size(engine):
+    """Estimates the memory usage in bytes of a deserialized engine."""
+    stock_market = engine.stock_market
+    if isinstance(stock_market, ColumnarMarket):
+        ohlc_size = stock_market.nbytes
+    else:
+        ohlc_size = sum(
+            estimate_ohlc_size(stock_market.ohlc(t)) for t in stock_market.tickers
+        )
+    signals = sum(len(sequence.signals) for sequence in engine.signal_sequences)
+    return ENGINE_SIZE + ohlc_size + signals * SIGNAL_SIZE
+
+
+class EngineCache:
+    """
+    Per process LRU cache of deserialized engines, bounded by their estimated size.
+    An engine id always refers to the same engine, so entries never need to be
+    invalidated and every worker process can keep its own cache. Entries expire
+    together with the stored engine. Columnar caches hold the market data of the
+    engines as numpy columns, see columnar_market.
+    """
+
+    def __init__(self, max_size, columnar=False):
+        self.__max_size = max_size
+        self.__columnar = columnar
+        self.__entries = OrderedDict()
+        self.__size = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def size(self):
+        return self.__size
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def clear(self):
+        self.__entries.clear()
+        self.__size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, engine_id):
+        entry = self.__entries.get(str(engine_id))
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                self.__remove(str(engine_id))
+            self.misses += 1
+            return None
+        self.__entries.move_to_end(str(engine_id))
+        self.hits += 1
+        return entry[2]
+
+    def put(self, engine_id, engine, expiration_time):
+        """Caches the engine for at most the given expiration time (in seconds)."""
+        if self.__columnar:
+            engine = engine.compact()
+        size = estimate_engine_size(engine)
+        if size > self.__max_size:
+            return
+        self.__remove(str(engine_id))
+        self.__entries[str(engine_id)] = (
+            time.monotonic() + expiration_time,
+            size,
+            engine,
+        )
+        self.__size += size
+        while self.__size > self.__max_size:
+            self.__remove(next(iter(self.__entries)))
+
+    def __remove(self, engine_id):
+        entry = self.__entries.pop(engine_id, None)
+        if entry is not None:
+            self.__size -= entry[1]
+
+
+@cache
+def get_engine_cache():
+    settings = get_settings()
+    return EngineCache(
+        settings.engine_cache_size_mb * 1024 * 1024, settings.engine_cache_columnar
+    )
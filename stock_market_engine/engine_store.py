@@ -1,50 +1,550 @@
+import asyncio
 import hashlib
 import json
 import uuid
 
 from simputils.logging import get_logger
+from stock_market.core import SignalSequence
 
+from .columnar_market import has_ohlc, market_columns
 from .common import get_signal_detector_factory, get_stock_updater_factory
 from .config import get_settings
-from .engine import Engine
+from .engine import Engine, detection_dates_from_json, signal_detectors_to_json
+from .engine_cache import get_engine_cache
+from .engine_view import EngineView, engine_metadata
+from .executor import run_in_executor
+from .lineage import get_lineage, lineage, lineage_key, publish_successor
+from .metrics import payload_size, record_size, timed
+from .ohlc_store import (
+    chunks_in_range,
+    load_ohlc_columns,
+    load_ohlcs,
+    ohlc_delta_chunks,
+    store_chunks,
+)
+from .signal_index import (
+    index_engine_signals,
+    query_signal_indexes,
+    signal_owner,
+    signals_after,
+    store_signal_indexes,
+)
+from .single_flight import get_single_flight
 
 logger = get_logger(__name__)
 
+"""
+An engine is stored as separately addressable parts:
+ - '<engine id>': the engine metadata (dates, tickers, updater and detectors), which
+   references the OHLC chunks of each ticker with their years and row counts (see
+   ohlc_store), and the signal parts of each signal detector with their lengths
+ - 'signals:<hash>': content addressed parts of the signal sequences, indexed by
+   date under 'signals:<hash>:index' (see signal_index)
+ - '<engine id>:lineage': the parent and root of the engine (see lineage)
+An engine derived from a parent engine is stored as a delta: it references the OHLC
+chunks and signal parts of its parent, and only adds the bars and signals appended
+since. A sequence of parts is merged again after REDIS_SNAPSHOT_INTERVAL deltas, so
+reading an engine stays a single MGET of its parts. The signals of each engine are
+indexed across engines under 'signals:date:<date>' and 'signals:ticker:<symbol>',
+an engine continuing the signal owner of its parent only indexes the signals after
+the detection dates of its parent (see signal_index).
+Engines stored with a single '<engine id>:signals:<index>' key per signal sequence,
+or as a single json blob under the engine id are supported for reading.
+"""
 
-def __get_hash(engine):
+
+def __signals_key(engine_id, index):
+    return f"{engine_id}:signals:{index}"
+
+
+def __signal_part(signals):
+    data = SignalSequence(signals).to_json().encode("utf-8")
+    return f"signals:{hashlib.sha256(data).hexdigest()}", data
+
+
+def __signal_parts(signal_sequence, parent_parts, snapshot_interval):
+    """
+    Splits the signal sequence in the parts of the sequence it was derived from,
+    followed by a part with the signals appended since, given the (key, length) of
+    the parent parts. Returns a list of (key, data, length).
+    """
+    signals = signal_sequence.signals
+    parts = []
+    begin = 0
+    if len(parent_parts) < snapshot_interval:
+        for key, length in parent_parts:
+            end = begin + length
+            part_key, data = __signal_part(signals[begin:end])
+            if end > len(signals) or part_key != key:
+                parts = []
+                begin = 0
+                break
+            parts.append((key, data, length))
+            begin = end
+    if begin < len(signals) or not parts:
+        parts.append((*__signal_part(signals[begin:]), len(signals) - begin))
+    return parts
+
+
+def __parent_ohlc_chunks(parent_metadata, ticker):
+    """Returns the (year, key, row count) of the OHLC chunks of the ticker in the
+    parent engine."""
+    if parent_metadata is None or "ohlc_rows" not in parent_metadata:
+        return []
+    symbol = ticker.symbol
+    if symbol not in parent_metadata["ohlc"]:
+        return []
+    return list(
+        zip(
+            parent_metadata["ohlc_years"][symbol],
+            parent_metadata["ohlc"][symbol],
+            parent_metadata["ohlc_rows"][symbol],
+        )
+    )
+
+
+def __parent_signal_parts(parent_metadata, signal_detector):
+    """Returns the (key, length) of the signal parts of the signal detector in the
+    parent engine."""
+    if parent_metadata is None or "signals" not in parent_metadata:
+        return []
+    signal_detectors = parent_metadata["signal_detectors"]
+    if signal_detector not in signal_detectors:
+        return []
+    i = signal_detectors.index(signal_detector)
+    return list(
+        zip(parent_metadata["signals"][i], parent_metadata["signal_lengths"][i])
+    )
+
+
+def __parent_signal_owner(parent_metadata):
+    """Returns the signal owner of the parent engine, None if its signals aren't
+    indexed with an owner."""
+    if parent_metadata is None or not parent_metadata.get("signal_index"):
+        return None
+    return parent_metadata.get("signal_owner")
+
+
+async def __index_signals(owner, engine, parent_metadata, redis):
+    """
+    Indexes the signals of the engine across engines under its signal owner, returns
+    the written members. When the engine continues the owner of its parent, only the
+    signals after the detection date of each signal detector in the parent are
+    indexed, and the signals the parent detected after it which the engine no longer
+    has are removed.
+    """
+    expiration_time = get_settings().redis_engine_expiration_time
+    if owner != __parent_signal_owner(parent_metadata):
+        return await index_engine_signals(
+            owner, engine.signals.signals, [], redis, expiration_time
+        )
+
+    detectors = signal_detectors_to_json(engine.signal_detectors)
+    parent_detectors = parent_metadata["signal_detectors"]
+    parent_dates = detection_dates_from_json(
+        parent_metadata.get("detection_dates")
+    ) or [None] * len(parent_detectors)
+    added = []
+    removed = []
+    for i, detector in enumerate(parent_detectors):
+        # All signals of removed signal detectors are removed
+        date = parent_dates[i] if detector in detectors else None
+        signals = []
+        if detector in detectors:
+            signals = engine.signal_sequences[detectors.index(detector)].signals
+            signals = [s for s in signals if date is None or s.date > date]
+        kept = {s.to_json() for s in signals}
+        removed.extend(
+            s
+            for s in await signals_after(parent_metadata["signals"][i], date, redis)
+            if s.to_json() not in kept
+        )
+        added.extend(signals)
+    for detector, sequence in zip(detectors, engine.signal_sequences):
+        if detector not in parent_detectors:
+            added.extend(sequence.signals)
+    return await index_engine_signals(owner, added, removed, redis, expiration_time)
+
+
+def get_engine_hash(start_date, tickers, signal_detectors, date):
+    """Returns the hash identifying the engine state with the given properties."""
     hash_components = {}
-    hash_components["start_date"] = engine.stock_market.start_date.isoformat()
-    hash_components["tickers"] = [t.to_json() for t in engine.stock_market.tickers]
-    hash_components["signal_detectors"] = [
-        sd.to_json() for sd in engine.signal_detectors
-    ]
-    hash_components["end_date"] = engine.date.isoformat()
+    hash_components["start_date"] = start_date.isoformat()
+    hash_components["tickers"] = [t.to_json() for t in sorted(tickers)]
+    hash_components["signal_detectors"] = [sd.to_json() for sd in signal_detectors]
+    hash_components["end_date"] = date.isoformat()
     return hashlib.md5(json.dumps(hash_components).encode("utf-8")).hexdigest()
 
 
-async def store_engine(engine, redis):
+def __get_hash(engine):
+    return get_engine_hash(
+        engine.stock_market.start_date,
+        engine.stock_market.tickers,
+        engine.signal_detectors,
+        engine.date,
+    )
+
+
+async def __find_engine(engine_hash, redis):
+    engine_id = await redis.get(engine_hash)
+    if engine_id is None or not await redis.exists(engine_id):
+        return None
+    engine_id = engine_id.decode("utf-8")
+    logger.debug(f"Cache hit for engine modification! id: '{engine_id}'")
+    return engine_id
+
+
+async def __publish_successor(parent_id, engine_id, redis):
+    if parent_id is not None and str(parent_id) != str(engine_id):
+        await publish_successor(await get_lineage(parent_id, redis), engine_id, redis)
+
+
+async def store_engine(engine, redis, parent_id=None):
+    """
+    Stores the engine, returns its id. The engine is stored once, storing an engine
+    that is already stored returns the id of the stored one. When the engine is
+    derived from the engine with the given parent id, it is added to the lineage of
+    the parent and published as its successor.
+    """
     assert engine is not None
 
     engine_hash = __get_hash(engine)
-    engine_id = await redis.get(engine_hash)
+    engine_id = await __find_engine(engine_hash, redis)
     if engine_id is not None:
-        stored_engine = await get_engine(engine_id, redis)
-        if stored_engine is not None:
-            logger.debug(f"Cache hit for engine modification! id: '{engine_id}'")
-            return engine_id
+        await __publish_successor(parent_id, engine_id, redis)
+        return engine_id
+
+    parent_lineage = None
+    parent_metadata = None
+    if parent_id is not None:
+        parent_lineage = await get_lineage(parent_id, redis)
+        with timed("redis"):
+            parent_metadata = __parts_metadata(await redis.get(str(parent_id)))
 
     random_id = uuid.uuid4()
-    await redis.set(
-        str(random_id), engine.to_json(), get_settings().redis_engine_expiration_time
+    settings = get_settings()
+    expiration_time = settings.redis_engine_expiration_time
+    metadata = engine_metadata(engine)
+    with timed("redis"):
+        owner = await signal_owner(
+            random_id,
+            parent_id,
+            __parent_signal_owner(parent_metadata),
+            redis,
+            expiration_time,
+        )
+    metadata["signal_owner"] = owner
+    metadata["ohlc"] = {}
+    metadata["ohlc_years"] = {}
+    metadata["ohlc_rows"] = {}
+    chunks = {}
+    stock_market = engine.stock_market
+    tickers = [t for t in stock_market.tickers if has_ohlc(stock_market, t)]
+    with timed("serialize"):
+        for ticker, ticker_chunks in zip(
+            tickers,
+            await asyncio.gather(
+                *[
+                    run_in_executor(
+                        ohlc_delta_chunks,
+                        market_columns(stock_market, t),
+                        __parent_ohlc_chunks(parent_metadata, t),
+                        settings.redis_compression,
+                        settings.redis_snapshot_interval,
+                    )
+                    for t in tickers
+                ]
+            ),
+        ):
+            symbol = ticker.symbol
+            metadata["ohlc"][symbol] = [key for _, key, _, _ in ticker_chunks]
+            metadata["ohlc_years"][symbol] = [y for y, _, _, _ in ticker_chunks]
+            metadata["ohlc_rows"][symbol] = [rows for _, _, _, rows in ticker_chunks]
+            chunks.update({key: data for _, key, data, _ in ticker_chunks})
+
+        signal_parts = [
+            __signal_parts(
+                signal_sequence,
+                __parent_signal_parts(parent_metadata, signal_detector),
+                settings.redis_snapshot_interval,
+            )
+            for signal_sequence, signal_detector in zip(
+                engine.signal_sequences, metadata["signal_detectors"]
+            )
+        ]
+        metadata["signals"] = [[key for key, _, _ in parts] for parts in signal_parts]
+        metadata["signal_lengths"] = [
+            [length for _, _, length in parts] for parts in signal_parts
+        ]
+        metadata["signal_index"] = True
+        chunks.update({key: data for parts in signal_parts for key, data, _ in parts})
+        indexed_parts = {}
+        for signal_sequence, parts in zip(engine.signal_sequences, signal_parts):
+            begin = 0
+            for key, _, length in parts:
+                end = begin + length
+                indexed_parts[key] = signal_sequence.signals[begin:end]
+                begin = end
+        metadata = json.dumps(metadata)
+
+    with timed("redis"):
+        written = await store_chunks(chunks, redis, expiration_time)
+        index_members = await store_signal_indexes(
+            indexed_parts, redis, expiration_time
+        )
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.set(
+                lineage_key(random_id),
+                json.dumps(lineage(random_id, parent_lineage)),
+                expiration_time,
+            )
+            pipe.set(str(random_id), metadata, expiration_time)
+            await pipe.execute()
+        await redis.set(engine_hash, str(random_id), expiration_time)
+        index_members += await __index_signals(owner, engine, parent_metadata, redis)
+    record_size(
+        "write",
+        payload_size([metadata, *[chunks[key] for key in written], *index_members]),
     )
-    await redis.set(engine_hash, str(random_id))
+    get_engine_cache().put(random_id, engine, expiration_time.total_seconds())
+    if parent_lineage is not None:
+        await publish_successor(parent_lineage, random_id, redis)
     return random_id
 
 
-async def get_engine(engine_id, redis):
-    engine_json = await redis.get(str(engine_id))
-    if engine_json is None:
+async def get_or_create_engine(engine_hash, create_engine, redis, parent_id=None):
+    """
+    Returns the id of the stored engine created by the 'create_engine' coroutine,
+    given the hash of the engine it creates. If such an engine is already stored,
+    its id is returned without creating the engine. Concurrent calls for the same
+    engine hash, also from other workers, create and store the engine only once.
+    The engine is published as successor of the given parent, see store_engine.
+    """
+    engine_id = await __find_engine(engine_hash, redis)
+    if engine_id is not None:
+        await __publish_successor(parent_id, engine_id, redis)
+        return engine_id
+
+    async def create_and_store():
+        engine_id = await __find_engine(engine_hash, redis)
+        if engine_id is not None:
+            await __publish_successor(parent_id, engine_id, redis)
+            return engine_id
+        return await store_engine(await create_engine(), redis, parent_id)
+
+    return await get_single_flight().run(engine_hash, create_and_store, redis)
+
+
+async def store_engines(engines, redis):
+    """
+    Stores the engines through get_or_create_engine, returns their ids. Identical
+    engines, also when stored concurrently by other calls, are stored once.
+    """
+
+    def created(engine):
+        async def create_engine():
+            return engine
+
+        return create_engine
+
+    return await asyncio.gather(
+        *[get_or_create_engine(__get_hash(e), created(e), redis) for e in engines]
+    )
+
+
+async def get_engine_view(engine_id, redis, cache=True):
+    """
+    Returns a read-only view on the stored engine, None if it doesn't exist. Unless
+    the engine is cached already, it is loaded and cached, see get_engine. Without
+    cache the view is lazily loaded instead, only the parts read from it are loaded.
+    """
+    if cache:
+        engine = await get_engine(engine_id, redis)
+        return None if engine is None else EngineView.from_engine(engine)
+    engine = get_engine_cache().get(engine_id)
+    if engine is not None:
+        return EngineView.from_engine(engine)
+    return await __get_engine_view(engine_id, redis)
+
+
+async def get_engine_views(engine_ids, redis, load_signals=False, cache=True):
+    """
+    Returns the views on the stored engines, None for the engines that don't exist.
+    The engines which are not cached are loaded with a single MGET and, with cache,
+    cached. With load_signals the signal sequences of all engines are loaded
+    upfront, with a single MGET as well.
+    """
+    views = {}
+    for engine_id in engine_ids:
+        engine = get_engine_cache().get(engine_id)
+        if engine is not None:
+            views[engine_id] = EngineView.from_engine(engine)
+
+    missing = [engine_id for engine_id in engine_ids if engine_id not in views]
+    data = {}
+    if missing:
+        with timed("redis"):
+            data = dict(zip(missing, await redis.mget([str(i) for i in missing])))
+        record_size("read", payload_size(data.values()))
+    signal_data = {}
+    if load_signals:
+        metadata = {i: __parts_metadata(engine_data) for i, engine_data in data.items()}
+        signal_keys = {
+            engine_id: [
+                key
+                for keys in __signals_keys(engine_id, engine_metadata)
+                for key in keys
+            ]
+            for engine_id, engine_metadata in metadata.items()
+            if engine_metadata is not None
+        }
+        keys = [key for keys in signal_keys.values() for key in keys]
+        with timed("redis"):
+            values = await redis.mget(keys) if keys else []
+        record_size("read", payload_size(values))
+        values = iter(values)
+        for engine_id, keys in signal_keys.items():
+            signal_data[engine_id] = [next(values) for _ in keys]
+
+    with timed("deserialize"):
+        loaded = {
+            engine_id: __engine_view(
+                engine_id, engine_data, redis, signal_data.get(engine_id)
+            )
+            for engine_id, engine_data in data.items()
+        }
+    loaded = {i: view for i, view in loaded.items() if view is not None}
+    if not cache:
+        return [views.get(engine_id, loaded.get(engine_id)) for engine_id in engine_ids]
+    for engine_id, engine in zip(loaded, await __cache_engines(loaded, redis)):
+        views[engine_id] = EngineView.from_engine(engine)
+    return [views.get(engine_id) for engine_id in engine_ids]
+
+
+async def __cache_engines(views, redis):
+    """Materializes the engines of the views, given by engine id, and caches them
+    until the stored engines expire. Returns the engines."""
+    engines = await asyncio.gather(*[view.engine() for view in views.values()])
+    if not engines:
+        return engines
+    async with redis.pipeline(transaction=False) as pipe:
+        for engine_id in views:
+            pipe.ttl(str(engine_id))
+        expiration_times = await pipe.execute()
+    for engine_id, engine, expiration_time in zip(views, engines, expiration_times):
+        if expiration_time > 0:
+            get_engine_cache().put(engine_id, engine, expiration_time)
+    return engines
+
+
+def __parts_metadata(data):
+    """Returns the metadata of an engine stored in parts, None for other data."""
+    if data is None:
         return None
-    return Engine.from_json(
-        engine_json, get_stock_updater_factory(), get_signal_detector_factory()
+    metadata = json.loads(data)
+    return None if "stock_market" in metadata else metadata
+
+
+def __signals_keys(engine_id, metadata):
+    """Returns the keys of the parts of each signal sequence."""
+    if "signals" in metadata:
+        return metadata["signals"]
+    return [
+        [__signals_key(engine_id, i)] for i in range(len(metadata["signal_detectors"]))
+    ]
+
+
+def __signal_sequences(signal_keys, values):
+    """Returns the signal sequences, given the keys of the parts of each sequence and
+    the values of all keys."""
+    values = iter(values)
+    return [
+        SignalSequence(
+            [s for _ in keys for s in SignalSequence.from_json(next(values)).signals]
+        )
+        for keys in signal_keys
+    ]
+
+
+async def __get_engine_view(engine_id, redis):
+    with timed("redis"):
+        data = await redis.get(str(engine_id))
+    record_size("read", payload_size([data]))
+    with timed("deserialize"):
+        return __engine_view(engine_id, data, redis)
+
+
+def __engine_view(engine_id, data, redis, signal_data=None):
+    """Returns the view on the engine stored as the given data. The signal sequences
+    of an engine stored in parts are parsed from signal_data when given."""
+    if data is None:
+        return None
+
+    metadata = json.loads(data)
+    if "stock_market" in metadata:  # engine stored as a single json blob
+        return EngineView.from_engine(
+            Engine.from_json(
+                data,
+                get_stock_updater_factory(),
+                get_signal_detector_factory(),
+            )
+        )
+
+    async def load_ticker_ohlcs(tickers, start=None, end=None):
+        chunk_years = metadata.get("ohlc_years", {})
+        chunk_keys = {
+            t: chunks_in_range(
+                metadata["ohlc"][t.symbol], chunk_years.get(t.symbol), start, end
+            )
+            for t in tickers
+        }
+        return await load_ohlcs(chunk_keys, redis)
+
+    def load_ticker_ohlc_columns(ticker, start=None, end=None):
+        chunk_keys = chunks_in_range(
+            metadata["ohlc"][ticker.symbol],
+            metadata.get("ohlc_years", {}).get(ticker.symbol),
+            start,
+            end,
+        )
+        return load_ohlc_columns(chunk_keys, redis)
+
+    async def load_signal_sequences():
+        signal_keys = __signals_keys(engine_id, metadata)
+        values = signal_data
+        if values is None:
+            keys = [key for keys in signal_keys for key in keys]
+            with timed("redis"):
+                values = await redis.mget(keys) if keys else []
+            record_size("read", payload_size(values))
+        with timed("deserialize"):
+            return __signal_sequences(signal_keys, values)
+
+    async def query_signals(detector_ids, query):
+        return await query_signal_indexes(
+            metadata["signals"], metadata["signal_lengths"], detector_ids, query, redis
+        )
+
+    return EngineView(
+        metadata,
+        load_ticker_ohlcs,
+        load_signal_sequences,
+        get_stock_updater_factory(),
+        get_signal_detector_factory(),
+        query_signals if metadata.get("signal_index") else None,
+        load_ticker_ohlc_columns,
     )
+
+
+async def get_engine(engine_id, redis):
+    """Returns the stored engine, None if it doesn't exist. The engine is cached
+    until it expires, see engine_cache."""
+    engine = get_engine_cache().get(engine_id)
+    if engine is not None:
+        return engine
+
+    view = await __get_engine_view(engine_id, redis)
+    if view is None:
+        return None
+    (engine,) = await __cache_engines({engine_id: view}, redis)
+    return engine
@@ -0,0 +1,264 @@
+import datetime as dt
+
+import numpy as np
+from stock_market.core import SignalSequence, StockMarket, Ticker, merge_signals
+
+from .columnar_market import EPOCH, has_ohlc, market_columns
+from .engine import (
+    Engine,
+    detection_dates_from_json,
+    detection_dates_to_json,
+    signal_detectors_from_json,
+    signal_detectors_to_json,
+    stock_updater_from_json,
+    stock_updater_to_json,
+)
+from .serialization import ohlc_to_columns
+from .signal_index import SignalQuery, query_signal_sequences
+
+
+class EngineView:
+    """
+    Read-only view on a stored engine.
+    Only the engine metadata is parsed upfront, OHLC data and signal sequences are
+    loaded on first access through the given asynchronous loaders. Signal queries
+    are answered by the optional signal query loader, without loading the signal
+    sequences. The optional OHLC columns loader streams the stored OHLC data of a
+    ticker a chunk at a time.
+    """
+
+    def __init__(
+        self,
+        metadata,
+        ohlc_loader,
+        signal_sequences_loader,
+        stock_updater_factory,
+        signal_detector_factory,
+        signal_query_loader=None,
+        ohlc_columns_loader=None,
+    ):
+        self.__metadata = metadata
+        self.__ohlc_loader = ohlc_loader
+        self.__ohlc_columns_loader = ohlc_columns_loader
+        self.__signal_sequences_loader = signal_sequences_loader
+        self.__signal_query_loader = signal_query_loader
+        self.__stock_updater_factory = stock_updater_factory
+        self.__signal_detector_factory = signal_detector_factory
+        self.__ohlcs = {}
+        self.__signal_sequences = None
+        self.__signal_detectors = None
+        self.__stock_market_updater = None
+
+    @staticmethod
+    def from_engine(engine):
+        """Creates a view on an already deserialized engine."""
+
+        async def load_ohlcs(tickers, start=None, end=None):
+            return {t: engine.stock_market.ohlc(t) for t in tickers}
+
+        async def load_ohlc_columns(ticker, start=None, end=None):
+            columns = market_columns(engine.stock_market, ticker)
+            if columns is not None:
+                yield columns
+
+        async def load_signal_sequences():
+            return engine.signal_sequences
+
+        view = EngineView(
+            engine_metadata(engine),
+            load_ohlcs,
+            load_signal_sequences,
+            None,
+            None,
+            ohlc_columns_loader=load_ohlc_columns,
+        )
+        view.__signal_detectors = engine.signal_detectors
+        view.__stock_market_updater = engine.stock_market_updater
+        return view
+
+    @property
+    def metadata(self):
+        return self.__metadata
+
+    @property
+    def date(self):
+        return dt.date.fromisoformat(self.__metadata["date"])
+
+    @property
+    def start_date(self):
+        return dt.date.fromisoformat(self.__metadata["start_date"])
+
+    @property
+    def tickers(self):
+        return [Ticker(symbol) for symbol in self.__metadata["tickers"]]
+
+    @property
+    def stock_market_updater(self):
+        if self.__stock_market_updater is None:
+            self.__stock_market_updater = stock_updater_from_json(
+                self.__metadata["stock_updater"], self.__stock_updater_factory
+            )
+        return self.__stock_market_updater
+
+    @property
+    def signal_detectors(self):
+        if self.__signal_detectors is None:
+            self.__signal_detectors = signal_detectors_from_json(
+                self.__metadata["signal_detectors"], self.__signal_detector_factory
+            )
+        return self.__signal_detectors
+
+    async def ohlc(self, ticker, start=None, end=None):
+        """
+        Returns the OHLC of the ticker, optionally trimmed to the values at or after
+        the start date and before the end date. Unless the whole OHLC is loaded
+        already, only the stored data overlapping the range is loaded.
+        """
+        if (start is None and end is None) or ticker in self.__ohlcs:
+            ohlc = (await self.__load_ohlcs([ticker])).get(ticker)
+        elif ticker.symbol in set(self.__metadata["ohlc"]):
+            ohlc = (await self.__ohlc_loader([ticker], start, end)).get(ticker)
+        else:
+            ohlc = None
+        return trim_ohlc(ohlc, start, end)
+
+    async def ohlc_columns(self, ticker, start=None, end=None, limit=None):
+        """
+        Yields the OHLC of the ticker as columns (see serialization.ohlc_to_columns),
+        trimmed like ohlc and optionally to its first 'limit' values. Unless the
+        whole OHLC is loaded already, the stored data overlapping the range is
+        loaded and yielded a chunk at a time.
+        """
+        if self.__ohlc_columns_loader is None or ticker in self.__ohlcs:
+            ohlc = await self.ohlc(ticker, start, end)
+            chunks = self.__single(None if ohlc is None else ohlc_to_columns(ohlc))
+        elif ticker.symbol in set(self.__metadata["ohlc"]):
+            chunks = self.__ohlc_columns_loader(ticker, start, end)
+        else:
+            return
+        async for columns in chunks:
+            columns = trim_columns(columns, start, end)
+            if limit is not None:
+                columns = [c[:limit] for c in columns]
+                limit -= len(columns[0])
+            if len(columns[0]):
+                yield columns
+            if limit == 0:
+                return
+
+    async def stock_market(self):
+        ohlcs = await self.__load_ohlcs(self.tickers)
+        return StockMarket(
+            self.start_date,
+            self.tickers,
+            {t: ohlc for t, ohlc in ohlcs.items() if ohlc is not None},
+        )
+
+    async def signal_sequences(self):
+        if self.__signal_sequences is None:
+            self.__signal_sequences = await self.__signal_sequences_loader()
+        return self.__signal_sequences
+
+    async def signals(self):
+        return merge_signals(*await self.signal_sequences())
+
+    async def query_signals(self, query):
+        """Returns the signals matching the signal query and the cursor of the next
+        page, None if there is no next page."""
+        detector_ids = [d.id for d in self.signal_detectors]
+        if self.__signal_query_loader is None or self.__signal_sequences is not None:
+            return query_signal_sequences(
+                await self.signal_sequences(), detector_ids, query
+            )
+        return await self.__signal_query_loader(detector_ids, query)
+
+    async def engine(self):
+        """Materializes the full engine."""
+        return Engine(
+            await self.stock_market(),
+            self.stock_market_updater,
+            self.signal_detectors,
+            await self.signal_sequences(),
+            self.date,
+            detection_dates_from_json(self.__metadata.get("detection_dates")),
+        )
+
+    @staticmethod
+    async def __single(columns):
+        if columns is not None:
+            yield columns
+
+    async def __load_ohlcs(self, tickers):
+        stored = set(self.__metadata["ohlc"])
+        missing = [t for t in tickers if t not in self.__ohlcs and t.symbol in stored]
+        if missing:
+            self.__ohlcs.update(await self.__ohlc_loader(missing))
+        return {t: self.__ohlcs.get(t) for t in tickers}
+
+
+async def added_signals(parent, view):
+    """
+    Returns the signals the engine of the view added compared to the engine of the
+    parent view. Only the signals after the detection date of each signal detector
+    in the parent are compared, read from the signal indexes of lazy views.
+    """
+    if parent is None:
+        return await view.signals()
+    parent_detectors = parent.metadata["signal_detectors"]
+    parent_dates = detection_dates_from_json(
+        parent.metadata.get("detection_dates")
+    ) or [None] * len(parent_detectors)
+    sequences = []
+    for detector, detector_json in zip(
+        view.signal_detectors, view.metadata["signal_detectors"]
+    ):
+        start = None
+        parent_signals = set()
+        if detector_json in parent_detectors:
+            date = parent_dates[parent_detectors.index(detector_json)]
+            start = None if date is None else date + dt.timedelta(days=1)
+            signals, _ = await parent.query_signals(
+                SignalQuery(start, None, [detector.id])
+            )
+            parent_signals = {s.to_json() for s in signals.signals}
+        signals, _ = await view.query_signals(SignalQuery(start, None, [detector.id]))
+        sequences.append(
+            SignalSequence(
+                [s for s in signals.signals if s.to_json() not in parent_signals]
+            )
+        )
+    return merge_signals(*sequences)
+
+
+def engine_metadata(engine):
+    """Returns the json serializable engine data, without OHLC data and signals."""
+    stock_market = engine.stock_market
+    return {
+        "start_date": stock_market.start_date.isoformat(),
+        "date": engine.date.isoformat(),
+        "tickers": [t.symbol for t in stock_market.tickers],
+        "ohlc": [t.symbol for t in stock_market.tickers if has_ohlc(stock_market, t)],
+        "stock_updater": stock_updater_to_json(engine.stock_market_updater),
+        "signal_detectors": signal_detectors_to_json(engine.signal_detectors),
+        "detection_dates": detection_dates_to_json(engine.detection_dates),
+    }
+
+
+def trim_columns(columns, start=None, end=None):
+    """Trims the OHLC columns like trim_ohlc, without copying the values."""
+    dates = columns[0]
+    begin = 0 if start is None else np.searchsorted(dates, (start - EPOCH).days)
+    stop = len(dates) if end is None else np.searchsorted(dates, (end - EPOCH).days)
+    return [c[begin:stop] for c in columns]
+
+
+def trim_ohlc(ohlc, start=None, end=None):
+    """Trims the OHLC to the values at or after the start date and before the end
+    date, returns None if no values remain."""
+    if ohlc is None or (start is None and end is None):
+        return ohlc
+    start = ohlc.start if start is None else start
+    end = ohlc.end + dt.timedelta(days=1) if end is None else end
+    if start >= end:
+        return None
+    return ohlc.trim(start, end)
@@ -0,0 +1,62 @@
+import asyncio
+import pickle
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import cache
+
+from simputils.logging import get_logger
+
+from .config import get_settings
+
+logger = get_logger(__name__)
+
+
+@cache
+def get_executor():
+    """
+    Returns the pool running CPU bound work (signal detection and engine
+    (de)serialization) off the event loop, as configured by EXECUTOR:
+    'thread', 'process' or 'none' to run the work on the event loop.
+    """
+    settings = get_settings()
+    if settings.executor == "thread":
+        return ThreadPoolExecutor(settings.executor_workers)
+    if settings.executor == "process":
+        return ProcessPoolExecutor(settings.executor_workers)
+    assert settings.executor == "none", settings.executor
+    return None
+
+
+def shutdown_executor():
+    executor = get_executor()
+    if executor is not None:
+        executor.shutdown()
+    get_executor.cache_clear()
+
+
+async def run_in_executor(func, *args):
+    executor = get_executor()
+    if executor is None:
+        return func(*args)
+    if isinstance(executor, ProcessPoolExecutor):
+        # The work is pickled once, the pool only copies the bytes
+        work = __pickled(func, args)
+        if work is None:
+            return func(*args)
+        func, args = __run_pickled, (work,)
+    # Exceptions raised by the work itself propagate
+    return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+
+
+def __pickled(func, args):
+    """Returns the pickled work, None if the work can't be sent to another process,
+    not all work can (e.g. local functions)."""
+    try:
+        return pickle.dumps((func, args), pickle.HIGHEST_PROTOCOL)
+    except (pickle.PicklingError, AttributeError, TypeError) as e:
+        logger.debug(f"Running {func} on the event loop, it can't be pickled: {e}")
+        return None
+
+
+def __run_pickled(work):
+    func, args = pickle.loads(work)
+    return func(*args)
@@ -0,0 +1,177 @@
+import os
+from functools import lru_cache, partial
+
+import pandas as pd
+from stock_market.common.json_mixins import SingleAttributeJsonMixin
+from stock_market.core import OHLC, OHLCFetcher, StockUpdater
+from stock_market.ext.fetcher import ProxyOHLCFetcher, YahooOHLCFetcher
+
+from .local_store import get_local_market_store
+from .serialization import ohlc_from_columns
+
+
+@lru_cache(maxsize=None)
+def _read_csv(path):
+    data = pd.read_csv(path, parse_dates=["Date"]).dropna()
+    data.Date = data.Date.dt.date
+    return data
+
+
+class CsvOHLCFetcher(OHLCFetcher, SingleAttributeJsonMixin):
+    """
+    Fetches OHLC data from '<symbol>.csv' files in the given directory, as downloaded
+    from Yahoo Finance. Like the Yahoo fetcher, the end date is not included.
+    """
+
+    JSON_ATTRIBUTE_NAME = "data_dir"
+    JSON_ATTRIBUTE_TYPE = "string"
+
+    def __init__(self, data_dir):
+        super().__init__("csv")
+        self.data_dir = data_dir
+
+    def fetch_single(self, start, end, ticker):
+        path = os.path.join(self.data_dir, f"{ticker.symbol}.csv")
+        if not os.path.isfile(path):
+            return None
+        data = _read_csv(path)
+        data = data.loc[(data.Date >= start) & (data.Date < end)]
+        if len(data) == 0:
+            return None
+        return OHLC(
+            data.Date.reset_index(drop=True),
+            data.Open.reset_index(drop=True),
+            data.High.reset_index(drop=True),
+            data.Low.reset_index(drop=True),
+            data["Adj Close"].reset_index(drop=True),
+        )
+
+    async def fetch_ohlc(self, requests):
+        return [
+            (ticker, self.fetch_single(start_date, end_date, ticker))
+            for start_date, end_date, ticker in requests
+        ]
+
+    def __eq__(self, other):
+        if not isinstance(other, CsvOHLCFetcher):
+            return False
+        return self.data_dir == other.data_dir
+
+
+class LocalOHLCFetcher(OHLCFetcher, SingleAttributeJsonMixin):
+    """
+    Fetches OHLC data from the local market data store in the given directory, see
+    local_store. The end date is not included.
+    """
+
+    JSON_ATTRIBUTE_NAME = "store_dir"
+    JSON_ATTRIBUTE_TYPE = "string"
+
+    def __init__(self, store_dir):
+        super().__init__("local")
+        self.store_dir = store_dir
+
+    def fetch_single(self, start, end, ticker):
+        store = get_local_market_store(self.store_dir)
+        columns = store.columns(ticker.symbol, start, end)
+        return None if columns is None else ohlc_from_columns(columns)
+
+    async def fetch_ohlc(self, requests):
+        return [
+            (ticker, self.fetch_single(start_date, end_date, ticker))
+            for start_date, end_date, ticker in requests
+        ]
+
+    def __eq__(self, other):
+        if not isinstance(other, LocalOHLCFetcher):
+            return False
+        return self.store_dir == other.store_dir
+
+
+class LocalStockUpdater(StockUpdater):
+    """
+    Updates stock markets from the local market data store of the given local
+    fetcher. The updated market is a ColumnarMarket over the memory-mapped columns
+    of the store, its market data isn't copied.
+    """
+
+    def __init__(self, fetcher):
+        super().__init__(fetcher)
+        self.__fetcher = fetcher
+
+    async def update(self, date, stock_market):
+        store = get_local_market_store(self.__fetcher.store_dir)
+        return store.stock_market(stock_market.start_date, stock_market.tickers, date)
+
+
+class CachedOHLCFetcher(OHLCFetcher):
+    """Fetches OHLC data through the given cache, which is shared by all engines."""
+
+    def __init__(self, fetcher, cache):
+        super().__init__(fetcher.name)
+        self.__fetcher = fetcher
+        self.__cache = cache
+
+    @property
+    def fetcher(self):
+        return self.__fetcher
+
+    async def fetch_ohlc(self, requests):
+        if not requests:
+            return []
+        return await self.__cache.fetch(self.__fetcher, requests)
+
+    def to_json(self):
+        return self.__fetcher.to_json()
+
+    def __eq__(self, other):
+        if isinstance(other, CachedOHLCFetcher):
+            other = other.fetcher
+        return self.__fetcher == other
+
+
+class PrefetchedOHLCFetcher(OHLCFetcher):
+    """
+    Serves OHLC data fetched upfront, given per ticker as the (start date, end date,
+    OHLC) it was fetched for. Only requests within the fetched range are supported.
+    """
+
+    def __init__(self, name, ohlcs):
+        super().__init__(name)
+        self.__ohlcs = ohlcs
+
+    async def fetch_ohlc(self, requests):
+        results = []
+        for start_date, end_date, ticker in requests:
+            fetched_start, fetched_end, ohlc = self.__ohlcs[ticker]
+            assert fetched_start <= start_date and end_date <= fetched_end, ticker
+            if ohlc is not None:
+                ohlc = ohlc.trim(start_date, end_date)
+            results.append((ticker, ohlc))
+        return results
+
+
+def __create_stock_updater(fetcher_type, cache, config):
+    return StockUpdater(CachedOHLCFetcher(fetcher_type.from_json(config), cache))
+
+
+def __create_local_stock_updater(config):
+    # The store is read without copying, caching its data would only duplicate it
+    return LocalStockUpdater(LocalOHLCFetcher.from_json(config))
+
+
+def register_stock_updater_factories(factory, cache):
+    for name, fetcher_type in [
+        ("yahoo", YahooOHLCFetcher),
+        ("proxy", ProxyOHLCFetcher),
+        ("csv", CsvOHLCFetcher),
+    ]:
+        factory.register(
+            name,
+            partial(__create_stock_updater, fetcher_type, cache),
+            fetcher_type.json_schema(),
+        )
+    factory.register(
+        "local", __create_local_stock_updater, LocalOHLCFetcher.json_schema()
+    )
+    return factory
@@ -0,0 +1,102 @@
+import asyncio
+import json
+from functools import cache
+
+from simputils.logging import get_logger
+
+from .config import get_settings
+
+logger = get_logger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+def __job_key(job_id):
+    return f"job:{job_id}"
+
+
+async def get_job(job_id, redis):
+    """Returns the status of the job, None if the job is unknown."""
+    job = await redis.get(__job_key(job_id))
+    return None if job is None else json.loads(job)
+
+
+async def set_job(job_id, redis, expiration_time, status, **fields):
+    await redis.set(
+        __job_key(job_id), json.dumps({"status": status, **fields}), expiration_time
+    )
+
+
+class JobQueue:
+    """
+    Runs jobs in the background on a pool of worker tasks. The status and result of
+    each job is stored in Redis, such that every worker process can report it.
+    A job is identified by the given id, jobs which are queued, running or done
+    aren't submitted again. Jobs aren't persisted: a job queued or running in a
+    worker process that stops is reported as such until its status expires.
+    """
+
+    def __init__(self, workers, expiration_time):
+        self.__worker_count = workers
+        self.__expiration_time = expiration_time
+        self.__loop = None
+        self.__queue = None
+        self.__workers = []
+
+    async def submit(self, job_id, work, redis):
+        """Queues the 'work' coroutine function as job, returns the job id."""
+        job = await get_job(job_id, redis)
+        if job is not None and job["status"] != FAILED:
+            logger.debug(f"Job '{job_id}' is already {job['status']}")
+            return job_id
+
+        await set_job(job_id, redis, self.__expiration_time, QUEUED)
+        self.__start()
+        self.__queue.put_nowait((job_id, work, redis))
+        return job_id
+
+    def stop(self):
+        for worker in self.__workers:
+            worker.cancel()
+        self.__workers = []
+        self.__loop = None
+
+    def __start(self):
+        loop = asyncio.get_running_loop()
+        if self.__loop is loop:
+            return
+        self.stop()
+        self.__loop = loop
+        self.__queue = asyncio.Queue()
+        self.__workers = [
+            asyncio.ensure_future(self.__work(self.__queue))
+            for _ in range(self.__worker_count)
+        ]
+
+    async def __work(self, queue):
+        while True:
+            job_id, work, redis = await queue.get()
+            try:
+                await set_job(job_id, redis, self.__expiration_time, RUNNING)
+                result = await work()
+                await set_job(
+                    job_id, redis, self.__expiration_time, DONE, result=result
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception(f"Job '{job_id}' failed")
+                await set_job(
+                    job_id, redis, self.__expiration_time, FAILED, error=str(e)
+                )
+            finally:
+                queue.task_done()
+
+
+@cache
+def get_job_queue():
+    settings = get_settings()
+    return JobQueue(settings.job_workers, settings.job_expiration_time)
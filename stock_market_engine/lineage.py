@@ -0,0 +1,57 @@
+import json
+
+"""
+Engines derived from each other form a lineage, identified by the id of its first
+engine: the root. The parent and root of each stored engine are stored under
+'<engine id>:lineage'. Whenever an engine is derived from another one, the ids of
+both engines are published on the channel of their lineage.
+"""
+
+KEEPALIVE_INTERVAL = 15
+
+
+def lineage_key(engine_id):
+    return f"{engine_id}:lineage"
+
+
+def lineage_channel(root_id):
+    return f"lineage:{root_id}"
+
+
+def lineage(engine_id, parent_lineage=None):
+    """Returns the lineage of the engine, given the lineage of its parent if any."""
+    if parent_lineage is None:
+        return {"parent": None, "root": str(engine_id)}
+    return {"parent": parent_lineage["id"], "root": parent_lineage["root"]}
+
+
+async def get_lineage(engine_id, redis):
+    """Returns the id, parent and root of the engine. Engines stored without lineage
+    are the root of their own lineage."""
+    data = await redis.get(lineage_key(engine_id))
+    engine_lineage = lineage(engine_id) if data is None else json.loads(data)
+    return {"id": str(engine_id), **engine_lineage}
+
+
+async def publish_successor(parent_lineage, engine_id, redis):
+    await redis.publish(
+        lineage_channel(parent_lineage["root"]),
+        json.dumps({"engine_id": str(engine_id), "parent_id": parent_lineage["id"]}),
+    )
+
+
+async def lineage_events(root_id, redis, keepalive_interval=KEEPALIVE_INTERVAL):
+    """
+    Yields the events published on the lineage, with the ids of the new engine and
+    its parent, until closed. Yields None when no event is published for the
+    keepalive interval.
+    """
+    pubsub = redis.pubsub()
+    await pubsub.subscribe(lineage_channel(root_id))
+    try:
+        while True:
+            message = await pubsub.get_message(True, timeout=keepalive_interval)
+            yield None if message is None else json.loads(message["data"])
+    finally:
+        await pubsub.unsubscribe()
+        await pubsub.close()
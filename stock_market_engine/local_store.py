@@ -0,0 +1,208 @@
+import datetime as dt
+import glob
+import json
+import os
+import shutil
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+from stock_market.core import Ticker
+
+from .columnar_market import EPOCH, ColumnarMarket, market_columns
+
+"""
+Local market data store: the OHLC columns of each symbol (dates as days since epoch,
+open, high, low, close, see serialization.ohlc_to_columns) saved as '.npy' files and
+memory-mapped read-only when read. Worker processes reading the same store share its
+pages through the OS page cache, and date ranges are sliced without copying. The
+'local' stock updater (see fetcher.LocalStockUpdater) updates engines to columnar
+markets over these slices.
+
+Layout of the store directory:
+ - manifest.json: per symbol the version of its columns and where they came from
+ - <symbol>/<version>/{dates,open,high,low,close}.npy
+
+Column files are never modified. A write saves new versions of the columns, then
+atomically replaces the manifest and finally removes the old versions, readers which
+mapped those keep reading them. At most one writer may update a store at a time.
+"""
+
+MANIFEST = "manifest.json"
+COLUMN_NAMES = ["dates", "open", "high", "low", "close"]
+
+
+class LocalMarketStore:
+    """Reads and writes the local market data store in the given directory."""
+
+    def __init__(self, store_dir):
+        self.__store_dir = store_dir
+        self.__manifest_stat = None
+        self.__manifest = {}
+        self.__columns = {}
+
+    @property
+    def store_dir(self):
+        return self.__store_dir
+
+    def symbols(self):
+        return sorted(self.__read_manifest())
+
+    def columns(self, symbol, start=None, end=None):
+        """
+        Returns the memory-mapped OHLC columns of the symbol from the start date up to
+        the end date, which is excluded. Returns None if the symbol is not stored.
+        """
+        entry = self.__read_manifest().get(symbol)
+        if entry is None:
+            return None
+        key = (symbol, entry["version"])
+        columns = self.__columns.get(key)
+        if columns is None:
+            version_dir = self.__version_dir(symbol, entry["version"])
+            columns = [
+                np.load(os.path.join(version_dir, f"{name}.npy"), mmap_mode="r")
+                for name in COLUMN_NAMES
+            ]
+            self.__columns = {k: c for k, c in self.__columns.items() if k[0] != symbol}
+            self.__columns[key] = columns
+        dates = columns[0]
+        begin = 0 if start is None else np.searchsorted(dates, (start - EPOCH).days)
+        stop = len(dates) if end is None else np.searchsorted(dates, (end - EPOCH).days)
+        return [c[begin:stop] for c in columns]
+
+    def stock_market(self, start_date, tickers, end_date=None):
+        """
+        Returns a stock market of the tickers with their stored data from the start
+        date up to the end date, excluded. The columns are not copied.
+        """
+        ticker_columns = {}
+        for ticker in tickers:
+            columns = self.columns(ticker.symbol, start_date, end_date)
+            if columns is not None and len(columns[0]) > 0:
+                ticker_columns[ticker] = columns
+        return ColumnarMarket(start_date, tickers, ticker_columns)
+
+    def ingest_csv(self, data_dir):
+        """
+        Stores the data of the '<symbol>.csv' files in the directory, as downloaded
+        from Yahoo Finance, which changed since they were last ingested. Returns the
+        updated symbols.
+        """
+        manifest = self.__read_manifest()
+        updates = {}
+        for path in sorted(glob.glob(os.path.join(data_dir, "*.csv"))):
+            symbol = os.path.basename(path).removesuffix(".csv")
+            source = LocalMarketStore.__csv_source(path)
+            if manifest.get(symbol, {}).get("csv") == source:
+                continue
+            updates[symbol] = (
+                LocalMarketStore.__read_csv_columns(path),
+                {"csv": source},
+            )
+        self.write(updates)
+        return sorted(updates)
+
+    def write(self, updates):
+        """Stores the columns of the symbols, given as dict of symbol to (columns,
+        description of their source). The description is a json serializable dict,
+        merged into the manifest entry of the symbol."""
+        if not updates:
+            return
+        manifest = dict(self.__read_manifest())
+        for symbol, (columns, source) in updates.items():
+            version = manifest.get(symbol, {}).get("version", 0) + 1
+            version_dir = self.__version_dir(symbol, version)
+            os.makedirs(version_dir, exist_ok=True)
+            for name, column in zip(COLUMN_NAMES, columns):
+                dtype = np.int64 if name == "dates" else np.float64
+                np.save(
+                    os.path.join(version_dir, f"{name}.npy"),
+                    np.ascontiguousarray(column, dtype=dtype),
+                )
+            manifest[symbol] = {
+                **manifest.get(symbol, {}),
+                **source,
+                "version": version,
+            }
+
+        path = os.path.join(self.__store_dir, MANIFEST)
+        with open(f"{path}.tmp", "w") as manifest_file:
+            json.dump(manifest, manifest_file, indent=1, sort_keys=True)
+        os.replace(f"{path}.tmp", path)
+
+        for symbol in updates:
+            current = str(manifest[symbol]["version"])
+            symbol_dir = os.path.join(self.__store_dir, symbol)
+            for version in os.listdir(symbol_dir):
+                if version != current:
+                    shutil.rmtree(os.path.join(symbol_dir, version))
+
+    @staticmethod
+    def __read_csv_columns(path):
+        data = pd.read_csv(path, parse_dates=["Date"]).dropna()
+        dates = data.Date.values.astype("datetime64[D]").astype(np.int64)
+        return [dates] + [
+            data[c].to_numpy(np.float64) for c in ["Open", "High", "Low", "Adj Close"]
+        ]
+
+    @staticmethod
+    def __csv_source(path):
+        stat = os.stat(path)
+        return {
+            "path": os.path.abspath(path),
+            "size": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+        }
+
+    def __version_dir(self, symbol, version):
+        return os.path.join(self.__store_dir, symbol, str(version))
+
+    def __read_manifest(self):
+        """Returns the manifest, read again when it was replaced."""
+        try:
+            stat = os.stat(os.path.join(self.__store_dir, MANIFEST))
+        except FileNotFoundError:
+            return {}
+        stat = (stat.st_ino, stat.st_mtime_ns)
+        if stat != self.__manifest_stat:
+            with open(os.path.join(self.__store_dir, MANIFEST)) as manifest_file:
+                self.__manifest = json.load(manifest_file)
+            self.__manifest_stat = stat
+        return self.__manifest
+
+
+async def refresh_local_store(store, stock_updater, date):
+    """
+    Fetches the data of the stored symbols after their last stored date up to the
+    date, which is excluded, with the stock updater. Symbols without stored data are
+    fetched from the first date of the other symbols. Returns the updated symbols.
+    """
+    tickers = [Ticker(symbol) for symbol in store.symbols()]
+    ticker_columns = {t: store.columns(t.symbol) for t in tickers}
+    ticker_columns = {t: c for t, c in ticker_columns.items() if len(c[0]) > 0}
+    if not ticker_columns:
+        return []
+    start = EPOCH + dt.timedelta(
+        days=int(min(columns[0][0] for columns in ticker_columns.values()))
+    )
+    updated = await stock_updater.update(
+        date, ColumnarMarket(start, tickers, ticker_columns)
+    )
+
+    updates = {}
+    for ticker in tickers:
+        updated_columns = market_columns(updated, ticker)
+        if updated_columns is None:
+            continue
+        rows = len(ticker_columns[ticker][0]) if ticker in ticker_columns else 0
+        if len(updated_columns[0]) > rows:
+            source = {"stock_updater": stock_updater.name, "date": date.isoformat()}
+            updates[ticker.symbol] = (updated_columns, source)
+    store.write(updates)
+    return sorted(updates)
+
+
+@lru_cache(maxsize=None)
+def get_local_market_store(store_dir):
+    return LocalMarketStore(store_dir)
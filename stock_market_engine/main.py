@@ -1,17 +1,37 @@
 import datetime
+import time
 import uuid
 from http import HTTPStatus
 
-from fastapi import FastAPI, HTTPException, Response
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import PlainTextResponse
 
 from .api import (
     EngineModel,
+    Mode,
+    StepModel,
+    SweepModel,
+    register_batch_api,
     register_indicator_api,
+    register_job_api,
+    register_lineage_api,
+    register_scheduler_api,
     register_signal_api,
     register_stock_market_api,
+    run_mutation,
 )
 from .common import get_redis, get_signal_detector_factory, get_stock_updater_factory
-from .engine_store import get_engine, store_engine
+from .config import get_settings
+from .engine import step, sweep
+from .engine_store import (
+    get_engine_hash,
+    get_engine_view,
+    store_engine,
+    store_engines,
+)
+from .executor import shutdown_executor
+from .metrics import get_metrics, record_request, request_metrics
+from .ohlc_cache import get_ohlc_fetch_cache
 from .redis import init_redis_pool
 
 app = FastAPI(title="Stock Market Engine")
@@ -20,6 +40,31 @@ app = FastAPI(title="Stock Market Engine")
 @app.on_event("startup")
 async def startup_event():
     app.state.redis = init_redis_pool()
+    get_ohlc_fetch_cache().bind_redis(lambda: get_redis(app))
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    shutdown_executor()
+
+
+@app.middleware("http")
+async def measure_request(request: Request, call_next):
+    start = time.perf_counter()
+    with request_metrics() as metrics:
+        response = await call_next(request)
+    endpoint = request.scope.get("endpoint")
+    if endpoint is not None:
+        record_request(endpoint.__name__, time.perf_counter() - start, metrics)
+    if get_settings().metrics_server_timing and metrics.durations:
+        response.headers["Server-Timing"] = metrics.server_timing()
+    return response
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics_text():
+    """Returns the metrics in the Prometheus text format."""
+    return get_metrics().expose()
 
 
 @app.post("/create")
@@ -32,20 +77,90 @@ async def create_engine(engine_config: EngineModel):
             status_code=HTTPStatus.BAD_REQUEST, detail="Incorrect engine configuration!"
         )
 
-    engine_id = await store_engine(engine, get_redis(app))
+    (engine_id,) = await store_engines([engine], get_redis(app))
     return str(engine_id)
 
 
 @app.post("/update/{engine_id}")
-async def update_engine(engine_id: uuid.UUID, date: datetime.date):
-    engine = await get_engine(engine_id, get_redis(app))
-    if not engine:
+async def update_engine(engine_id: uuid.UUID, date: datetime.date, mode: Mode = "sync"):
+    redis = get_redis(app)
+    view = await get_engine_view(engine_id, redis)
+    if not view:
         return Response(status_code=HTTPStatus.NO_CONTENT.value)
-    new_engine = await engine.update(date)
-    engine_id = await store_engine(new_engine, get_redis(app))
-    return str(engine_id)
+
+    async def update():
+        engine = await view.engine()
+        return await engine.update(date)
+
+    engine_hash = get_engine_hash(
+        view.start_date, view.tickers, view.signal_detectors, date
+    )
+    return await run_mutation(app, engine_id, engine_hash, update, mode)
+
+
+@app.post("/step/{engine_id}")
+async def step_engine(engine_id: uuid.UUID, steps: StepModel):
+    """
+    Advances the engine through multiple dates at once, returns the id of the engine
+    at each date. The id is null for dates which aren't checkpoints.
+    """
+    redis = get_redis(app)
+    view = await get_engine_view(engine_id, redis)
+    if not view:
+        return Response(status_code=HTTPStatus.NO_CONTENT.value)
+
+    dates = steps.get_dates()
+    if not dates or dates[0] <= view.date:
+        raise HTTPException(
+            status_code=HTTPStatus.BAD_REQUEST,
+            detail="Steps need to be after the engine date!",
+        )
+
+    result = []
+    parent_id = engine_id
+    async for engine in step(await view.engine(), dates):
+        engine_id = None
+        if steps.is_checkpoint(engine.date) or engine.date == dates[-1]:
+            engine_id = parent_id = await store_engine(engine, redis, parent_id)
+            engine_id = str(engine_id)
+        result.append({"date": engine.date, "engine_id": engine_id})
+    return result
+
+
+@app.post("/sweep")
+async def sweep_signal_detectors(sweep_config: SweepModel):
+    """
+    Runs each signal detector configuration on the same stock market, up to the
+    given date. Returns the signals of each configuration and, when requested, the
+    id of its stored engine.
+    """
+    stock_market = sweep_config.stock_market.create()
+    detectors = sweep_config.create_signal_detectors(get_signal_detector_factory())
+    if not detectors or any(
+        d is None or not d.is_valid(stock_market) for d in detectors
+    ):
+        raise HTTPException(
+            status_code=HTTPStatus.BAD_REQUEST,
+            detail="Incorrect signal detector configuration!",
+        )
+
+    stock_updater = sweep_config.create_stock_updater(get_stock_updater_factory())
+    engines = await sweep(stock_market, stock_updater, detectors, sweep_config.date)
+    engine_ids = [None] * len(engines)
+    if sweep_config.store_engines:
+        engine_ids = [
+            str(engine_id) for engine_id in await store_engines(engines, get_redis(app))
+        ]
+    return [
+        {"signals": engine.signal_sequences[0].to_json(), "engine_id": engine_id}
+        for engine, engine_id in zip(engines, engine_ids)
+    ]
 
 
+register_batch_api(app)
 register_indicator_api(app)
+register_job_api(app)
+register_lineage_api(app)
+register_scheduler_api(app)
 register_signal_api(app)
 register_stock_market_api(app)
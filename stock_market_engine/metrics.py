@@ -0,0 +1,231 @@
+import contextvars
+import time
+from contextlib import contextmanager
+from functools import cache
+
+from .engine_cache import get_engine_cache
+
+"""
+Minimal instrumentation layer: histograms of phase durations and payload sizes,
+exposed in the Prometheus text format.
+
+Phases timed during a request are accumulated in the request context and recorded
+with the endpoint label once the endpoint is known, at the end of the request.
+"""
+
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (1e3, 1e4, 1e5, 1e6, 1e7, 1e8)
+
+__request_metrics = contextvars.ContextVar("request_metrics", default=None)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    labels = ",".join(f'{n}="{v}"' for n, v in zip(names, values))
+    return f"{{{labels}}}"
+
+
+def _format_value(value):
+    return repr(float(value)) if value != float("inf") else "+Inf"
+
+
+class Histogram:
+    def __init__(self, name, documentation, label_names, buckets):
+        self.__name = name
+        self.__documentation = documentation
+        self.__label_names = tuple(label_names)
+        self.__buckets = tuple(buckets) + (float("inf"),)
+        self.__series = {}
+
+    @property
+    def name(self):
+        return self.__name
+
+    def observe(self, value, *label_values):
+        assert len(label_values) == len(self.__label_names), label_values
+        series = self.__series.get(label_values)
+        if series is None:
+            series = self.__series[label_values] = [0] * len(self.__buckets) + [0.0]
+        for i, bucket in enumerate(self.__buckets):
+            if value <= bucket:
+                series[i] += 1
+        series[-1] += value
+
+    def expose(self):
+        lines = [
+            f"# HELP {self.__name} {self.__documentation}",
+            f"# TYPE {self.__name} histogram",
+        ]
+        for label_values, series in sorted(self.__series.items()):
+            for bucket, count in zip(self.__buckets, series):
+                labels = _format_labels(
+                    self.__label_names + ("le",),
+                    label_values + (_format_value(bucket),),
+                )
+                lines.append(f"{self.__name}_bucket{labels} {count}")
+            labels = _format_labels(self.__label_names, label_values)
+            lines.append(f"{self.__name}_sum{labels} {_format_value(series[-1])}")
+            lines.append(f"{self.__name}_count{labels} {series[-2]}")
+        return lines
+
+
+class Gauge:
+    """Gauge reporting the value of the given function when exposed."""
+
+    def __init__(self, name, documentation, function, type="gauge"):
+        self.__name = name
+        self.__documentation = documentation
+        self.__function = function
+        self.__type = type
+
+    @property
+    def name(self):
+        return self.__name
+
+    def expose(self):
+        return [
+            f"# HELP {self.__name} {self.__documentation}",
+            f"# TYPE {self.__name} {self.__type}",
+            f"{self.__name} {_format_value(self.__function())}",
+        ]
+
+
+class Metrics:
+    def __init__(self):
+        self.request_duration = Histogram(
+            "sme_request_duration_seconds",
+            "Duration of the requests per endpoint.",
+            ["endpoint"],
+            DURATION_BUCKETS,
+        )
+        self.phase_duration = Histogram(
+            "sme_phase_duration_seconds",
+            "Duration of the phases (redis, serialize, deserialize, fetch, detect) of"
+            " the requests per endpoint.",
+            ["endpoint", "phase"],
+            DURATION_BUCKETS,
+        )
+        self.payload_size = Histogram(
+            "sme_payload_bytes",
+            "Size of the data read from and written to Redis per endpoint.",
+            ["endpoint", "phase"],
+            SIZE_BUCKETS,
+        )
+        self.detector_duration = Histogram(
+            "sme_detector_duration_seconds",
+            "Duration of the signal detection per signal detector.",
+            ["detector"],
+            DURATION_BUCKETS,
+        )
+        self.fetcher_duration = Histogram(
+            "sme_fetcher_duration_seconds",
+            "Duration of the OHLC fetches per fetcher.",
+            ["fetcher"],
+            DURATION_BUCKETS,
+        )
+        self.__metrics = [
+            self.request_duration,
+            self.phase_duration,
+            self.payload_size,
+            self.detector_duration,
+            self.fetcher_duration,
+            Gauge(
+                "sme_engine_cache_hits_total",
+                "Engine cache hits.",
+                lambda: get_engine_cache().hits,
+                "counter",
+            ),
+            Gauge(
+                "sme_engine_cache_misses_total",
+                "Engine cache misses.",
+                lambda: get_engine_cache().misses,
+                "counter",
+            ),
+            Gauge(
+                "sme_engine_cache_size_bytes",
+                "Estimated size of the cached engines.",
+                lambda: get_engine_cache().size,
+            ),
+        ]
+
+    def expose(self):
+        lines = [line for metric in self.__metrics for line in metric.expose()]
+        return "\n".join(lines) + "\n"
+
+
+@cache
+def get_metrics():
+    return Metrics()
+
+
+class RequestMetrics:
+    """The durations and payload sizes of the phases of a single request."""
+
+    def __init__(self):
+        self.durations = {}
+        self.sizes = {}
+
+    def server_timing(self):
+        return ", ".join(
+            f"{phase};dur={duration * 1000:.1f}"
+            for phase, duration in self.durations.items()
+        )
+
+
+@contextmanager
+def request_metrics():
+    """Collects the phases timed within the context as a RequestMetrics."""
+    metrics = RequestMetrics()
+    token = __request_metrics.set(metrics)
+    try:
+        yield metrics
+    finally:
+        __request_metrics.reset(token)
+
+
+def record_request(endpoint, duration, request):
+    metrics = get_metrics()
+    metrics.request_duration.observe(duration, endpoint)
+    for phase, phase_duration in request.durations.items():
+        metrics.phase_duration.observe(phase_duration, endpoint, phase)
+    for phase, size in request.sizes.items():
+        metrics.payload_size.observe(size, endpoint, phase)
+
+
+@contextmanager
+def timed(phase):
+    """Times the phase, as part of the current request if any."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        metrics = __request_metrics.get()
+        if metrics is None:
+            get_metrics().phase_duration.observe(duration, "", phase)
+        else:
+            metrics.durations[phase] = metrics.durations.get(phase, 0) + duration
+
+
+@contextmanager
+def measured(histogram, *label_values):
+    """Records the duration of the context in the histogram."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - start, *label_values)
+
+
+def record_size(phase, size):
+    """Records the size of the data read or written in the phase."""
+    metrics = __request_metrics.get()
+    if metrics is None:
+        get_metrics().payload_size.observe(size, "", phase)
+    else:
+        metrics.sizes[phase] = metrics.sizes.get(phase, 0) + size
+
+
+def payload_size(values):
+    return sum(len(value) for value in values if value is not None)
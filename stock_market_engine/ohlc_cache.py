@@ -0,0 +1,182 @@
+import asyncio
+import datetime as dt
+import hashlib
+import time
+from collections import OrderedDict
+from functools import cache
+
+from simputils.logging import get_logger
+
+from .config import get_settings
+from .engine_cache import estimate_ohlc_size
+from .metrics import get_metrics, measured
+from .ohlc_store import ohlc_from_chunks, ohlc_to_chunk
+
+logger = get_logger(__name__)
+
+
+class OHLCFetchCache:
+    """
+    Cache of fetched OHLC data shared by all engines, keyed by fetcher, ticker and
+    requested date range. Lookups go through an in-process LRU tier bounded by the
+    estimated size of its OHLC data, then through a Redis tier shared by all
+    workers. Concurrent misses for the same key are
+    coalesced into a single fetch.
+    Ranges ending today or later, and ranges without data, expire sooner as their
+    data can still change.
+    """
+
+    NO_DATA = b"null"
+    # Estimated memory usage of an entry besides its OHLC data
+    ENTRY_SIZE = 256
+
+    def __init__(self, max_size, expiration_time, recent_expiration_time):
+        self.__max_size = max_size
+        self.__expiration_time = expiration_time
+        self.__recent_expiration_time = recent_expiration_time
+        self.__local = OrderedDict()
+        self.__size = 0
+        self.__in_flight = {}
+        self.__redis_getter = None
+
+    @property
+    def size(self):
+        return self.__size
+
+    def bind_redis(self, redis_getter):
+        """Enables the Redis tier, using the redis connection of the given getter."""
+        self.__redis_getter = redis_getter
+
+    async def fetch(self, fetcher, requests):
+        """Fetches the OHLC data for the given (start date, end date, ticker)
+        requests, only calling the given fetcher on a cache miss."""
+        keys = [self.__key(fetcher, request) for request in requests]
+
+        futures = {}
+        owned = {}
+        for key, request in zip(keys, requests):
+            if key in futures:
+                continue
+            hit, ohlc = self.__get_local(key)
+            if hit:
+                futures[key] = asyncio.get_running_loop().create_future()
+                futures[key].set_result(ohlc)
+            elif key in self.__in_flight:
+                futures[key] = self.__in_flight[key]
+            else:
+                futures[key] = asyncio.get_running_loop().create_future()
+                self.__in_flight[key] = futures[key]
+                owned[key] = request
+
+        if owned:
+            await self.__fetch_owned(fetcher, owned, futures)
+        return [
+            (ticker, await futures[key]) for key, (_, _, ticker) in zip(keys, requests)
+        ]
+
+    async def __fetch_owned(self, fetcher, requests, futures):
+        try:
+            ohlcs = await self.__get_remote(requests)
+            missing = {k: r for k, r in requests.items() if k not in ohlcs}
+            if missing:
+                logger.debug(f"Fetching OHLC data for {list(missing.values())}")
+                with measured(get_metrics().fetcher_duration, fetcher.name):
+                    fetched = await fetcher.fetch_ohlc(list(missing.values()))
+                fetched_ohlcs = dict(fetched) if fetched is not None else {}
+                new_ohlcs = {
+                    key: fetched_ohlcs.get(request[2])
+                    for key, request in missing.items()
+                }
+                if fetched is not None:
+                    await self.__set_remote(requests, new_ohlcs)
+                ohlcs.update(new_ohlcs)
+
+            for key, request in requests.items():
+                self.__set_local(key, ohlcs[key], request[1])
+                futures[key].set_result(ohlcs[key])
+        except Exception as e:
+            for key in requests:
+                if not futures[key].done():
+                    futures[key].set_exception(e)
+        finally:
+            for key in requests:
+                self.__in_flight.pop(key, None)
+                if not futures[key].done():  # cancelled, don't leave waiters hanging
+                    futures[key].cancel()
+
+    def __key(self, fetcher, request):
+        start_date, end_date, ticker = request
+        fetcher_config = hashlib.md5(fetcher.to_json().encode("utf-8")).hexdigest()
+        return (
+            f"fetch:{fetcher.name}:{fetcher_config}:{ticker.symbol}:"
+            f"{start_date.isoformat()}:{end_date.isoformat()}"
+        )
+
+    def __entry_expiration_time(self, ohlc, end_date):
+        if ohlc is None or end_date >= dt.date.today():
+            return self.__recent_expiration_time
+        return self.__expiration_time
+
+    def __get_local(self, key):
+        entry = self.__local.get(key)
+        if entry is None:
+            return False, None
+        expires_at, _, ohlc = entry
+        if expires_at < time.monotonic():
+            self.__remove_local(key)
+            return False, None
+        self.__local.move_to_end(key)
+        return True, ohlc
+
+    def __set_local(self, key, ohlc, end_date):
+        expiration_time = self.__entry_expiration_time(ohlc, end_date)
+        size = self.ENTRY_SIZE + estimate_ohlc_size(ohlc)
+        self.__remove_local(key)
+        if size > self.__max_size:
+            return
+        self.__local[key] = (
+            time.monotonic() + expiration_time.total_seconds(),
+            size,
+            ohlc,
+        )
+        self.__size += size
+        while self.__size > self.__max_size:
+            self.__remove_local(next(iter(self.__local)))
+
+    def __remove_local(self, key):
+        entry = self.__local.pop(key, None)
+        if entry is not None:
+            self.__size -= entry[1]
+
+    async def __get_remote(self, requests):
+        if self.__redis_getter is None:
+            return {}
+        keys = list(requests)
+        values = await self.__redis_getter().mget(keys)
+        return {
+            key: None if value == self.NO_DATA else ohlc_from_chunks([value])
+            for key, value in zip(keys, values)
+            if value is not None
+        }
+
+    async def __set_remote(self, requests, ohlcs):
+        if self.__redis_getter is None:
+            return
+        async with self.__redis_getter().pipeline(transaction=False) as pipe:
+            for key, ohlc in ohlcs.items():
+                pipe.set(
+                    key,
+                    self.NO_DATA if ohlc is None else ohlc_to_chunk(ohlc),
+                    self.__entry_expiration_time(ohlc, requests[key][1]),
+                )
+            await pipe.execute()
+
+
+@cache
+def get_ohlc_fetch_cache():
+    settings = get_settings()
+    return OHLCFetchCache(
+        settings.ohlc_fetch_cache_size_mb * 1024 * 1024,
+        settings.ohlc_fetch_cache_expiration_time,
+        settings.ohlc_fetch_cache_recent_expiration_time,
+    )
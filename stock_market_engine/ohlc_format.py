@@ -0,0 +1,71 @@
+import io
+import json
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+except ImportError:  # pragma: no cover
+    pa = None
+
+"""
+Incremental encodings of OHLC data, to stream large histories in batches of rows
+with bounded memory. The OHLC data is given as an asynchronous iterable of OHLC
+columns (see serialization.ohlc_to_columns), e.g. the stored chunks of the OHLC
+loaded one at a time (see EngineView.ohlc_columns).
+"""
+
+__COLUMNS = ["date", "open", "high", "low", "close"]
+BATCH_SIZE = 1024
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+
+async def __batches(chunks, batch_size):
+    async for columns in chunks:
+        for begin in range(0, len(columns[0]), batch_size):
+            end = begin + batch_size
+            dates, *values = [c[begin:end] for c in columns]
+            yield [dates.astype("datetime64[D]")] + values
+
+
+async def ohlc_ndjson(chunks, batch_size=BATCH_SIZE):
+    """Yields the OHLC columns as newline delimited json objects, a batch of rows at
+    a time."""
+    async for dates, *values in __batches(chunks, batch_size):
+        rows = zip(np.datetime_as_string(dates).tolist(), *[v.tolist() for v in values])
+        yield "".join(
+            json.dumps(dict(zip(__COLUMNS, row))) + "\n" for row in rows
+        ).encode("utf-8")
+
+
+def has_arrow():
+    return pa is not None
+
+
+async def ohlc_arrow(chunks, batch_size=BATCH_SIZE):
+    """Yields the OHLC columns in the Arrow IPC streaming format, a record batch at a
+    time."""
+    assert has_arrow(), "pyarrow is not installed"
+    schema = pa.schema(
+        [("date", pa.date32())] + [(c, pa.float64()) for c in __COLUMNS[1:]]
+    )
+    buffer = io.BytesIO()
+    with pa.ipc.new_stream(buffer, schema) as writer:
+        async for columns in __batches(chunks, batch_size):
+            writer.write_batch(
+                pa.record_batch(
+                    [pa.array(columns[0])]
+                    + [pa.array(c, pa.float64()) for c in columns[1:]],
+                    schema=schema,
+                )
+            )
+            yield __take(buffer)
+    yield __take(buffer)
+
+
+def __take(buffer):
+    data = buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    return data
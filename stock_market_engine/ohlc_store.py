@@ -0,0 +1,183 @@
+import asyncio
+import datetime as dt
+import hashlib
+import json
+
+import numpy as np
+import pandas as pd
+
+from .executor import run_in_executor
+from .metrics import payload_size, record_size, timed
+from .serialization import (
+    is_packed,
+    ohlc_from_columns,
+    ohlc_to_bytes,
+    pack,
+    unpack,
+)
+
+"""
+OHLC data is stored in content addressed chunks of one calendar year, such that
+engines (and engine versions) sharing the same market data share the same chunks.
+Chunks are packed column buffers (see serialization), chunks stored as json by
+earlier versions are still supported for reading.
+Every engine referencing a chunk refreshes its expiration time, so a chunk lives at
+least as long as the longest living engine that references it.
+
+An engine derived from another one references the chunks of the engine it was
+derived from and only adds chunks with the rows appended since, see
+ohlc_delta_chunks. The chunks of a year are merged again after a number of appends.
+"""
+
+__COLUMNS = ["open", "high", "low", "close"]
+
+
+def __chunk_key(data):
+    return f"ohlc:{hashlib.sha256(data).hexdigest()}"
+
+
+def ohlc_to_chunk(ohlc):
+    """Serializes the OHLC as a single chunk."""
+    return ohlc_to_bytes(ohlc)
+
+
+def __year_chunks(columns, compress):
+    years = columns[0].astype("datetime64[D]").astype("datetime64[Y]")
+    years = years.astype(np.int64) + 1970
+    bounds = [0, *(np.flatnonzero(np.diff(years)) + 1), len(years)]
+
+    chunks = []
+    for begin, end in zip(bounds[:-1], bounds[1:]):
+        data = pack({}, [c[begin:end] for c in columns], compress)
+        chunks.append((int(years[begin]), __chunk_key(data), data, int(end - begin)))
+    return chunks
+
+
+def ohlc_delta_chunks(columns, parent_chunks, compress=False, snapshot_interval=32):
+    """
+    Splits the OHLC, given as columns (see serialization.ohlc_to_columns), in the
+    chunks of the OHLC it was derived from, followed by
+    yearly chunks of the rows appended since, given the (year, chunk key, row count)
+    of the parent chunks. Falls back on yearly chunks of the whole OHLC (a snapshot)
+    when it doesn't start with the parent data, or when the parent already has
+    'snapshot_interval' chunks of appended rows. Returns a list of (year, chunk key,
+    chunk data, row count) in chronological order.
+    """
+    appended_chunks = len(parent_chunks) - len({year for year, _, _ in parent_chunks})
+    if appended_chunks >= snapshot_interval:
+        return __year_chunks(columns, compress)
+
+    chunks = []
+    begin = 0
+    for year, key, rows in parent_chunks:
+        end = begin + rows
+        if end > len(columns[0]):
+            return __year_chunks(columns, compress)
+        data = pack({}, [c[begin:end] for c in columns], compress)
+        if __chunk_key(data) != key:
+            return __year_chunks(columns, compress)
+        chunks.append((year, key, data, rows))
+        begin = end
+    if begin < len(columns[0]):
+        chunks.extend(__year_chunks([c[begin:] for c in columns], compress))
+    return chunks
+
+
+def chunks_in_range(chunk_keys, chunk_years, start=None, end=None):
+    """Returns the keys of the yearly chunks holding data at or after the start date
+    and before the end date."""
+    if chunk_years is None:  # stored without years
+        return chunk_keys
+    first = -np.inf if start is None else start.year
+    last = np.inf if end is None else (end - dt.timedelta(days=1)).year
+    return [k for k, y in zip(chunk_keys, chunk_years) if first <= y <= last]
+
+
+async def store_chunks(chunks, redis, expiration_time):
+    """Stores the content addressed chunks which are not yet stored and refreshes the
+    expiration time of the chunks that are. Returns the keys of the stored chunks."""
+    keys = list(chunks)
+    async with redis.pipeline(transaction=False) as pipe:
+        for key in keys:
+            pipe.expire(key, expiration_time)
+        refreshed = await pipe.execute()
+
+    missing = [key for key, exists in zip(keys, refreshed) if not exists]
+    if not missing:
+        return missing
+    async with redis.pipeline(transaction=False) as pipe:
+        for key in missing:
+            pipe.set(key, chunks[key], expiration_time)
+        await pipe.execute()
+    return missing
+
+
+def __json_chunk_columns(chunk):
+    json_obj = json.loads(chunk)
+    dates = pd.to_datetime(pd.Series(json_obj["dates"])).values.astype("datetime64[D]")
+    return [dates.astype(np.int64)] + [np.array(json_obj[c]) for c in __COLUMNS]
+
+
+def chunk_columns(chunk):
+    """Returns the OHLC columns (see serialization.ohlc_to_columns) of a chunk."""
+    return unpack(chunk)[1] if is_packed(chunk) else __json_chunk_columns(chunk)
+
+
+def ohlc_from_chunks(chunks):
+    """Creates a single OHLC from the serialized chunks, in chronological order."""
+    columns = [chunk_columns(chunk) for chunk in chunks]
+    if not columns:
+        return None
+    if len(columns) == 1:
+        return ohlc_from_columns(columns[0])
+    return ohlc_from_columns([np.concatenate(c) for c in zip(*columns)])
+
+
+async def load_ohlcs(chunk_keys, redis):
+    """Loads the OHLCs given a dict of ticker to chunk keys.
+    Returns None for a ticker if any of its chunks expired."""
+    keys = [key for ticker_keys in chunk_keys.values() for key in ticker_keys]
+    chunks = {}
+    if keys:
+        with timed("redis"):
+            chunks = dict(zip(keys, await redis.mget(keys)))
+        record_size("read", payload_size(chunks.values()))
+
+    ohlcs = {}
+    loading = {}
+    for ticker, ticker_keys in chunk_keys.items():
+        ticker_chunks = [chunks[key] for key in ticker_keys]
+        if any(chunk is None for chunk in ticker_chunks):
+            ohlcs[ticker] = None
+        else:
+            loading[ticker] = ticker_chunks
+
+    with timed("deserialize"):
+        loaded = await asyncio.gather(
+            *[run_in_executor(ohlc_from_chunks, c) for c in loading.values()]
+        )
+    ohlcs.update(zip(loading, loaded))
+    return ohlcs
+
+
+async def load_ohlc_columns(chunk_keys, redis):
+    """
+    Yields the OHLC columns of each of the chunks in turn, only one chunk is loaded
+    at a time. Yields nothing if any of the chunks expired, stops early if a chunk
+    expires while loading.
+    """
+    if not chunk_keys:
+        return
+    with timed("redis"):
+        existing = await redis.exists(*chunk_keys)
+    if existing < len(chunk_keys):
+        return
+    for key in chunk_keys:
+        with timed("redis"):
+            chunk = await redis.get(key)
+        if chunk is None:
+            return
+        record_size("read", payload_size([chunk]))
+        with timed("deserialize"):
+            columns = await run_in_executor(chunk_columns, chunk)
+        yield columns
@@ -12,7 +12,7 @@ def init_redis_pool() -> Redis:
         global_settings.redis_url,
         encoding="utf-8",
         db=global_settings.redis_db,
-        decode_responses=True,
+        decode_responses=False,
     )
     logger.info("Initialized redis")
     return redis
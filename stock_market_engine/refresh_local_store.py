@@ -0,0 +1,67 @@
+import argparse
+import asyncio
+import datetime as dt
+
+from simputils.logging import get_logger
+
+from .common import get_stock_updater_factory
+from .local_store import get_local_market_store, refresh_local_store
+
+logger = get_logger(__name__)
+
+"""
+Creates or refreshes a local market data store, run with
+'python -m stock_market_engine.refresh_local_store', see --help for the options.
+Only the CSV files which changed since the last run are ingested again, and only the
+data after the last stored date of each symbol is fetched.
+"""
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m stock_market_engine.refresh_local_store",
+        description="Creates or refreshes a local market data store.",
+    )
+    parser.add_argument("store_dir", help="directory of the local market data store")
+    parser.add_argument(
+        "--csv",
+        metavar="DATA_DIR",
+        help="ingest the '<symbol>.csv' files in the directory",
+    )
+    parser.add_argument(
+        "--stock-updater",
+        help="name of the stock updater fetching the data after the stored data",
+    )
+    parser.add_argument(
+        "--stock-updater-config",
+        default='""',
+        help="json config of the stock updater",
+    )
+    parser.add_argument(
+        "--date",
+        type=dt.date.fromisoformat,
+        default=dt.date.today() + dt.timedelta(days=1),
+        help="fetch the data up to this date, excluded (default: tomorrow)",
+    )
+    return parser.parse_args(args)
+
+
+async def run(args):
+    store = get_local_market_store(args.store_dir)
+    if args.csv is not None:
+        symbols = store.ingest_csv(args.csv)
+        logger.info(f"Ingested {len(symbols)} CSV files: {', '.join(symbols)}")
+    if args.stock_updater is not None:
+        stock_updater = get_stock_updater_factory().create(
+            args.stock_updater, args.stock_updater_config
+        )
+        symbols = await refresh_local_store(store, stock_updater, args.date)
+        logger.info(f"Refreshed {len(symbols)} symbols: {', '.join(symbols)}")
+
+
+def main(args=None):
+    asyncio.run(run(parse_args(args)))
+
+
+if __name__ == "__main__":
+    main()
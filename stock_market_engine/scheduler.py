@@ -0,0 +1,251 @@
+import asyncio
+import datetime as dt
+import json
+import uuid
+from collections import defaultdict
+from functools import cache
+
+from simputils.logging import get_logger
+from stock_market.core import StockMarket, StockUpdater
+
+from .columnar_market import ohlc_end
+from .config import get_settings
+from .engine_store import get_engine_hash, get_engine_views, get_or_create_engine
+from .fetcher import PrefetchedOHLCFetcher
+
+logger = get_logger(__name__)
+
+"""
+Advances subscribed engines daily. A subscription is identified by the id of the
+engine it was created for and follows that engine: each run replaces the engine by
+the advanced one and publishes the new id on the ENGINES_CHANNEL.
+
+The run after market close advances the engines to the next day, such that the
+engine clients request the next morning is already stored. Its signal detection is
+done up to the last day of fetched market data, see Engine.detect, such that the next
+run detects the signals on days whose data wasn't available yet.
+"""
+
+SUBSCRIPTIONS_KEY = "scheduler:subscriptions"
+ENGINES_CHANNEL = "scheduler:engines"
+# A run for a date is done once, by the worker holding its key
+RUN_EXPIRATION_TIME = dt.timedelta(days=1)
+
+
+async def subscribe(engine_id, redis):
+    """Registers the engine for automatic advancement, returns the subscription id."""
+    subscription_id = str(engine_id)
+    await redis.hsetnx(SUBSCRIPTIONS_KEY, subscription_id, str(engine_id))
+    return subscription_id
+
+
+async def unsubscribe(subscription_id, redis):
+    """Returns whether the subscription existed."""
+    return bool(await redis.hdel(SUBSCRIPTIONS_KEY, subscription_id))
+
+
+async def get_subscription(subscription_id, redis):
+    """Returns the id of the latest engine of the subscription, None if unknown."""
+    engine_id = await redis.hget(SUBSCRIPTIONS_KEY, subscription_id)
+    return None if engine_id is None else engine_id.decode("utf-8")
+
+
+class Scheduler:
+    """
+    Advances the subscribed engines to a date at most once per date across all
+    workers. Engines are grouped by stock updater and ticker set, and each group is
+    advanced in batches of at most 'batch_size' engines. The OHLC data of a batch is
+    fetched once for all its engines. At most 'concurrency' batches are advanced at
+    once, bounding the number of engines loaded at once.
+    """
+
+    def __init__(self, concurrency, lock_timeout, run_time, batch_size):
+        self.__concurrency = concurrency
+        self.__batch_size = batch_size
+        self.__lock_timeout = lock_timeout
+        self.__run_time = run_time
+        self.__task = None
+
+    async def run(self, date, redis):
+        """
+        Advances the subscribed engines to the date, returns the new engine id per
+        subscription id of the advanced engines. Returns None when the engines are
+        already advanced to the date by this or another worker.
+        """
+        run_key = f"scheduler:run:{date.isoformat()}"
+        if not await redis.set(run_key, 1, ex=self.__lock_timeout, nx=True):
+            logger.info(f"Engines are already advanced to {date}")
+            return None
+        try:
+            advanced = await self.__advance(date, redis)
+        except BaseException:
+            await redis.delete(run_key)
+            raise
+        await redis.expire(run_key, RUN_EXPIRATION_TIME)
+        return advanced
+
+    async def __advance(self, date, redis):
+        subscriptions = {
+            subscription_id.decode("utf-8"): engine_id.decode("utf-8")
+            for subscription_id, engine_id in (
+                await redis.hgetall(SUBSCRIPTIONS_KEY)
+            ).items()
+        }
+        views = await get_engine_views(
+            [uuid.UUID(engine_id) for engine_id in subscriptions.values()],
+            redis,
+            cache=False,
+        )
+
+        groups = defaultdict(list)
+        for (subscription_id, engine_id), view in zip(subscriptions.items(), views):
+            if view is None:
+                logger.warning(f"Engine '{engine_id}' expired, unsubscribing")
+                await unsubscribe(subscription_id, redis)
+            elif view.date < date:
+                key = (
+                    json.dumps(view.metadata["stock_updater"], sort_keys=True),
+                    tuple(sorted(t.symbol for t in view.tickers)),
+                )
+                groups[key].append((subscription_id, engine_id, view))
+
+        logger.info(
+            f"Advancing {sum(map(len, groups.values()))} engines in {len(groups)}"
+            f" groups to {date}"
+        )
+        semaphore = asyncio.Semaphore(self.__concurrency)
+
+        async def advance_batch(batch):
+            async with semaphore:
+                return await self.__advance_batch(batch, date, redis)
+
+        batches = [
+            batch
+            for group in groups.values()
+            for batch in Scheduler.__batches(group, self.__batch_size)
+        ]
+        advanced = {}
+        for batch_advanced in await asyncio.gather(
+            *[advance_batch(batch) for batch in batches]
+        ):
+            advanced.update(batch_advanced)
+        return advanced
+
+    @staticmethod
+    def __batches(group, batch_size):
+        for begin in range(0, len(group), batch_size):
+            end = begin + batch_size
+            yield group[begin:end]
+
+    @staticmethod
+    async def __advance_batch(batch, date, redis):
+        engines = await asyncio.gather(*[view.engine() for _, _, view in batch])
+        stock_updater = await Scheduler.__prefetch(
+            engines[0].stock_market_updater, engines, date
+        )
+
+        async def advance(subscription_id, parent_id, view, engine):
+            async def update():
+                return await engine.detect(
+                    date, await stock_updater.update(date, engine.stock_market)
+                )
+
+            engine_hash = get_engine_hash(
+                view.start_date, view.tickers, view.signal_detectors, date
+            )
+            engine_id = str(
+                await get_or_create_engine(engine_hash, update, redis, parent_id)
+            )
+            if await redis.hexists(SUBSCRIPTIONS_KEY, subscription_id):
+                await redis.hset(SUBSCRIPTIONS_KEY, subscription_id, engine_id)
+            await redis.publish(
+                ENGINES_CHANNEL,
+                json.dumps(
+                    {
+                        "subscription_id": subscription_id,
+                        "engine_id": engine_id,
+                        "date": date.isoformat(),
+                    }
+                ),
+            )
+            return subscription_id, engine_id
+
+        return dict(
+            await asyncio.gather(
+                *[
+                    advance(subscription_id, parent_id, view, engine)
+                    for (subscription_id, parent_id, view), engine in zip(
+                        batch, engines
+                    )
+                ]
+            )
+        )
+
+    @staticmethod
+    async def __prefetch(stock_updater, engines, date):
+        """
+        Fetches the OHLC data the engines need to update to the date, each ticker once
+        from the earliest date any of the engines needs. Returns a stock updater serving
+        that data.
+        """
+        starts = {}
+        for engine in engines:
+            stock_market = engine.stock_market
+            for ticker in stock_market.tickers:
+                end = ohlc_end(stock_market, ticker)
+                start = (
+                    stock_market.start_date
+                    if end is None
+                    else end + dt.timedelta(days=1)
+                )
+                starts[ticker] = min(start, starts.get(ticker, start))
+
+        tickers_by_start = defaultdict(list)
+        for ticker, start in starts.items():
+            tickers_by_start[start].append(ticker)
+        stock_markets = await asyncio.gather(
+            *[
+                stock_updater.update(date, StockMarket(start, tickers))
+                for start, tickers in tickers_by_start.items()
+            ]
+        )
+
+        ohlcs = {}
+        for (start, tickers), stock_market in zip(
+            tickers_by_start.items(), stock_markets
+        ):
+            ohlcs.update({t: (start, date, stock_market.ohlc(t)) for t in tickers})
+        return StockUpdater(PrefetchedOHLCFetcher(stock_updater.name, ohlcs))
+
+    def start(self, redis_getter):
+        """Starts advancing the engines daily at the run time, to the next day."""
+        if self.__task is None:
+            self.__task = asyncio.ensure_future(self.__run_daily(redis_getter))
+
+    def stop(self):
+        if self.__task is not None:
+            self.__task.cancel()
+            self.__task = None
+
+    async def __run_daily(self, redis_getter):
+        while True:
+            now = dt.datetime.now()
+            run_at = dt.datetime.combine(now.date(), self.__run_time)
+            if run_at <= now:
+                run_at += dt.timedelta(days=1)
+            await asyncio.sleep((run_at - now).total_seconds())
+            try:
+                await self.run(run_at.date() + dt.timedelta(days=1), redis_getter())
+            except Exception:
+                logger.exception("Advancing the subscribed engines failed")
+
+
+@cache
+def get_scheduler():
+    settings = get_settings()
+    return Scheduler(
+        settings.scheduler_concurrency,
+        settings.scheduler_lock_timeout,
+        settings.scheduler_time,
+        settings.scheduler_batch_size,
+    )
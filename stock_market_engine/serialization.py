@@ -0,0 +1,108 @@
+import json
+import struct
+import zlib
+
+import numpy as np
+import pandas as pd
+from stock_market.core import OHLC
+
+"""
+Versioned binary container for column data, used to serialize the stored OHLC chunks.
+
+Layout (little endian):
+ - magic b"SME" (3 bytes), version (uint8), flags (uint8), header length (uint32)
+ - header: compact json with the caller's metadata and the column layout
+ - padding up to a multiple of 8 bytes
+ - the column buffers, each padded up to a multiple of 8 bytes
+Everything after the fixed size prefix is zlib compressed when the COMPRESSED flag is
+set. Uncompressed columns are reconstructed without copying the data.
+"""
+
+MAGIC = b"SME"
+VERSION = 1
+COMPRESSED = 1
+
+__PREFIX = struct.Struct("<3sBBI")
+__OHLC_COLUMNS = ["open", "high", "low", "close"]
+
+
+def __padding(length):
+    return b"\0" * (-length % 8)
+
+
+def is_packed(data):
+    return isinstance(data, bytes) and data[: len(MAGIC)] == MAGIC
+
+
+def pack(metadata, columns, compress=False):
+    """Packs the json serializable metadata and a list of 1D numpy arrays."""
+    columns = [np.ascontiguousarray(c) for c in columns]
+    header = json.dumps(
+        {
+            "metadata": metadata,
+            "columns": [[c.dtype.str, len(c)] for c in columns],
+        },
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+    body = [header, __padding(__PREFIX.size + len(header))]
+    for column in columns:
+        body.extend([column.tobytes(), __padding(column.nbytes)])
+    body = b"".join(body)
+
+    flags = 0
+    if compress:
+        flags |= COMPRESSED
+        body = zlib.compress(body)
+    return __PREFIX.pack(MAGIC, VERSION, flags, len(header)) + body
+
+
+def unpack(data):
+    """Returns the metadata and columns of packed data."""
+    magic, version, flags, header_length = __PREFIX.unpack_from(data)
+    assert magic == MAGIC, "Not a packed buffer"
+    assert version <= VERSION, f"Unsupported format version {version}"
+
+    buffer = memoryview(data)
+    offset = __PREFIX.size
+    if flags & COMPRESSED:
+        buffer = memoryview(zlib.decompress(buffer[offset:]))
+        offset = 0
+
+    header_end = offset + header_length
+    header = json.loads(bytes(buffer[offset:header_end]))
+    offset = header_end
+    offset += -(__PREFIX.size + header_length) % 8
+
+    columns = []
+    for dtype, length in header["columns"]:
+        column = np.frombuffer(
+            buffer, dtype=np.dtype(dtype), count=length, offset=offset
+        )
+        columns.append(column)
+        offset += column.nbytes + (-column.nbytes % 8)
+    return header["metadata"], columns
+
+
+def ohlc_to_columns(ohlc):
+    """Returns the OHLC dates (as days since epoch) and values as numpy arrays."""
+    dates = pd.to_datetime(ohlc.dates).values.astype("datetime64[D]").astype(np.int64)
+    return [dates] + [getattr(ohlc, c).values.to_numpy() for c in __OHLC_COLUMNS]
+
+
+def ohlc_from_columns(columns):
+    dates, *values = columns
+    if len(dates) == 0:
+        return None
+    return OHLC(
+        pd.Series(dates.astype("datetime64[D]")),
+        *[pd.Series(v, copy=False) for v in values],
+    )
+
+
+def ohlc_to_bytes(ohlc, compress=False):
+    return pack({}, ohlc_to_columns(ohlc), compress)
+
+
+def ohlc_from_bytes(data):
+    return ohlc_from_columns(unpack(data)[1])
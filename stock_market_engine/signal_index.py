@@ -0,0 +1,400 @@
+import datetime as dt
+from bisect import bisect_left
+from collections import defaultdict
+
+from stock_market.core import Signal, SignalSequence
+
+from .metrics import payload_size, record_size, timed
+
+"""
+Index of the stored signal parts, answering filtered signal queries without loading
+or merging whole signal sequences. The index of the content addressed part
+'signals:<hash>' is the sorted set 'signals:<hash>:index' of its signals, scored by
+the ordinal of their date. Members are the signal json prefixed by the zero padded
+position of the signal in the part, which keeps the signals of a date in order.
+
+Queried signals are ordered like merge_signals orders them: by date, then by the
+index of their signal detector, then by their position in its sequence. A cursor
+is the '<date>:<detector index>:<position>' of the last signal of a page.
+
+Across engines, signals are indexed by date under 'signals:date:<date>' and by
+ticker under 'signals:ticker:<symbol>'. These sorted sets are scored by the ordinal
+of the signal date as well, with the signal json prefixed by the id of its owner as
+members. An owner is a chain of engines each derived from the previous one, named
+after its first engine. 'signals:owner:<owner>' holds the newest engine of the
+chain, under which its signals are listed, and expires with it. An engine derived
+from the newest engine of a chain continues it and only indexes the signals added
+since its parent, other engines start their own owner and index all their signals.
+Members of expired owners are removed when read.
+"""
+
+POSITION_DIGITS = 10
+
+# Continues the owner with the engine if its newest engine is the parent
+CONTINUE_OWNER_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    redis.call('set', KEYS[1], ARGV[2], 'EX', ARGV[3])
+    return 1
+end
+return 0
+"""
+
+
+def signal_index_key(part_key):
+    return f"{part_key}:index"
+
+
+def date_index_key(date):
+    return f"signals:date:{date.isoformat()}"
+
+
+def ticker_index_key(symbol):
+    return f"signals:ticker:{symbol}"
+
+
+def owner_key(owner):
+    return f"signals:owner:{owner}"
+
+
+def __index_member(position, signal):
+    return f"{position:0{POSITION_DIGITS}d}:{signal.to_json()}"
+
+
+async def store_signal_indexes(parts, redis, expiration_time):
+    """
+    Stores the index of the signal parts, given as dict of part key to signals, which
+    are not yet indexed and refreshes the expiration time of the indexes that are.
+    Returns the written members.
+    """
+    keys = list(parts)
+    async with redis.pipeline(transaction=False) as pipe:
+        for key in keys:
+            pipe.expire(signal_index_key(key), expiration_time)
+        refreshed = await pipe.execute()
+
+    written = []
+    async with redis.pipeline(transaction=False) as pipe:
+        for key, exists in zip(keys, refreshed):
+            if exists or not parts[key]:
+                continue
+            members = {
+                __index_member(position, signal): signal.date.toordinal()
+                for position, signal in enumerate(parts[key])
+            }
+            pipe.zadd(signal_index_key(key), members)
+            pipe.expire(signal_index_key(key), expiration_time)
+            written.extend(members)
+        if written:
+            await pipe.execute()
+    return written
+
+
+class SignalQuery:
+    """
+    Filters signals on a date range, with the end date excluded, on the ids of their
+    signal detectors, on their sentiment and on a ticker. At most 'limit' signals are
+    returned per page, starting after the cursor of the previous page.
+    """
+
+    def __init__(
+        self,
+        start=None,
+        end=None,
+        detector_ids=None,
+        sentiment=None,
+        ticker=None,
+        limit=None,
+        cursor=None,
+    ):
+        self.start = start
+        self.end = end
+        self.detector_ids = detector_ids
+        self.sentiment = sentiment
+        self.ticker = ticker
+        self.limit = limit
+        self.after = None if cursor is None else SignalQuery.__parse_cursor(cursor)
+
+    @property
+    def is_empty(self):
+        return all(
+            value is None
+            for value in [
+                self.start,
+                self.end,
+                self.detector_ids,
+                self.sentiment,
+                self.ticker,
+                self.limit,
+                self.after,
+            ]
+        )
+
+    @property
+    def filters_content(self):
+        """Whether signals are filtered on more than their date and detector."""
+        return self.sentiment is not None or self.ticker is not None
+
+    @property
+    def first_date(self):
+        """The first date of which signals may be returned, None if unbounded."""
+        dates = [] if self.start is None else [self.start]
+        if self.after is not None:
+            dates.append(self.after[0])
+        return max(dates) if dates else None
+
+    def detector_indexes(self, detector_ids):
+        """Returns the indexes of the queried detectors, given the detector ids."""
+        return [
+            i
+            for i, detector_id in enumerate(detector_ids)
+            if self.detector_ids is None or detector_id in self.detector_ids
+        ]
+
+    def matches(self, signal):
+        return (
+            (self.start is None or signal.date >= self.start)
+            and (self.end is None or signal.date < self.end)
+            and (self.sentiment is None or signal.sentiment == self.sentiment)
+            and (
+                self.ticker is None or self.ticker in [t.symbol for t in signal.tickers]
+            )
+        )
+
+    def page(self, candidates):
+        """
+        Returns the page of matching signals and the cursor of the next page, None if
+        it is the last page, given (date, detector index, position, signal) tuples
+        including at least the first 'limit' + 1 matches after the cursor.
+        """
+        matches = sorted(
+            (c for c in candidates if self.matches(c[3])),
+            key=lambda c: c[:3],
+        )
+        if self.after is not None:
+            matches = [c for c in matches if c[:3] > self.after]
+        next_cursor = None
+        if self.limit is not None and len(matches) > self.limit:
+            matches = matches[: self.limit]
+            date, detector_index, position, _ = matches[-1]
+            next_cursor = f"{date.isoformat()}:{detector_index}:{position}"
+        return SignalSequence([c[3] for c in matches]), next_cursor
+
+    @staticmethod
+    def __parse_cursor(cursor):
+        date, detector_index, position = cursor.split(":")
+        return dt.date.fromisoformat(date), int(detector_index), int(position)
+
+
+def query_signal_sequences(signal_sequences, detector_ids, query):
+    """Runs the query on the loaded signal sequences of the signal detectors with
+    the given ids, returns the signals and the cursor of the next page."""
+    candidates = []
+    first_date = query.first_date
+    for i in query.detector_indexes(detector_ids):
+        signals = signal_sequences[i].signals
+        # bisect only supports a key as of python 3.10
+        dates = [s.date for s in signals]
+        begin = 0
+        if first_date is not None:
+            begin = bisect_left(dates, first_date)
+        end = len(signals)
+        if query.end is not None:
+            end = bisect_left(dates, query.end)
+        candidates.extend(
+            (signals[p].date, i, p, signals[p]) for p in range(begin, end)
+        )
+    return query.page(candidates)
+
+
+async def query_signal_indexes(part_keys, part_lengths, detector_ids, query, redis):
+    """
+    Runs the query on the indexes of the signal parts, given the keys and lengths of
+    the parts of each signal sequence, and the ids of their signal detectors. Returns
+    the signals and the cursor of the next page. Only the signals in the date range
+    are read, at most 'limit' + 1 per part unless the signal content is filtered.
+    """
+    first_date = query.first_date
+    first = "-inf" if first_date is None else first_date.toordinal()
+    last = "+inf" if query.end is None else f"({query.end.toordinal()}"
+    num = None
+    if query.limit is not None and not query.filters_content:
+        num = query.limit + 1
+    # The signals at the cursor date aren't limited, as those up to the cursor are
+    # skipped
+    split_first_date = num is not None and query.after is not None
+    split_first_date = split_first_date and first_date == query.after[0]
+
+    ranges = []
+    for i in query.detector_indexes(detector_ids):
+        offset = 0
+        for key, length in zip(part_keys[i], part_lengths[i]):
+            if split_first_date:
+                ranges.append((i, offset, key, first, first, None))
+                ranges.append((i, offset, key, f"({first}", last, num))
+            else:
+                ranges.append((i, offset, key, first, last, num))
+            offset += length
+
+    with timed("redis"):
+        async with redis.pipeline(transaction=False) as pipe:
+            for _, _, key, range_min, range_max, range_num in ranges:
+                pipe.zrangebyscore(
+                    signal_index_key(key),
+                    range_min,
+                    range_max,
+                    start=None if range_num is None else 0,
+                    num=range_num,
+                )
+            results = await pipe.execute() if ranges else []
+    record_size("read", payload_size(m for members in results for m in members))
+
+    candidates = []
+    with timed("deserialize"):
+        for (i, offset, _, _, _, _), members in zip(ranges, results):
+            for member in members:
+                position, _, signal_json = member.decode("utf-8").partition(":")
+                signal = Signal.from_json(signal_json)
+                position = offset + int(position)
+                candidates.append((signal.date, i, position, signal))
+    return query.page(candidates)
+
+
+async def signals_after(part_keys, date, redis):
+    """Returns the signals of the signal parts with the given keys after the date,
+    all signals if the date is None, read from their indexes."""
+    first = "-inf" if date is None else f"({date.toordinal()}"
+    async with redis.pipeline(transaction=False) as pipe:
+        for key in part_keys:
+            pipe.zrangebyscore(signal_index_key(key), first, "+inf")
+        results = await pipe.execute() if part_keys else []
+    record_size("read", payload_size(m for members in results for m in members))
+    return [
+        Signal.from_json(member.decode("utf-8").partition(":")[2])
+        for members in results
+        for member in members
+    ]
+
+
+async def signal_owner(engine_id, parent_id, parent_owner, redis, expiration_time):
+    """
+    Returns the owner of the signals of the engine, derived from the parent engine
+    with the given id and signal owner, if any: the owner of the parent if the
+    parent is its newest engine, otherwise the engine starts its own owner.
+    """
+    if parent_owner is not None and await redis.eval(
+        CONTINUE_OWNER_SCRIPT,
+        1,
+        owner_key(parent_owner),
+        str(parent_id),
+        str(engine_id),
+        int(expiration_time.total_seconds()),
+    ):
+        return parent_owner
+    await redis.set(owner_key(engine_id), str(engine_id), expiration_time)
+    return str(engine_id)
+
+
+async def index_engine_signals(owner, signals, removed, redis, expiration_time):
+    """
+    Adds the signals to the indexes across engines under the owner, and removes the
+    removed signals. Returns the written members.
+    """
+    indexes = defaultdict(dict)
+    removed_members = defaultdict(list)
+    for signal in signals:
+        member = f"{owner}:{signal.to_json()}"
+        score = signal.date.toordinal()
+        indexes[date_index_key(signal.date)][member] = score
+        for ticker in signal.tickers:
+            indexes[ticker_index_key(ticker.symbol)][member] = score
+    for signal in removed:
+        member = f"{owner}:{signal.to_json()}"
+        removed_members[date_index_key(signal.date)].append(member)
+        for ticker in signal.tickers:
+            removed_members[ticker_index_key(ticker.symbol)].append(member)
+    if not indexes and not removed_members:
+        return []
+
+    async with redis.pipeline(transaction=True) as pipe:
+        for key, members in removed_members.items():
+            pipe.zrem(key, *members)
+        for key, members in indexes.items():
+            pipe.zadd(key, members)
+            pipe.expire(key, expiration_time)
+        await pipe.execute()
+    return [member for members in indexes.values() for member in members]
+
+
+async def signals_on_date(date, redis, limit=None):
+    """Returns the (engine id, signal sequence) of the engines listing signals on
+    the date, at most 'limit' signals."""
+    return await __engine_signals(date_index_key(date), redis, None, None, limit)
+
+
+async def signals_on_ticker(symbol, redis, start=None, end=None, limit=None):
+    """Returns the (engine id, signal sequence) of the engines listing signals on
+    the ticker at or after the start date and before the end date, at most 'limit'
+    signals."""
+    return await __engine_signals(ticker_index_key(symbol), redis, start, end, limit)
+
+
+async def __engine_signals(key, redis, start, end, limit):
+    """Reads the members of the index until 'limit' members of live owners are read,
+    the members of expired owners are removed."""
+    first = "-inf" if start is None else start.toordinal()
+    last = "+inf" if end is None else f"({end.toordinal()}"
+    signals = defaultdict(list)
+    engine_ids = {}
+    count = 0
+    while True:
+        num = None if limit is None else limit - count
+        with timed("redis"):
+            members = await redis.zrangebyscore(
+                key, first, last, start=None if num is None else count, num=num
+            )
+        record_size("read", payload_size(members))
+
+        owner_members = defaultdict(list)
+        with timed("deserialize"):
+            for member in members:
+                owner, _, signal_json = member.decode("utf-8").partition(":")
+                owner_members[owner].append((member, Signal.from_json(signal_json)))
+        owners = [o for o in owner_members if o not in engine_ids]
+        engine_ids.update(zip(owners, await __owner_engines(owners, redis)))
+
+        expired = [
+            member
+            for owner, ms in owner_members.items()
+            if engine_ids[owner] is None
+            for member, _ in ms
+        ]
+        if expired:
+            with timed("redis"):
+                await redis.zrem(key, *expired)
+        for owner, ms in owner_members.items():
+            if engine_ids[owner] is not None:
+                signals[engine_ids[owner]].extend(signal for _, signal in ms)
+        # The live members read so far precede the next ones, the expired are removed
+        count += len(members) - len(expired)
+        if num is None or len(members) < num or count >= limit:
+            break
+
+    return [(engine_id, SignalSequence(s)) for engine_id, s in signals.items()]
+
+
+async def __owner_engines(owners, redis):
+    """Returns the newest engine id of each owner, None for expired owners. Members
+    indexed before owners existed are owned by their engine."""
+    with timed("redis"):
+        async with redis.pipeline(transaction=False) as pipe:
+            for owner in owners:
+                pipe.get(owner_key(owner))
+                pipe.exists(owner)
+            results = await pipe.execute() if owners else []
+    engine_ids = []
+    for owner, engine_id, exists in zip(owners, results[::2], results[1::2]):
+        if engine_id is not None:
+            engine_ids.append(engine_id.decode("utf-8"))
+        else:
+            engine_ids.append(owner if exists else None)
+    return engine_ids
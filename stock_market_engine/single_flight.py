@@ -0,0 +1,72 @@
+import asyncio
+import uuid
+from functools import cache
+
+from simputils.logging import get_logger
+
+from .config import get_settings
+
+logger = get_logger(__name__)
+
+# Releases the lock only if it is still held with the token, it may have expired and
+# been acquired by another worker
+RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class SingleFlight:
+    """
+    Runs work identified by a key at most once at a time. Concurrent calls with the
+    same key within the process wait for the running work, calls from other
+    processes wait for the Redis lock of the key to be released and share the
+    result the lock holder published.
+    """
+
+    def __init__(self, timeout, poll_interval):
+        self.__timeout = timeout
+        self.__poll_interval = poll_interval
+        self.__in_flight = {}
+
+    async def run(self, key, work, redis):
+        task = self.__in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self.__run_locked(key, work, redis))
+            self.__in_flight[key] = task
+            task.add_done_callback(lambda _: self.__in_flight.pop(key, None))
+        else:
+            logger.debug(f"Joining in-flight work for '{key}'")
+        # The work continues for the other callers if this one gets cancelled
+        return await asyncio.shield(task)
+
+    async def __run_locked(self, key, work, redis):
+        lock_key = f"lock:{key}"
+        result_key = f"flight:{key}"
+        token = str(uuid.uuid4())
+        while True:
+            if await redis.set(lock_key, token, ex=self.__timeout, nx=True):
+                try:
+                    result = await work()
+                    await redis.set(result_key, str(result), self.__timeout)
+                    return result
+                finally:
+                    await redis.eval(RELEASE_LOCK_SCRIPT, 1, lock_key, token)
+
+            logger.debug(f"Waiting for work of another worker on '{key}'")
+            while await redis.exists(lock_key):
+                await asyncio.sleep(self.__poll_interval)
+            result = await redis.get(result_key)
+            if result is not None:
+                return result.decode("utf-8")
+            # The lock holder failed, retry
+
+
+@cache
+def get_single_flight():
+    settings = get_settings()
+    return SingleFlight(
+        settings.single_flight_timeout, settings.single_flight_poll_interval
+    )
@@ -1,27 +1,53 @@
+import asyncio
 import datetime as dt
 import json
+import os
+import time
+import uuid
 from http import HTTPStatus
 
 import pytest
 from fakeredis.aioredis import FakeRedis
 from fastapi.testclient import TestClient
-from stock_market.core import OHLC
-
+from stock_market.core import OHLC, SignalSequence
+
+from stock_market_engine.api import EngineModel
+from stock_market_engine.common import (
+    get_signal_detector_factory,
+    get_stock_updater_factory,
+)
+from stock_market_engine.config import get_settings
+from stock_market_engine.engine_store import store_engine
 from stock_market_engine.main import app
 
+DATA_DIR = os.path.join(os.path.dirname(__file__), os.pardir, "data")
+
 
 def get_client_impl():
     with TestClient(app) as client:
-        app.state.redis = FakeRedis(decode_responses=True, encoding="UTF-8")
+        app.state.redis = FakeRedis()
         while True:
             yield client
 
 
 @pytest.fixture
-def client():
+def client(monkeypatch):
+    monkeypatch.setattr(get_settings(), "stock_updater", "csv")
+    monkeypatch.setattr(get_settings(), "stock_updater_config", json.dumps(DATA_DIR))
     return next(get_client_impl())
 
 
+@pytest.fixture
+def running_client(monkeypatch):
+    """Client of which the event loop keeps running between the requests, such
+    that background jobs can complete."""
+    monkeypatch.setattr(get_settings(), "stock_updater", "csv")
+    monkeypatch.setattr(get_settings(), "stock_updater_config", json.dumps(DATA_DIR))
+    with TestClient(app) as client:
+        app.state.redis = FakeRedis()
+        yield client
+
+
 def get_date(client, engine_id):
     response = client.get(f"/getdate/{engine_id}")
     assert response.status_code == HTTPStatus.OK
@@ -124,3 +150,462 @@ def test_api(client):
     response = client.get("/getsupportedindicators")
     assert response.status_code == HTTPStatus.OK
     assert len(response.json()) == 3
+
+
+def test_step(client):
+    engine_config = {
+        "stock_market": {
+            "start_date": "2021-01-01",
+            "tickers": [{"symbol": "SPY"}],
+        },
+        "signal_detectors": [
+            {"static_name": "Monthly", "config": json.dumps(1)},
+        ],
+    }
+    engine_id = get_engine_id(client.post("/create", json=engine_config))
+
+    response = client.post(
+        f"/step/{engine_id}",
+        json={
+            "start_date": "2021-01-04",
+            "end_date": "2021-01-08",
+            "checkpoints": ["2021-01-06"],
+        },
+    )
+    assert response.status_code == HTTPStatus.OK
+    steps = response.json()
+    assert [s["date"] for s in steps] == [f"2021-01-0{d}" for d in range(4, 9)]
+    assert [s["engine_id"] is not None for s in steps] == [
+        False,
+        False,
+        True,
+        False,
+        True,
+    ]
+
+    response = client.post(f"/update/{engine_id}", params={"date": "2021-01-08"})
+    assert response.json() == steps[-1]["engine_id"]
+    assert get_date(client, steps[2]["engine_id"]) == "2021-01-06"
+
+    response = client.post(f"/step/{engine_id}", json={"dates": ["2021-01-01"]})
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+
+
+def test_sweep(client):
+    sweep_config = {
+        "stock_market": {
+            "start_date": "2021-01-01",
+            "tickers": [{"symbol": "SPY"}],
+        },
+        "signal_detectors": [
+            {"static_name": "Monthly", "config": json.dumps(1)},
+            {"static_name": "Bi-monthly", "config": json.dumps(2)},
+        ],
+        "date": "2021-06-01",
+    }
+    response = client.post("/sweep", json=sweep_config)
+    assert response.status_code == HTTPStatus.OK
+    results = response.json()
+    assert [r["engine_id"] for r in results] == [None, None]
+    monthly, bi_monthly = [json.loads(r["signals"]) for r in results]
+    assert len(bi_monthly) > len(monthly) > 0
+
+    response = client.post("/sweep", json={**sweep_config, "store_engines": True})
+    assert response.status_code == HTTPStatus.OK
+    for result in response.json():
+        response = client.get(f"/signals/{result['engine_id']}")
+        assert response.json() == result["signals"]
+        assert get_date(client, result["engine_id"]) == "2021-06-01"
+
+    # Identical engines are stored once, also by other requests
+    response = client.post(
+        "/sweep",
+        json={
+            **sweep_config,
+            "signal_detectors": sweep_config["signal_detectors"][:1] * 2,
+            "date": "2021-05-03",
+            "store_engines": True,
+        },
+    )
+    engine_ids = [r["engine_id"] for r in response.json()]
+    assert engine_ids[0] == engine_ids[1]
+    engine_config = {
+        "stock_market": sweep_config["stock_market"],
+        "signal_detectors": sweep_config["signal_detectors"][:1],
+    }
+    engine_id = get_engine_id(client.post("/create", json=engine_config))
+    engine_id = client.post(f"/update/{engine_id}", params={"date": "2021-05-03"})
+    assert engine_id.json() == engine_ids[0]
+
+    sweep_config["signal_detectors"].append({"static_name": "Unknown", "config": "1"})
+    response = client.post("/sweep", json=sweep_config)
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+
+
+def test_batch(client):
+    engine_configs = [
+        {
+            "stock_market": {
+                "start_date": "2021-01-01",
+                "tickers": [{"symbol": symbol}],
+            },
+            "signal_detectors": [
+                {"static_name": "Monthly", "config": json.dumps(1)},
+            ],
+        }
+        for symbol in ["SPY", "QQQ"]
+    ]
+    # Identical engines are stored once
+    response = client.post("/engines/create", json=engine_configs + engine_configs[:1])
+    assert response.status_code == HTTPStatus.OK
+    *engine_ids, same_engine_id = response.json()
+    assert len(set(engine_ids)) == 2
+    assert same_engine_id == engine_ids[0]
+
+    response = client.post(
+        "/engines/update",
+        json={"engine_ids": engine_ids + [str(uuid.uuid4())], "date": "2021-03-01"},
+    )
+    assert response.status_code == HTTPStatus.OK
+    *engine_ids, unknown = response.json()
+    assert unknown is None
+
+    response = client.post(
+        "/engines/batch",
+        json={
+            "engine_ids": engine_ids,
+            "fields": ["date", "tickers", "signals", "signal_detectors"],
+        },
+    )
+    assert response.status_code == HTTPStatus.OK
+    spy, qqq = response.json()
+    assert spy["date"] == qqq["date"] == "2021-03-01"
+    assert (spy["tickers"], qqq["tickers"]) == (["SPY"], ["QQQ"])
+    assert len(spy["signal_detectors"]) == 1
+    assert spy["signals"] == client.get(f"/signals/{engine_ids[0]}").json()
+    assert len(json.loads(spy["signals"])) == 3
+
+    response = client.post("/engines/batch", json={"engine_ids": [str(uuid.uuid4())]})
+    assert response.json() == [None]
+
+
+def test_ticker_range_and_formats(client):
+    engine_config = {
+        "stock_market": {
+            "start_date": "2021-01-01",
+            "tickers": [{"symbol": "SPY"}],
+        },
+        "signal_detectors": [],
+    }
+    engine_id = get_engine_id(client.post("/create", json=engine_config))
+    engine_id = client.post(f"/update/{engine_id}", params={"date": "2021-03-01"})
+    engine_id = engine_id.json()
+
+    params = {"start": "2021-02-01", "end": "2021-03-01", "limit": 5}
+    response = client.get(f"/ticker/{engine_id}/SPY", params=params)
+    assert response.status_code == HTTPStatus.OK
+    ohlc = OHLC.from_json(response.json())
+    assert len(ohlc.dates) == 5
+    assert ohlc.start == dt.date(2021, 2, 1)
+
+    response = client.get(
+        f"/ticker/{engine_id}/SPY", params={**params, "format": "ndjson"}
+    )
+    assert response.status_code == HTTPStatus.OK
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row["date"] for row in rows] == [d.isoformat() for d in ohlc.dates]
+    assert [row["close"] for row in rows] == ohlc.close.values.tolist()
+
+    pa = pytest.importorskip("pyarrow")
+    response = client.get(
+        f"/ticker/{engine_id}/SPY", params={**params, "format": "arrow"}
+    )
+    assert response.status_code == HTTPStatus.OK
+    table = pa.ipc.open_stream(response.content).read_all()
+    assert table.column("date").to_pylist() == ohlc.dates.tolist()
+    assert table.column("open").to_pylist() == ohlc.open.values.tolist()
+
+    params = {"start": "2022-01-01"}
+    response = client.get(f"/ticker/{engine_id}/SPY", params=params)
+    assert response.status_code == HTTPStatus.NO_CONTENT
+
+
+def test_signal_filters(client):
+    engine_config = {
+        "stock_market": {
+            "start_date": "2021-01-01",
+            "tickers": [{"symbol": "SPY"}],
+        },
+        "signal_detectors": [
+            {"static_name": "Monthly", "config": json.dumps(1)},
+            {"static_name": "Bi-monthly", "config": json.dumps(2)},
+        ],
+    }
+    engine_id = get_engine_id(client.post("/create", json=engine_config))
+    engine_id = client.post(f"/update/{engine_id}", params={"date": "2021-06-01"})
+    engine_id = engine_id.json()
+
+    def get_signals(**params):
+        response = client.get(f"/signals/{engine_id}", params=params)
+        assert response.status_code == HTTPStatus.OK
+        signals = SignalSequence.from_json(response.json()).signals
+        return signals, response.headers.get("x-next-cursor")
+
+    signals, cursor = get_signals()
+    assert cursor is None
+    assert {s.id for s in signals} == {1, 2}
+
+    filtered, _ = get_signals(detector_id=2, start="2021-03-01", end="2021-05-01")
+    assert filtered == [
+        s
+        for s in signals
+        if s.id == 2 and dt.date(2021, 3, 1) <= s.date < dt.date(2021, 5, 1)
+    ]
+    assert len(filtered) > 0
+
+    pages = []
+    while True:
+        page, cursor = get_signals(limit=2, **({"cursor": cursor} if cursor else {}))
+        pages.append(page)
+        if cursor is None:
+            break
+    assert [s for page in pages for s in page] == signals
+    assert all(len(page) == 2 for page in pages[:-1])
+
+    response = client.get(f"/signals/{engine_id}", params={"cursor": "invalid"})
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+
+
+def test_signals_across_engines(client):
+    engine_config = {
+        "stock_market": {
+            "start_date": "2021-01-01",
+            "tickers": [{"symbol": "SPY"}],
+        },
+        "signal_detectors": [{"static_name": "Monthly", "config": json.dumps(1)}],
+    }
+    engine_id = get_engine_id(client.post("/create", json=engine_config))
+    parent_id = client.post(f"/update/{engine_id}", params={"date": "2021-02-15"})
+    parent_id = parent_id.json()
+    engine_id = client.post(f"/update/{parent_id}", params={"date": "2021-03-15"})
+    engine_id = engine_id.json()
+
+    response = client.get("/signals/date/2021-03-01")
+    assert response.status_code == HTTPStatus.OK
+    [result] = response.json()
+    assert result["engine_id"] == engine_id
+    signals = SignalSequence.from_json(result["signals"]).signals
+    assert [s.date for s in signals] == [dt.date(2021, 3, 1)]
+
+    # The signals of the parent are listed under its newest descendant
+    response = client.get("/signals/date/2021-02-01")
+    assert [r["engine_id"] for r in response.json()] == [engine_id]
+
+    response = client.get("/signals/ticker/SPY", params={"limit": 1})
+    assert response.status_code == HTTPStatus.OK
+    assert len(response.json()) <= 1
+
+
+def test_caching(client, monkeypatch):
+    engine_config = {
+        "stock_market": {
+            "start_date": "2021-01-01",
+            "tickers": [{"symbol": "SPY"}],
+        },
+        "signal_detectors": [{"static_name": "Monthly", "config": json.dumps(1)}],
+    }
+    engine_id = get_engine_id(client.post("/create", json=engine_config))
+    engine_id = client.post(f"/update/{engine_id}", params={"date": "2021-03-01"})
+    engine_id = engine_id.json()
+
+    urls = [
+        f"/getdate/{engine_id}",
+        f"/tickers/{engine_id}",
+        f"/ticker/{engine_id}/SPY",
+        f"/ticker/{engine_id}/SPY?format=ndjson",
+        f"/signals/{engine_id}",
+        f"/signaldetectors/{engine_id}",
+    ]
+    responses = [client.get(url) for url in urls]
+    for response in responses:
+        assert response.status_code == HTTPStatus.OK
+        cache_control = response.headers["cache-control"]
+        assert cache_control.startswith("public, max-age=")
+        assert cache_control.endswith(", immutable")
+        max_age = int(cache_control.split(",")[1].removeprefix(" max-age="))
+        expiration_time = get_settings().redis_engine_expiration_time
+        assert 0 < max_age <= expiration_time.total_seconds()
+    etags = [response.headers["etag"] for response in responses]
+    assert len(set(etags)) == len(urls)
+    assert client.get(urls[0]).headers["etag"] == etags[0]
+
+    response = client.get(f"/getdate/{uuid.uuid4()}", headers={"If-None-Match": "*"})
+    assert response.status_code == HTTPStatus.NO_CONTENT
+    assert "etag" not in response.headers
+
+    # Not modified responses don't load the engine
+    def fail(*args, **kwargs):
+        raise AssertionError("The engine is loaded")
+
+    monkeypatch.setattr("stock_market_engine.api.stock_market.get_engine_view", fail)
+    monkeypatch.setattr("stock_market_engine.api.signal.get_engine_view", fail)
+    for url, etag in zip(urls, etags):
+        response = client.get(url, headers={"If-None-Match": f'"other", {etag}'})
+        assert response.status_code == HTTPStatus.NOT_MODIFIED
+        assert response.headers["etag"] == etag
+        assert response.content == b""
+
+    for url in ["/getsupportedsignaldetectors", "/getsupportedindicators"]:
+        response = client.get(url)
+        assert response.status_code == HTTPStatus.OK
+        assert "immutable" not in response.headers["cache-control"]
+        etag = response.headers["etag"]
+        response = client.get(url, headers={"If-None-Match": etag})
+        assert response.status_code == HTTPStatus.NOT_MODIFIED
+        response = client.get(url, headers={"If-None-Match": '"other"'})
+        assert response.status_code == HTTPStatus.OK
+
+
+def test_metrics(client, monkeypatch):
+    monkeypatch.setattr(get_settings(), "metrics_server_timing", True)
+    engine_config = {
+        "stock_market": {
+            "start_date": "2021-01-01",
+            "tickers": [{"symbol": "IWM"}],
+        },
+        "signal_detectors": [
+            {"static_name": "Monthly", "config": json.dumps(1)},
+        ],
+    }
+    engine_id = get_engine_id(client.post("/create", json=engine_config))
+    response = client.post(f"/update/{engine_id}", params={"date": "2021-02-01"})
+    assert "detect;dur=" in response.headers["Server-Timing"]
+
+    response = client.get("/metrics")
+    assert response.status_code == HTTPStatus.OK
+    metrics = response.text
+    for sample in [
+        'sme_request_duration_seconds_count{endpoint="update_engine"}',
+        'sme_phase_duration_seconds_count{endpoint="update_engine",phase="fetch"}',
+        'sme_phase_duration_seconds_count{endpoint="create_engine",phase="redis"}',
+        'sme_payload_bytes_count{endpoint="create_engine",phase="write"}',
+        'sme_detector_duration_seconds_count{detector="Monthly"}',
+        'sme_fetcher_duration_seconds_count{fetcher="csv"}',
+        "sme_engine_cache_hits_total",
+    ]:
+        assert sample in metrics
+
+
+def wait_for_job(client, job_id):
+    for _ in range(100):
+        response = client.get(f"/jobs/{job_id}")
+        assert response.status_code == HTTPStatus.OK
+        job = response.json()
+        if job["status"] in ["done", "failed"]:
+            return job
+        time.sleep(0.05)
+    raise TimeoutError(job_id)
+
+
+def test_async_mode(running_client):
+    client = running_client
+    engine_config = {
+        "stock_market": {
+            "start_date": "2021-01-01",
+            "tickers": [{"symbol": "VOO"}],
+        },
+        "signal_detectors": [],
+    }
+    engine_id = get_engine_id(client.post("/create", json=engine_config))
+
+    params = {"date": "2021-02-01", "mode": "async"}
+    response = client.post(f"/update/{engine_id}", params=params)
+    assert response.status_code == HTTPStatus.ACCEPTED
+    job_id = response.json()["job_id"]
+    assert client.post(f"/update/{engine_id}", params=params).json() == {
+        "job_id": job_id
+    }
+
+    job = wait_for_job(client, job_id)
+    assert job["status"] == "done"
+    assert get_date(client, job["result"]) == "2021-02-01"
+
+    response = client.post(f"/addticker/{job['result']}/SH", params={"mode": "async"})
+    assert response.status_code == HTTPStatus.ACCEPTED
+    job = wait_for_job(client, response.json()["job_id"])
+    response = client.get(f"/tickers/{job['result']}")
+    assert response.json() == ["SH", "VOO"]
+
+    assert client.get("/jobs/unknown").status_code == HTTPStatus.NOT_FOUND
+
+
+def test_scheduler(client):
+    engine_config = {
+        "stock_market": {
+            "start_date": "2021-01-01",
+            "tickers": [{"symbol": "DIA"}],
+        },
+        "signal_detectors": [],
+    }
+    engine_id = get_engine_id(client.post("/create", json=engine_config))
+    response = client.post(f"/subscribe/{engine_id}")
+    assert response.status_code == HTTPStatus.OK
+    subscription_id = response.json()
+
+    response = client.post("/scheduler/run", params={"date": "2021-02-01"})
+    assert response.status_code == HTTPStatus.OK
+    new_engine_id = response.json()[subscription_id]
+    assert client.get(f"/subscriptions/{subscription_id}").json() == new_engine_id
+    assert get_date(client, new_engine_id) == "2021-02-01"
+
+    response = client.post("/scheduler/run", params={"date": "2021-02-01"})
+    assert response.status_code == HTTPStatus.CONFLICT
+
+    assert client.post(f"/unsubscribe/{subscription_id}").status_code == HTTPStatus.OK
+    response = client.get(f"/subscriptions/{subscription_id}")
+    assert response.status_code == HTTPStatus.NOT_FOUND
+    response = client.post(f"/subscribe/{uuid.uuid4()}")
+    assert response.status_code == HTTPStatus.NO_CONTENT
+
+
+async def test_engine_events(monkeypatch):
+    monkeypatch.setattr(get_settings(), "stock_updater", "csv")
+    monkeypatch.setattr(get_settings(), "stock_updater_config", json.dumps(DATA_DIR))
+    redis = app.state.redis = FakeRedis()
+    engine_config = EngineModel(
+        stock_market={"start_date": "2021-01-01", "tickers": [{"symbol": "SPY"}]},
+        signal_detectors=[{"static_name": "Monthly", "config": json.dumps(1)}],
+    )
+    engine = engine_config.create(
+        get_stock_updater_factory(), get_signal_detector_factory()
+    )
+    engine_id = await store_engine(await engine.update(dt.date(2021, 2, 1)), redis)
+
+    [get_engine_events] = [
+        route.endpoint for route in app.routes if route.path == "/events/{engine_id}"
+    ]
+    response = await get_engine_events(engine_id)
+    assert response.media_type == "text/event-stream"
+    assert (await get_engine_events(uuid.uuid4())).status_code == HTTPStatus.NO_CONTENT
+
+    async def next_event():
+        async for event in response.body_iterator:
+            if not event.startswith(":"):
+                return event
+
+    event = asyncio.ensure_future(next_event())
+    await asyncio.sleep(0.01)
+    new_engine = await engine.update(dt.date(2021, 3, 2))
+    new_engine_id = await store_engine(new_engine, redis, engine_id)
+
+    event = await asyncio.wait_for(event, 1)
+    lines = event.strip().split("\n")
+    assert lines[:2] == [f"id: {new_engine_id}", "event: engine"]
+    data = json.loads(lines[2].removeprefix("data: "))
+    assert data["engine_id"] == str(new_engine_id)
+    assert data["parent_id"] == str(engine_id)
+    assert data["date"] == "2021-03-02"
+    signals = SignalSequence.from_json(data["signals"])
+    # Only the signals added to the parent engine
+    assert [s.date for s in signals.signals] == [dt.date(2021, 3, 1)]
+    await response.body_iterator.aclose()
@@ -0,0 +1,105 @@
+import datetime as dt
+import os
+import pickle
+
+import numpy as np
+import pytest
+from stock_market.core import StockMarket, StockUpdater, Ticker
+from stock_market.ext.signal import GoldenCrossSignalDetector, MonthlySignalDetector
+
+from stock_market_engine.columnar_market import ColumnarMarket, market_columns
+from stock_market_engine.engine import Engine
+from stock_market_engine.engine_cache import OHLC_ROW_SIZE
+from stock_market_engine.fetcher import CsvOHLCFetcher
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), os.pardir, "data")
+
+
+@pytest.fixture
+def stock_updater():
+    return StockUpdater(CsvOHLCFetcher(DATA_DIR))
+
+
+@pytest.fixture
+def tickers():
+    return [Ticker("SPY"), Ticker("QQQ")]
+
+
+@pytest.fixture
+async def stock_market(stock_updater, tickers):
+    return await stock_updater.update(
+        dt.date(2021, 1, 1), StockMarket(dt.date(2020, 1, 1), tickers)
+    )
+
+
+async def test_from_stock_market(stock_market, tickers):
+    market = ColumnarMarket.from_stock_market(stock_market)
+    assert market == stock_market
+    assert market.date == stock_market.date
+    assert market.tickers == stock_market.tickers
+    for ticker in tickers:
+        assert market.ohlc(ticker) == stock_market.ohlc(ticker)
+        # The OHLC is shared while referenced
+        assert market.ohlc(ticker) is market.ohlc(ticker)
+    assert market.ohlc(Ticker("DIA")) is None
+
+    # SPY and QQQ trade on the same days, their dates are stored once
+    spy, qqq = [market.columns(t) for t in tickers]
+    assert spy[0] is qqq[0]
+    rows = len(spy[0])
+    assert market.nbytes == rows * 8 * 9
+    assert market.nbytes < 2 * rows * OHLC_ROW_SIZE / 5
+
+
+async def test_float32(stock_market, tickers):
+    market = ColumnarMarket.from_stock_market(stock_market, np.float32)
+    assert market.nbytes < ColumnarMarket.from_stock_market(stock_market).nbytes
+    for ticker in tickers:
+        assert np.allclose(
+            market.ohlc(ticker).close.values, stock_market.ohlc(ticker).close.values
+        )
+
+
+async def test_pickle(stock_market, tickers):
+    market = ColumnarMarket.from_stock_market(stock_market, np.float32)
+    ohlcs = [market.ohlc(t) for t in tickers]
+    unpickled = pickle.loads(pickle.dumps(market))
+    assert unpickled == market
+    assert unpickled.dtype == market.dtype
+    # The shared date arrays remain shared
+    assert unpickled.nbytes == market.nbytes
+    assert [unpickled.ohlc(t) for t in tickers] == ohlcs
+
+
+async def test_mutations(stock_market, stock_updater, tickers):
+    market = ColumnarMarket.from_stock_market(stock_market)
+    date = dt.date(2021, 3, 1)
+    updated = await stock_updater.update(date, market)
+    assert isinstance(updated, ColumnarMarket)
+    assert updated == await stock_updater.update(date, stock_market)
+
+    removed = market.remove_ticker(tickers[0])
+    assert isinstance(removed, ColumnarMarket)
+    assert removed == stock_market.remove_ticker(tickers[0])
+    added = removed.add_ticker(Ticker("DIA"))
+    assert added.tickers == [Ticker("DIA"), tickers[1]]
+    assert market_columns(added, Ticker("DIA")) is None
+    # The columns are shared, not copied
+    for column, added_column in zip(
+        market.columns(tickers[1]), market_columns(added, tickers[1])
+    ):
+        assert column is added_column
+
+
+async def test_engine(stock_market, stock_updater, tickers):
+    engine = Engine(
+        stock_market,
+        stock_updater,
+        [MonthlySignalDetector(1), GoldenCrossSignalDetector(2, tickers[0])],
+    )
+    date = dt.date(2021, 6, 1)
+    expected = await engine.update(date)
+    updated = await engine.compact().update(date)
+    assert isinstance(updated.stock_market, ColumnarMarket)
+    assert updated.signals == expected.signals
+    assert updated.to_json() == expected.to_json()
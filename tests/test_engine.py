@@ -1,5 +1,7 @@
 import datetime
 import json
+import os
+import threading
 
 import pandas as pd
 import pytest
@@ -15,14 +17,25 @@ from stock_market.core import (
     Ticker,
     add_signal,
 )
+from stock_market.ext.signal import (
+    DeathCrossSignalDetector,
+    GoldenCrossSignalDetector,
+    MonthlySignalDetector,
+)
 
+from stock_market_engine.config import get_settings
 from stock_market_engine.engine import (
     Engine,
     add_signal_detector,
     add_ticker,
     remove_signal_detector,
     remove_ticker,
+    step,
 )
+from stock_market_engine.executor import get_executor, shutdown_executor
+from stock_market_engine.fetcher import CsvOHLCFetcher
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), os.pardir, "data")
 
 
 class DummyFetcher(OHLCFetcher):
@@ -57,6 +70,20 @@ class DummyFetcher(OHLCFetcher):
         return {}
 
 
+class RecordingFetcher(DummyFetcher):
+    def __init__(self):
+        super().__init__()
+        self.requests = []
+
+    async def fetch_ohlc(self, requests):
+        self.requests.extend(requests)
+        results = []
+        for request in requests:
+            [(_, ohlc)] = await super().fetch_ohlc([request])
+            results.append((request[2], ohlc))
+        return results
+
+
 class DummyMonthlySignalDetector(SignalDetector):
     def __init__(self):
         super().__init__(1, "DummyDetector")
@@ -91,6 +118,20 @@ class DummyMonthlySignalDetector(SignalDetector):
         return "DummyDetector"
 
 
+class RecordingSignalDetector(SignalDetector):
+    def __init__(self):
+        super().__init__(2, "RecordingDetector")
+        self.detected_ranges = []
+
+    def detect(self, from_date, to_date, stock_market, sequence):
+        self.detected_ranges.append((from_date, to_date))
+        return sequence
+
+    @staticmethod
+    def NAME():
+        return "RecordingDetector"
+
+
 @pytest.fixture
 def spy():
     return Ticker("SPY")
@@ -126,6 +167,131 @@ async def test_update(engine, spy):
     assert 4 == last_spy_time_value.value
 
 
+async def test_update_detects_new_days_only(stock_market, stock_updater, date):
+    detector = RecordingSignalDetector()
+    engine = Engine(stock_market, stock_updater, [detector])
+    engine = await engine.update(datetime.date(2000, 5, 1))
+    engine = await engine.update(datetime.date(2000, 5, 3))
+    assert detector.detected_ranges == [
+        (date, datetime.date(2000, 5, 1)),
+        (datetime.date(2000, 5, 1), datetime.date(2000, 5, 3)),
+    ]
+    # The market data of the update date is fetched by the next update
+    assert engine.detection_dates == [datetime.date(2000, 5, 2)]
+
+
+async def test_daily_updates(spy):
+    detectors = [
+        MonthlySignalDetector(1),
+        GoldenCrossSignalDetector(2, spy),
+        DeathCrossSignalDetector(3, spy),
+    ]
+    engine = Engine(
+        StockMarket(datetime.date(2005, 1, 1), [spy]),
+        StockUpdater(CsvOHLCFetcher(DATA_DIR)),
+        detectors,
+    )
+    end = datetime.date(2006, 9, 1)
+    expected = await engine.update(end)
+
+    date = datetime.date(2006, 6, 2)
+    while date <= end:
+        engine = await engine.update(date)
+        date += datetime.timedelta(days=1)
+    assert engine.signals == expected.signals
+    assert engine.detection_dates == expected.detection_dates
+    assert [s.date for s in engine.signals.signals if s.id != 1] == [
+        datetime.date(2005, 10, 10),
+        datetime.date(2006, 7, 25),
+        datetime.date(2006, 8, 29),
+    ]
+
+
+async def test_update_detects_off_event_loop(stock_market, stock_updater):
+    threads = []
+
+    class ThreadRecordingSignalDetector(RecordingSignalDetector):
+        def detect(self, from_date, to_date, stock_market, sequence):
+            threads.append(threading.current_thread())
+            return sequence
+
+    engine = Engine(
+        stock_market,
+        stock_updater,
+        [ThreadRecordingSignalDetector(), ThreadRecordingSignalDetector()],
+    )
+    await engine.update(datetime.date(2000, 5, 1))
+    assert len(threads) == 2
+    assert threading.main_thread() not in threads
+
+
+@pytest.mark.parametrize("executor", ["process", "none"])
+async def test_update_in_executor(engine, executor, monkeypatch):
+    monkeypatch.setattr(get_settings(), "executor", executor)
+    shutdown_executor()
+    try:
+        engine = await engine.update(datetime.date(2000, 5, 1))
+        assert 3 == len(engine.signals.signals)
+    finally:
+        shutdown_executor()
+    monkeypatch.undo()
+    assert get_executor() is not None
+
+
+async def test_step(spy):
+    class CountingFetcher(CsvOHLCFetcher):
+        def __init__(self):
+            super().__init__(DATA_DIR)
+            self.fetches = 0
+
+        async def fetch_ohlc(self, requests):
+            self.fetches += 1
+            return await super().fetch_ohlc(requests)
+
+    fetcher = CountingFetcher()
+    engine = Engine(
+        StockMarket(datetime.date(2021, 1, 1), [spy]),
+        StockUpdater(fetcher),
+        [DummyMonthlySignalDetector()],
+    )
+    dates = [datetime.date(2021, 1, 5), datetime.date(2021, 2, 2)]
+    dates.append(datetime.date(2021, 3, 3))
+    steps = [e async for e in step(engine, dates)]
+    assert fetcher.fetches == 1
+
+    for date, stepped in zip(dates, steps):
+        engine = await engine.update(date)
+        assert stepped.date == engine.date
+        assert stepped.stock_market == engine.stock_market
+        assert stepped.signals == engine.signals
+        assert stepped.detection_dates == engine.detection_dates
+    assert len(steps[-1].signals.signals) == 3
+
+
+async def test_step_boundaries(spy):
+    engine = Engine(
+        StockMarket(datetime.date(2005, 1, 1), [spy]),
+        StockUpdater(CsvOHLCFetcher(DATA_DIR)),
+        [GoldenCrossSignalDetector(1, spy), DeathCrossSignalDetector(2, spy)],
+    )
+    # Steps on and right after the days of the crosses
+    dates = [
+        datetime.date(2006, 7, 25),
+        datetime.date(2006, 7, 26),
+        datetime.date(2006, 8, 29),
+        datetime.date(2006, 8, 30),
+        datetime.date(2006, 9, 1),
+    ]
+    steps = [e async for e in step(engine, dates)]
+    expected = await engine.update(dates[-1])
+    assert steps[-1].signals == expected.signals
+    assert [s.date for s in expected.signals.signals] == [
+        datetime.date(2005, 10, 10),
+        datetime.date(2006, 7, 25),
+        datetime.date(2006, 8, 29),
+    ]
+
+
 async def test_json(engine):
     factory = Factory()
     factory.register(
@@ -144,29 +310,67 @@ async def test_json(engine):
     assert engine.stock_market == from_json.stock_market
     assert engine.signals == from_json.signals
     assert engine.signal_detectors == from_json.signal_detectors
+    assert engine.detection_dates == from_json.detection_dates
 
 
-async def test_add_ticker(engine):
+@pytest.fixture
+def recording_engine(stock_market):
+    """Engine updated to a date, recording the fetches and detections after."""
+
+    async def create():
+        fetcher = RecordingFetcher()
+        detector = RecordingSignalDetector()
+        engine = Engine(
+            stock_market,
+            StockUpdater(fetcher),
+            [DummyMonthlySignalDetector(), detector],
+        )
+        engine = await engine.update(datetime.date(2000, 5, 1))
+        fetcher.requests.clear()
+        detector.detected_ranges.clear()
+        return engine, fetcher, detector
+
+    return create
+
+
+async def test_add_ticker(recording_engine, spy):
+    engine, fetcher, detector = await recording_engine()
     QQQ = Ticker("QQQ")
-    engine = await add_ticker(engine, QQQ)
-    assert QQQ in engine.stock_market.tickers
-
-
-async def test_remove_ticker(engine, spy):
-    engine = await remove_ticker(engine, spy)
-    assert spy not in engine.stock_market.tickers
-
-
-async def test_add_signal_detector(stock_market, stock_updater):
-    detector = DummyMonthlySignalDetector()
-    engine = Engine(stock_market, stock_updater, [])
-    engine = await add_signal_detector(engine, detector)
-    assert detector in engine.signal_detectors
-
-
-async def test_remove_signal_detector(stock_market, stock_updater):
-    detector = DummyMonthlySignalDetector()
-    engine = Engine(stock_market, stock_updater, [])
-    engine = await add_signal_detector(engine, detector)
-    engine = await remove_signal_detector(engine, detector.id)
-    assert detector not in engine.signal_detectors
+    new_engine = await add_ticker(engine, QQQ)
+    assert QQQ in new_engine.stock_market.tickers
+    assert new_engine.stock_market.ohlc(spy) is engine.stock_market.ohlc(spy)
+    # Only the added ticker is fetched, nothing new is detected
+    assert fetcher.requests == [(engine.stock_market.start_date, engine.date, QQQ)]
+    assert detector.detected_ranges == []
+    assert new_engine.signals == engine.signals
+
+
+async def test_remove_ticker(recording_engine, spy):
+    engine, fetcher, detector = await recording_engine()
+    new_engine = await remove_ticker(engine, spy)
+    assert spy not in new_engine.stock_market.tickers
+    assert new_engine.signals == engine.signals
+    assert fetcher.requests == []
+    assert detector.detected_ranges == []
+
+
+async def test_add_signal_detector(recording_engine):
+    engine, fetcher, detector = await recording_engine()
+    engine = await remove_signal_detector(engine, 1)
+    new_detector = DummyMonthlySignalDetector()
+    new_engine = await add_signal_detector(engine, new_detector)
+    assert new_detector in new_engine.signal_detectors
+    assert len(new_engine.signals.signals) == 3
+    assert new_engine.detection_dates == engine.detection_dates * 2
+    # Only the added detector detects
+    assert fetcher.requests == []
+    assert detector.detected_ranges == []
+
+
+async def test_remove_signal_detector(recording_engine):
+    engine, fetcher, detector = await recording_engine()
+    new_engine = await remove_signal_detector(engine, 1)
+    assert [d.id for d in new_engine.signal_detectors] == [detector.id]
+    assert new_engine.signals.signals == []
+    assert fetcher.requests == []
+    assert detector.detected_ranges == []
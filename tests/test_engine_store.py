@@ -0,0 +1,777 @@
+import asyncio
+import datetime as dt
+import json
+import uuid
+
+import pandas as pd
+import pytest
+from fakeredis.aioredis import FakeRedis
+from stock_market.core import (
+    OHLC,
+    Sentiment,
+    Signal,
+    SignalSequence,
+    StockMarket,
+    StockUpdater,
+    Ticker,
+    TickerOHLC,
+)
+from stock_market.ext.fetcher import YahooOHLCFetcher
+from stock_market.ext.signal import BiMonthlySignalDetector, MonthlySignalDetector
+
+from stock_market_engine.columnar_market import ColumnarMarket
+from stock_market_engine.config import get_settings
+from stock_market_engine.engine import Engine
+from stock_market_engine.engine_cache import (
+    EngineCache,
+    estimate_engine_size,
+    get_engine_cache,
+)
+from stock_market_engine.engine_store import (
+    get_engine,
+    get_engine_hash,
+    get_engine_view,
+    get_engine_views,
+    get_or_create_engine,
+    store_engine,
+    store_engines,
+)
+from stock_market_engine.engine_view import EngineView, added_signals
+from stock_market_engine.lineage import get_lineage, lineage_events
+from stock_market_engine.ohlc_store import ohlc_from_chunks
+from stock_market_engine.signal_index import (
+    SignalQuery,
+    date_index_key,
+    owner_key,
+    signal_index_key,
+    signals_on_date,
+    signals_on_ticker,
+)
+from stock_market_engine.single_flight import SingleFlight
+
+
+@pytest.fixture(autouse=True)
+def engine_cache():
+    get_engine_cache().clear()
+    return get_engine_cache()
+
+
+@pytest.fixture
+def redis():
+    return FakeRedis()
+
+
+@pytest.fixture
+def spy():
+    return Ticker("SPY")
+
+
+@pytest.fixture
+def qqq():
+    return Ticker("QQQ")
+
+
+@pytest.fixture
+def engine(spy, qqq):
+    start_date = dt.date(2000, 1, 1)
+    end_date = dt.date(2000, 3, 1)
+    dates = pd.Series(pd.date_range(start_date, end_date))
+    ohlc = OHLC(
+        dates,
+        pd.Series(range(len(dates))) + 0.5,
+        pd.Series(range(len(dates))) + 0.5,
+        pd.Series(range(len(dates))) + 0.5,
+        pd.Series(range(len(dates))) + 0.5,
+    )
+    stock_market = StockMarket(start_date, [spy, qqq]).update_ticker(
+        TickerOHLC(spy, ohlc)
+    )
+    detector = MonthlySignalDetector(1)
+    sequence = detector.detect(start_date, end_date, stock_market, SignalSequence())
+    return Engine(
+        stock_market,
+        StockUpdater(YahooOHLCFetcher()),
+        [detector],
+        [sequence],
+        end_date,
+    )
+
+
+async def test_store_and_get_engine(engine, redis):
+    engine_id = await store_engine(engine, redis)
+    stored_engine = await get_engine(engine_id, redis)
+    assert engine.stock_market == stored_engine.stock_market
+    assert engine.signals == stored_engine.signals
+    assert engine.signal_detectors == stored_engine.signal_detectors
+    assert engine.date == stored_engine.date
+
+
+async def test_store_engine_cache_hit(engine, redis):
+    engine_id = await store_engine(engine, redis)
+    assert str(engine_id) == await store_engine(engine, redis)
+
+
+async def test_engine_view(engine, redis, spy, qqq, engine_cache):
+    engine_id = await store_engine(engine, redis)
+    engine_cache.clear()
+    view = await get_engine_view(engine_id, redis)
+    assert view.date == engine.date
+    assert view.start_date == engine.stock_market.start_date
+    assert view.tickers == engine.stock_market.tickers
+    assert await view.ohlc(spy) == engine.stock_market.ohlc(spy)
+    assert await view.ohlc(qqq) is None
+    assert await view.signals() == engine.signals
+
+
+async def test_engine_views(engine, redis, engine_cache):
+    engine_id = await store_engine(engine, redis)
+    cached_engine = Engine(
+        engine.stock_market,
+        engine.stock_market_updater,
+        engine.signal_detectors,
+        engine.signal_sequences,
+        engine.date + dt.timedelta(days=1),
+    )
+    cached_engine_id = await store_engine(cached_engine, redis)
+    blob_engine_id = uuid.uuid4()
+    await redis.set(str(blob_engine_id), engine.to_json())
+    engine_cache.clear()
+    await get_engine(cached_engine_id, redis)
+
+    engine_ids = [engine_id, uuid.uuid4(), cached_engine_id, blob_engine_id]
+    views = await get_engine_views(engine_ids, redis, load_signals=True)
+    assert views[1] is None
+    await redis.flushall()
+    for view in [views[0], views[2], views[3]]:
+        assert await view.signals() == engine.signals
+    assert [views[0].date, views[2].date] == [engine.date, cached_engine.date]
+
+
+async def test_get_engine_single_blob(engine, redis):
+    engine_id = uuid.uuid4()
+    await redis.set(str(engine_id), engine.to_json())
+    stored_engine = await get_engine(engine_id, redis)
+    assert engine.stock_market == stored_engine.stock_market
+    assert engine.signals == stored_engine.signals
+
+
+async def test_ohlc_chunks_are_shared(engine, redis, spy):
+    await store_engine(engine, redis)
+    chunk_keys = set(await redis.keys("ohlc:*"))
+    assert len(chunk_keys) == 1
+
+    new_engine = Engine(
+        engine.stock_market,
+        engine.stock_market_updater,
+        [],
+        [],
+        engine.date,
+    )
+    await store_engine(new_engine, redis)
+    assert set(await redis.keys("ohlc:*")) == chunk_keys
+
+
+async def test_ohlc_chunks_per_year(redis, spy):
+    dates = pd.Series(pd.date_range(dt.date(1999, 12, 30), dt.date(2001, 1, 2)))
+    values = pd.Series(range(len(dates))) + 0.5
+    ohlc = OHLC(dates, values, values, values, values)
+    stock_market = StockMarket(dt.date(1999, 12, 30), [spy]).update_ticker(
+        TickerOHLC(spy, ohlc)
+    )
+    engine = Engine(stock_market, StockUpdater(YahooOHLCFetcher()), [])
+    engine_id = await store_engine(engine, redis)
+    metadata = json.loads(await redis.get(str(engine_id)))
+    assert metadata["ohlc_years"][spy.symbol] == [1999, 2000, 2001]
+    chunk_keys = metadata["ohlc"][spy.symbol]
+    assert ohlc_from_chunks(await redis.mget(chunk_keys)) == ohlc
+
+
+async def test_engine_view_ohlc_range(redis, spy, engine_cache):
+    dates = pd.Series(pd.date_range(dt.date(1999, 12, 30), dt.date(2001, 1, 2)))
+    values = pd.Series(range(len(dates))) + 0.5
+    ohlc = OHLC(dates, values, values, values, values)
+    stock_market = StockMarket(dt.date(1999, 12, 30), [spy]).update_ticker(
+        TickerOHLC(spy, ohlc)
+    )
+    engine = Engine(stock_market, StockUpdater(YahooOHLCFetcher()), [])
+    engine_id = await store_engine(engine, redis)
+    engine_cache.clear()
+
+    view = await get_engine_view(engine_id, redis, cache=False)
+    # Expires the chunk of 2000
+    metadata = json.loads(await redis.get(str(engine_id)))
+    await redis.delete(metadata["ohlc"][spy.symbol][1])
+
+    def rows(ohlc):
+        return list(zip(ohlc.dates, ohlc.close.values))
+
+    start, end = dt.date(2001, 1, 1), dt.date(2001, 1, 2)
+    assert rows(await view.ohlc(spy, start, end)) == rows(ohlc.trim(start, end))
+    assert rows(await view.ohlc(spy, end=dt.date(1999, 12, 31))) == rows(
+        ohlc.trim(ohlc.start, dt.date(1999, 12, 31))
+    )
+    assert await view.ohlc(spy, start=dt.date(2002, 1, 1)) is None
+    assert await view.ohlc(spy, dt.date(2000, 6, 1), dt.date(2000, 6, 2)) is None
+
+
+async def test_engine_view_ohlc_columns(redis, spy, engine_cache):
+    dates = pd.Series(pd.date_range(dt.date(1999, 12, 30), dt.date(2001, 1, 2)))
+    values = pd.Series(range(len(dates))) + 0.5
+    ohlc = OHLC(dates, values, values, values, values)
+    stock_market = StockMarket(dt.date(1999, 12, 30), [spy]).update_ticker(
+        TickerOHLC(spy, ohlc)
+    )
+    engine = Engine(stock_market, StockUpdater(YahooOHLCFetcher()), [])
+    engine_id = await store_engine(engine, redis)
+    engine_cache.clear()
+    view = await get_engine_view(engine_id, redis, cache=False)
+
+    async def closes(*args):
+        return [c[4].tolist() async for c in view.ohlc_columns(spy, *args)]
+
+    # A chunk per year, trimmed to the range
+    start = dt.date(1999, 12, 31)
+    assert await closes(start) == [
+        ohlc.trim(start, dt.date(2000, 1, 1)).close.values.tolist(),
+        ohlc.trim(dt.date(2000, 1, 1), dt.date(2001, 1, 1)).close.values.tolist(),
+        ohlc.trim(dt.date(2001, 1, 1), dt.date(2001, 1, 3)).close.values.tolist(),
+    ]
+    assert await closes(None, dt.date(2000, 1, 2), 3) == [[0.5, 1.5], [2.5]]
+    assert await closes(dt.date(2002, 1, 1)) == []
+
+
+def test_ohlc_json_chunks():
+    dates = pd.Series(pd.date_range(dt.date(2000, 1, 1), dt.date(2000, 1, 10)))
+    values = pd.Series(range(len(dates))) + 0.5
+    ohlc = OHLC(dates, values, values, values, values)
+    json_chunk = json.dumps(
+        {
+            "dates": [d.isoformat() for d in ohlc.dates],
+            **{c: values.tolist() for c in ["open", "high", "low", "close"]},
+        }
+    ).encode("utf-8")
+    assert ohlc_from_chunks([json_chunk]) == ohlc
+
+
+async def test_get_engine_cached(engine, redis, engine_cache):
+    engine_id = await store_engine(engine, redis)
+    engine_cache.clear()
+    stored_engine = await get_engine(engine_id, redis)
+    assert engine_cache.misses == 1
+    # The cache holds the engine with its market data as columns
+    cached_engine = await get_engine(engine_id, redis)
+    assert isinstance(cached_engine.stock_market, ColumnarMarket)
+    assert cached_engine.stock_market == stored_engine.stock_market
+    assert await get_engine(engine_id, redis) is cached_engine
+    assert (await get_engine_view(engine_id, redis)).date == engine.date
+    assert engine_cache.hits == 3
+
+
+async def test_get_engine_view_cached(engine, redis, engine_cache):
+    engine_id = await store_engine(engine, redis)
+    other_date = engine.date + dt.timedelta(days=1)
+    other = Engine(
+        engine.stock_market,
+        engine.stock_market_updater,
+        engine.signal_detectors,
+        engine.signal_sequences,
+        other_date,
+    )
+    other_id = await store_engine(other, redis)
+    engine_cache.clear()
+    assert (await get_engine_view(engine_id, redis)).date == engine.date
+    assert (await get_engine_view(engine_id, redis)).date == engine.date
+    assert (engine_cache.misses, engine_cache.hits) == (1, 1)
+
+    # Engines read together are cached as well
+    views = await get_engine_views([engine_id, other_id, uuid.uuid4()], redis)
+    assert [view.date for view in views[:2]] == [engine.date, other_date]
+    assert views[2] is None
+    assert len(engine_cache) == 2
+    assert engine_cache.misses == 3
+    await get_engine_views([engine_id, other_id], redis)
+    assert engine_cache.misses == 3
+
+    # Lazy views don't load the engine
+    engine_cache.clear()
+    assert (await get_engine_view(engine_id, redis, cache=False)).date == engine.date
+    assert len(engine_cache) == 0
+
+
+def test_engine_cache_size_bound(engine):
+    size = estimate_engine_size(engine)
+    cache = EngineCache(2 * size)
+    for i in range(3):
+        cache.put(i, engine, 60)
+    assert len(cache) == 2
+    assert cache.size == 2 * size
+    assert cache.get(0) is None
+    assert cache.get(2) is engine
+
+
+async def test_get_or_create_engine_once(engine, redis):
+    created = []
+
+    async def create():
+        created.append(engine)
+        await asyncio.sleep(0.01)
+        return engine
+
+    engine_ids = await asyncio.gather(
+        *[get_or_create_engine("engine_hash", create, redis) for _ in range(3)]
+    )
+    assert len(created) == 1
+    assert len(set(map(str, engine_ids))) == 1
+
+
+async def test_single_flight_across_workers(redis):
+    calls = []
+
+    async def work():
+        calls.append(None)
+        await asyncio.sleep(0.05)
+        return "result"
+
+    workers = [SingleFlight(dt.timedelta(seconds=10), 0.01) for _ in range(2)]
+    results = await asyncio.gather(*[w.run("key", work, redis) for w in workers])
+    assert results == ["result", "result"]
+    assert len(calls) == 1
+
+
+async def test_store_engines(engine, redis):
+    other = Engine(
+        engine.stock_market,
+        engine.stock_market_updater,
+        [],
+        [],
+        engine.date,
+    )
+    first, second = await asyncio.gather(
+        store_engines([engine, other, engine], redis), store_engines([engine], redis)
+    )
+    first, second = [str(i) for i in first], [str(i) for i in second]
+    assert first[0] == first[2] == second[0]
+    assert first[1] != first[0]
+    assert [str(i) for i in await store_engines([other], redis)] == [first[1]]
+
+
+async def test_single_flight_keeps_lock_of_other_worker(redis):
+    async def work():
+        # The lock expired and another worker acquired it meanwhile
+        await redis.set("lock:key", "other worker")
+        return "result"
+
+    worker = SingleFlight(dt.timedelta(seconds=10), 0.01)
+    assert await worker.run("key", work, redis) == "result"
+    assert await redis.get("lock:key") == b"other worker"
+
+
+async def test_get_or_create_engine_stored(engine, redis):
+    engine_id = await store_engine(engine, redis)
+    engine_hash = get_engine_hash(
+        engine.stock_market.start_date,
+        engine.stock_market.tickers,
+        engine.signal_detectors,
+        engine.date,
+    )
+    assert await redis.ttl(engine_hash) > 0
+
+    async def create():
+        assert False, "Stored engine should not be recreated"
+
+    assert await get_or_create_engine(engine_hash, create, redis) == str(engine_id)
+
+
+def derive(engine, days):
+    return Engine(
+        engine.stock_market,
+        engine.stock_market_updater,
+        engine.signal_detectors,
+        engine.signal_sequences,
+        engine.date + dt.timedelta(days=days),
+    )
+
+
+async def test_lineage(engine, redis):
+    root_id = await store_engine(engine, redis)
+    child_id = await store_engine(derive(engine, 1), redis, root_id)
+
+    async def create():
+        return derive(engine, 2)
+
+    grandchild_id = await get_or_create_engine("engine_hash", create, redis, child_id)
+
+    assert await get_lineage(root_id, redis) == {
+        "id": str(root_id),
+        "parent": None,
+        "root": str(root_id),
+    }
+    assert await get_lineage(grandchild_id, redis) == {
+        "id": str(grandchild_id),
+        "parent": str(child_id),
+        "root": str(root_id),
+    }
+
+
+async def test_lineage_events(engine, redis):
+    root_id = await store_engine(engine, redis)
+    events = lineage_events(str(root_id), redis, keepalive_interval=0.01)
+    # Subscribes, times out without events
+    assert await events.__anext__() is None
+
+    child_id = await store_engine(derive(engine, 1), redis, root_id)
+    event = None
+    while event is None:
+        event = await asyncio.wait_for(events.__anext__(), 1)
+    assert event == {"engine_id": str(child_id), "parent_id": str(root_id)}
+    await events.aclose()
+
+
+def advance(engine, days):
+    """Returns the engine with days of OHLC data and signals appended."""
+    spy = Ticker("SPY")
+    ohlc = engine.stock_market.ohlc(spy)
+    dates = pd.Series(pd.date_range(ohlc.start, ohlc.end + dt.timedelta(days=days)))
+    values = pd.Series(range(len(dates))) + 0.5
+    stock_market = engine.stock_market.update_ticker(
+        TickerOHLC(spy, OHLC(dates, values, values, values, values))
+    )
+    date = engine.date + dt.timedelta(days=days)
+    [detector] = engine.signal_detectors
+    sequence = detector.detect(
+        engine.date + dt.timedelta(days=1),
+        date,
+        stock_market,
+        engine.signal_sequences[0],
+    )
+    return Engine(
+        stock_market, engine.stock_market_updater, [detector], [sequence], date
+    )
+
+
+async def get_metadata(engine_id, redis):
+    return json.loads(await redis.get(str(engine_id)))
+
+
+async def test_delta_storage(engine, redis, engine_cache):
+    parent_id = await store_engine(engine, redis)
+    keys = set(await redis.keys())
+
+    child = advance(engine, 31)
+    child_id = await store_engine(child, redis, parent_id)
+
+    parent_metadata = await get_metadata(parent_id, redis)
+    metadata = await get_metadata(child_id, redis)
+    # The child references the parts of its parent, and adds the appended data
+    assert metadata["ohlc"]["SPY"][:-1] == parent_metadata["ohlc"]["SPY"]
+    assert metadata["ohlc_rows"]["SPY"] == [61, 31]
+    assert metadata["signals"][0][:-1] == parent_metadata["signals"][0]
+    assert metadata["signal_lengths"] == [[3, 1]]
+    new_keys = {k.decode("utf-8") for k in set(await redis.keys()) - keys}
+    assert new_keys == {
+        str(child_id),
+        f"{child_id}:lineage",
+        metadata["ohlc"]["SPY"][-1],
+        metadata["signals"][0][-1],
+        signal_index_key(metadata["signals"][0][-1]),
+        # Only the appended signal is indexed across engines
+        date_index_key(child.signals.signals[-1].date),
+        get_engine_hash(
+            child.stock_market.start_date,
+            child.stock_market.tickers,
+            child.signal_detectors,
+            child.date,
+        ),
+    }
+
+    # The signals indexed by the parent are kept, and listed under the child
+    first_signal = engine.signals.signals[0]
+    assert await redis.zrange(date_index_key(first_signal.date), 0, -1) == [
+        f"{parent_id}:{first_signal.to_json()}".encode("utf-8")
+    ]
+    assert await signals_on_date(first_signal.date, redis) == [
+        (str(child_id), SignalSequence([first_signal]))
+    ]
+
+    engine_cache.clear()
+    stored_engine = await get_engine(child_id, redis)
+    assert stored_engine.stock_market == child.stock_market
+    assert stored_engine.signal_sequences == child.signal_sequences
+    # The parts of the parent are refreshed
+    assert await redis.ttl(metadata["ohlc"]["SPY"][0]) > 0
+
+
+async def test_delta_storage_snapshots(engine, redis, engine_cache, monkeypatch):
+    monkeypatch.setattr(get_settings(), "redis_snapshot_interval", 2)
+    engine_id = await store_engine(engine, redis)
+    lengths = []
+    for _ in range(3):
+        engine = advance(engine, 1)
+        engine_id = await store_engine(engine, redis, engine_id)
+        metadata = await get_metadata(engine_id, redis)
+        lengths.append((metadata["ohlc_rows"]["SPY"], metadata["signal_lengths"][0]))
+
+    # Merged after two deltas, signal sequences without new signals are reused as is
+    assert lengths == [([61, 1], [3]), ([61, 1, 1], [3]), ([64], [3])]
+    engine_cache.clear()
+    stored_engine = await get_engine(engine_id, redis)
+    assert stored_engine.stock_market == engine.stock_market
+    assert stored_engine.signal_sequences == engine.signal_sequences
+
+
+async def test_delta_storage_changed_data(engine, redis, engine_cache, spy):
+    parent_id = await store_engine(engine, redis)
+    ohlc = engine.stock_market.ohlc(spy)
+    values = ohlc.close.values + 1
+    child = Engine(
+        engine.stock_market.update_ticker(
+            TickerOHLC(spy, OHLC(ohlc.dates, values, values, values, values))
+        ),
+        engine.stock_market_updater,
+        engine.signal_detectors,
+        [SignalSequence()],
+        engine.date + dt.timedelta(days=1),
+    )
+    child_id = await store_engine(child, redis, parent_id)
+
+    metadata = await get_metadata(child_id, redis)
+    assert metadata["ohlc_rows"]["SPY"] == [61]
+    assert metadata["signal_lengths"] == [[0]]
+    engine_cache.clear()
+    stored_engine = await get_engine(child_id, redis)
+    assert stored_engine.stock_market == child.stock_market
+    assert stored_engine.signals == SignalSequence()
+
+
+async def test_signal_query(engine, redis, engine_cache, spy, qqq):
+    def signals(detector_id, name, days):
+        return SignalSequence(
+            [
+                Signal(
+                    detector_id,
+                    name,
+                    sentiment,
+                    dt.date(2000, 1, 1) + dt.timedelta(days=day),
+                    tickers,
+                )
+                for day, sentiment, tickers in days
+            ]
+        )
+
+    bullish, bearish = Sentiment.BULLISH, Sentiment.BEARISH
+    signal_sequences = [
+        signals(
+            1,
+            "monthly",
+            [(0, bullish, [spy]), (0, bearish, [qqq]), (31, bullish, [spy, qqq])],
+        ),
+        signals(
+            2,
+            "bi-monthly",
+            [(0, bearish, [spy]), (20, bullish, []), (31, bearish, [qqq])],
+        ),
+    ]
+    signal_engine = Engine(
+        engine.stock_market,
+        engine.stock_market_updater,
+        [MonthlySignalDetector(1), BiMonthlySignalDetector(2)],
+        signal_sequences,
+        engine.date,
+    )
+    engine_id = await store_engine(signal_engine, redis)
+    # Queries are answered by the index, without the signal parts
+    metadata = await get_metadata(engine_id, redis)
+    await redis.delete(*[key for keys in metadata["signals"] for key in keys])
+    engine_cache.clear()
+    view = await get_engine_view(engine_id, redis, cache=False)
+
+    all_signals = [s for sequence in signal_sequences for s in sequence.signals]
+    all_signals.sort(key=lambda s: s.date)
+    queries = [
+        {},
+        {"start": dt.date(2000, 1, 21)},
+        {"start": dt.date(2000, 1, 21), "end": dt.date(2000, 2, 1)},
+        {"detector_ids": [2]},
+        {"sentiment": bearish},
+        {"ticker": "QQQ"},
+        {"detector_ids": [1], "sentiment": bullish, "ticker": "SPY"},
+    ]
+    for query in queries:
+        expected = [
+            s
+            for s in all_signals
+            if s.date >= query.get("start", s.date)
+            and (query.get("end") is None or s.date < query["end"])
+            and s.id in query.get("detector_ids", [s.id])
+            and s.sentiment == query.get("sentiment", s.sentiment)
+            and (
+                "ticker" not in query
+                or query["ticker"] in [t.symbol for t in s.tickers]
+            )
+        ]
+        assert len(expected) > 0
+        for queried_view in [view, EngineView.from_engine(signal_engine)]:
+            for limit in [None, 1, 2, 4]:
+                cursor = None
+                result = []
+                while True:
+                    page, cursor = await queried_view.query_signals(
+                        SignalQuery(**query, limit=limit, cursor=cursor)
+                    )
+                    assert limit is None or len(page.signals) <= limit
+                    result.extend(page.signals)
+                    if cursor is None:
+                        break
+                assert result == expected, (query, limit)
+
+
+async def test_signals_across_engines(engine, redis, engine_cache, spy):
+    engine_id = await store_engine(engine, redis)
+    child = advance(engine, 31)
+    child_id = await store_engine(child, redis, engine_id)
+    other_signals = SignalSequence(
+        [Signal(1, "monthly", Sentiment.BULLISH, dt.date(2000, 4, 1), [spy])]
+    )
+    other = Engine(
+        engine.stock_market,
+        engine.stock_market_updater,
+        engine.signal_detectors,
+        [other_signals],
+        engine.date + dt.timedelta(days=1),
+    )
+    other_id = await store_engine(other, redis)
+
+    new_signal = child.signals.signals[-1]
+    assert new_signal.date == dt.date(2000, 4, 1)
+    assert sorted(await signals_on_date(new_signal.date, redis)) == [
+        (id, signals)
+        for id, signals in sorted(
+            [
+                (str(child_id), SignalSequence([new_signal])),
+                (str(other_id), other_signals),
+            ]
+        )
+    ]
+    assert await signals_on_date(dt.date(2000, 4, 2), redis) == []
+    assert await signals_on_ticker("SPY", redis, start=dt.date(2000, 3, 1)) == [
+        (str(other_id), other_signals)
+    ]
+    assert await signals_on_ticker("SPY", redis, end=dt.date(2000, 3, 1)) == []
+
+    # The signals of expired engines are removed
+    await redis.delete(str(other_id), owner_key(other_id))
+    assert await signals_on_ticker("SPY", redis) == []
+    assert await redis.exists("signals:ticker:SPY") == 0
+    assert await signals_on_date(new_signal.date, redis) == [
+        (str(child_id), SignalSequence([new_signal]))
+    ]
+
+    # The signals of an expired ancestor remain listed while its descendants live
+    first_signal = engine.signals.signals[0]
+    assert await signals_on_date(first_signal.date, redis) == [
+        (str(child_id), SignalSequence([first_signal]))
+    ]
+    await redis.delete(str(engine_id))
+    assert await signals_on_date(first_signal.date, redis) == [
+        (str(child_id), SignalSequence([first_signal]))
+    ]
+
+
+async def test_signals_across_engines_incremental(engine, redis, spy):
+    detector = engine.signal_detectors[0]
+
+    def create_engine(days, date, detection_date):
+        signals = SignalSequence(
+            [
+                Signal(1, "monthly", Sentiment.BULLISH, dt.date(2000, 3, day), [spy])
+                for day in days
+            ]
+        )
+        return Engine(
+            engine.stock_market,
+            engine.stock_market_updater,
+            [detector],
+            [signals],
+            date,
+            [detection_date],
+        )
+
+    # The signal after the detection date of the parent is detected again by the
+    # child, which drops it
+    parent = create_engine([1, 3], dt.date(2000, 3, 4), dt.date(2000, 3, 2))
+    parent_id = await store_engine(parent, redis)
+    child = create_engine([1, 5], dt.date(2000, 3, 6), dt.date(2000, 3, 5))
+    child_id = await store_engine(child, redis, parent_id)
+    for day, expected in [(1, [child_id]), (3, []), (5, [child_id])]:
+        listed = await signals_on_date(dt.date(2000, 3, day), redis)
+        assert [engine_id for engine_id, _ in listed] == [str(i) for i in expected]
+
+    # Another engine derived from the parent starts its own owner
+    other = create_engine([1, 4], dt.date(2000, 3, 5), dt.date(2000, 3, 4))
+    other_id = await store_engine(other, redis, parent_id)
+    listed = await signals_on_date(dt.date(2000, 3, 1), redis)
+    assert sorted(engine_id for engine_id, _ in listed) == sorted(
+        [str(child_id), str(other_id)]
+    )
+
+
+async def test_added_signals(engine, redis, engine_cache, spy):
+    def create_engine(days, date, detection_date):
+        signals = SignalSequence(
+            [
+                Signal(1, "monthly", Sentiment.BULLISH, dt.date(2000, 3, day), [spy])
+                for day in days
+            ]
+        )
+        return Engine(
+            engine.stock_market,
+            engine.stock_market_updater,
+            engine.signal_detectors,
+            [signals],
+            date,
+            [detection_date],
+        )
+
+    parent = create_engine([1, 3], dt.date(2000, 3, 4), dt.date(2000, 3, 2))
+    child = create_engine([1, 4, 5], dt.date(2000, 3, 6), dt.date(2000, 3, 5))
+    parent_id = await store_engine(parent, redis)
+    child_id = await store_engine(child, redis, parent_id)
+    expected = SignalSequence(child.signals.signals[1:])
+
+    views = await get_engine_views([parent_id, child_id], redis)
+    assert await added_signals(*views) == expected
+    assert await added_signals(None, views[1]) == child.signals
+
+    # Lazy views read the signals after the detection dates from the index
+    for engine_id in [parent_id, child_id]:
+        metadata = await get_metadata(engine_id, redis)
+        await redis.delete(*[key for keys in metadata["signals"] for key in keys])
+    engine_cache.clear()
+    views = await get_engine_views([parent_id, child_id], redis, cache=False)
+    assert await added_signals(*views) == expected
+
+
+async def test_signals_across_engines_limit(engine, redis, spy):
+    signal = Signal(1, "monthly", Sentiment.BULLISH, dt.date(2000, 3, 1), [spy])
+    engine_ids = []
+    for days in range(3):
+        engine_ids.append(
+            str(
+                await store_engine(
+                    Engine(
+                        engine.stock_market,
+                        engine.stock_market_updater,
+                        engine.signal_detectors,
+                        [SignalSequence([signal])],
+                        engine.date + dt.timedelta(days=days),
+                    ),
+                    redis,
+                )
+            )
+        )
+    # The expired engines listed first don't count towards the limit
+    engine_ids.sort()
+    await redis.delete(engine_ids[0], owner_key(engine_ids[0]))
+    listed = await signals_on_ticker("SPY", redis, limit=2)
+    assert [engine_id for engine_id, _ in listed] == engine_ids[1:]
+    assert await redis.zcard("signals:ticker:SPY") == 2
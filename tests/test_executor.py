@@ -0,0 +1,50 @@
+import os
+
+import pytest
+
+from stock_market_engine.config import get_settings
+from stock_market_engine.executor import run_in_executor, shutdown_executor
+
+
+def raise_type_error():
+    raise TypeError(os.getpid())
+
+
+class Payload:
+    pickled = 0
+
+    def __reduce__(self):
+        Payload.pickled += 1
+        return Payload, ()
+
+
+def payload_pid(payload):
+    return type(payload).__name__, os.getpid()
+
+
+@pytest.fixture
+def process_executor(monkeypatch):
+    monkeypatch.setattr(get_settings(), "executor", "process")
+    shutdown_executor()
+    yield
+    shutdown_executor()
+
+
+async def test_worker_exceptions_propagate(process_executor):
+    with pytest.raises(TypeError) as e:
+        await run_in_executor(raise_type_error)
+    # Raised in the worker process, not run again on the event loop
+    assert e.value.args[0] != os.getpid()
+
+
+async def test_unpicklable_work_runs_on_event_loop(process_executor):
+    def local_work(value):
+        return value, os.getpid()
+
+    assert await run_in_executor(local_work, 1) == (1, os.getpid())
+
+
+async def test_work_is_pickled_once(process_executor):
+    name, pid = await run_in_executor(payload_pid, Payload())
+    assert (name, Payload.pickled) == ("Payload", 1)
+    assert pid != os.getpid()
@@ -0,0 +1,115 @@
+import asyncio
+import datetime as dt
+import os
+
+import pytest
+from fakeredis.aioredis import FakeRedis
+from stock_market.core import OHLCFetcher, Ticker
+
+from stock_market_engine.engine_cache import estimate_ohlc_size
+from stock_market_engine.fetcher import CachedOHLCFetcher, CsvOHLCFetcher
+from stock_market_engine.ohlc_cache import OHLCFetchCache
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), os.pardir, "data")
+
+
+class CountingFetcher(OHLCFetcher):
+    def __init__(self):
+        super().__init__("counting")
+        self.fetcher = CsvOHLCFetcher(DATA_DIR)
+        self.requests = []
+
+    async def fetch_ohlc(self, requests):
+        self.requests.extend(requests)
+        await asyncio.sleep(0)
+        return await self.fetcher.fetch_ohlc(requests)
+
+    def to_json(self):
+        return self.fetcher.to_json()
+
+
+@pytest.fixture
+def spy():
+    return Ticker("SPY")
+
+
+@pytest.fixture
+def request_range(spy):
+    return (dt.date(2021, 1, 1), dt.date(2021, 2, 1), spy)
+
+
+def create_cache(max_size=1024 * 1024):
+    return OHLCFetchCache(max_size, dt.timedelta(hours=1), dt.timedelta(minutes=1))
+
+
+async def test_csv_fetcher(request_range, spy):
+    [(ticker, ohlc)] = await CsvOHLCFetcher(DATA_DIR).fetch_ohlc([request_range])
+    assert ticker == spy
+    assert ohlc.start == dt.date(2021, 1, 4)
+    assert ohlc.end == dt.date(2021, 1, 29)
+
+
+async def test_csv_fetcher_unknown_ticker():
+    request = (dt.date(2021, 1, 1), dt.date(2021, 2, 1), Ticker("UNKNOWN"))
+    assert await CsvOHLCFetcher(DATA_DIR).fetch_ohlc([request]) == [
+        (Ticker("UNKNOWN"), None)
+    ]
+
+
+async def test_cache_coalesces_concurrent_fetches(request_range):
+    fetcher = CountingFetcher()
+    cached_fetcher = CachedOHLCFetcher(fetcher, create_cache())
+    results = await asyncio.gather(
+        *[cached_fetcher.fetch_ohlc([request_range]) for _ in range(5)]
+    )
+    assert len(fetcher.requests) == 1
+    assert all(result == results[0] for result in results)
+
+    await cached_fetcher.fetch_ohlc([request_range])
+    assert len(fetcher.requests) == 1
+
+
+async def test_cache_redis_tier(request_range):
+    redis = FakeRedis()
+    fetcher = CountingFetcher()
+    first_cache = create_cache()
+    first_cache.bind_redis(lambda: redis)
+    [(_, ohlc)] = await first_cache.fetch(fetcher, [request_range])
+
+    second_cache = create_cache()
+    second_cache.bind_redis(lambda: redis)
+    assert await second_cache.fetch(fetcher, [request_range]) == [
+        (request_range[2], ohlc)
+    ]
+    assert len(fetcher.requests) == 1
+
+
+async def test_cache_size(request_range, spy):
+    fetcher = CountingFetcher()
+    ranges = [
+        request_range,
+        (dt.date(2021, 2, 1), dt.date(2021, 3, 1), spy),
+        (dt.date(2021, 3, 1), dt.date(2021, 4, 1), spy),
+    ]
+    sizes = [
+        OHLCFetchCache.ENTRY_SIZE + estimate_ohlc_size(ohlc)
+        for _, ohlc in await fetcher.fetch_ohlc(ranges)
+    ]
+    max_size = sum(sizes) - min(sizes)
+    cache = create_cache(max_size)
+    for ohlc_range in ranges:
+        await cache.fetch(fetcher, [ohlc_range])
+        assert cache.size <= max_size
+
+    # The least recently used entry is evicted to stay within the size
+    fetcher.requests.clear()
+    await cache.fetch(fetcher, ranges[1:])
+    assert fetcher.requests == []
+    await cache.fetch(fetcher, ranges[:1])
+    assert fetcher.requests == ranges[:1]
+
+    # Entries larger than the cache aren't cached
+    full_range = (dt.date(1990, 1, 1), dt.date(2021, 1, 1), spy)
+    await cache.fetch(fetcher, [full_range])
+    await cache.fetch(fetcher, [full_range])
+    assert fetcher.requests.count(full_range) == 2
@@ -0,0 +1,150 @@
+import datetime as dt
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+from stock_market.core import StockMarket, StockUpdater, Ticker
+from stock_market.ext.signal import GoldenCrossSignalDetector
+
+from stock_market_engine.columnar_market import ColumnarMarket
+from stock_market_engine.common import get_stock_updater_factory
+from stock_market_engine.engine import Engine
+from stock_market_engine.fetcher import CsvOHLCFetcher, LocalOHLCFetcher
+from stock_market_engine.local_store import LocalMarketStore, refresh_local_store
+from stock_market_engine.refresh_local_store import main
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), os.pardir, "data")
+
+
+@pytest.fixture
+def store_dir(tmp_path):
+    return str(tmp_path / "store")
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    """SPY and QQQ data up to 2021."""
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    for symbol in ["SPY", "QQQ"]:
+        data = pd.read_csv(os.path.join(DATA_DIR, f"{symbol}.csv"))
+        data[data.Date < "2021-01-01"].to_csv(data_dir / f"{symbol}.csv", index=False)
+    return str(data_dir)
+
+
+def is_memory_mapped(column):
+    while column is not None:
+        if isinstance(column, np.memmap):
+            return True
+        column = column.base
+    return False
+
+
+def test_ingest_csv(store_dir, data_dir):
+    store = LocalMarketStore(store_dir)
+    assert store.symbols() == []
+    assert store.ingest_csv(data_dir) == ["QQQ", "SPY"]
+    assert store.symbols() == ["QQQ", "SPY"]
+    assert store.columns("DIA") is None
+
+    columns = store.columns("SPY", dt.date(2020, 1, 1), dt.date(2020, 2, 1))
+    assert all(is_memory_mapped(c) for c in columns)
+    assert columns[0][0] == (dt.date(2020, 1, 2) - dt.date(1970, 1, 1)).days
+    assert len(columns[0]) == 21
+
+    # Only changed files are ingested again, by any reader of the store
+    assert store.ingest_csv(data_dir) == []
+    shutil.copy(os.path.join(DATA_DIR, "SPY.csv"), data_dir)
+    assert LocalMarketStore(store_dir).ingest_csv(data_dir) == ["SPY"]
+    assert len(store.columns("SPY", dt.date(2021, 1, 1))[0]) > 0
+    assert os.listdir(os.path.join(store_dir, "SPY")) == ["2"]
+    # Columns read before the update remain valid
+    assert len(columns[0]) == 21
+
+
+async def test_local_fetcher(store_dir):
+    LocalMarketStore(store_dir).ingest_csv(DATA_DIR)
+    requests = [
+        (dt.date(2020, 1, 1), dt.date(2021, 2, 1), Ticker("SPY")),
+        (dt.date(2021, 1, 1), dt.date(2021, 2, 1), Ticker("QQQ")),
+        (dt.date(2040, 1, 1), dt.date(2040, 2, 1), Ticker("QQQ")),
+        (dt.date(2021, 1, 1), dt.date(2021, 2, 1), Ticker("UNKNOWN")),
+    ]
+    assert await LocalOHLCFetcher(store_dir).fetch_ohlc(
+        requests
+    ) == await CsvOHLCFetcher(DATA_DIR).fetch_ohlc(requests)
+
+    stock_updater = get_stock_updater_factory().create("local", json.dumps(store_dir))
+    assert json.loads(stock_updater.to_json()) == store_dir
+    tickers = [Ticker("SPY"), Ticker("DIA")]
+    stock_market = StockMarket(dt.date(2020, 1, 1), tickers)
+    date = dt.date(2021, 1, 1)
+    expected = await StockUpdater(CsvOHLCFetcher(DATA_DIR)).update(date, stock_market)
+    updated = await stock_updater.update(date, stock_market)
+    assert updated == expected
+    # The updated market is served from the store without copying
+    assert isinstance(updated, ColumnarMarket)
+    assert all(is_memory_mapped(c) for c in updated.columns(Ticker("SPY")))
+
+    detectors = [GoldenCrossSignalDetector(1, Ticker("SPY"))]
+    engine = await Engine(stock_market, stock_updater, detectors).update(date)
+    expected = await Engine(
+        stock_market, StockUpdater(CsvOHLCFetcher(DATA_DIR)), detectors
+    ).update(date)
+    assert engine.signals == expected.signals
+    assert engine.stock_market == expected.stock_market
+
+
+async def test_refresh(store_dir, data_dir):
+    store = LocalMarketStore(store_dir)
+    store.ingest_csv(data_dir)
+    columns = store.columns("SPY")
+
+    date = dt.date(2021, 2, 1)
+    stock_updater = StockUpdater(CsvOHLCFetcher(DATA_DIR))
+    assert await refresh_local_store(store, stock_updater, date) == ["QQQ", "SPY"]
+    assert await refresh_local_store(store, stock_updater, date) == []
+
+    full_store = LocalMarketStore(os.path.join(store_dir, os.pardir, "full"))
+    full_store.ingest_csv(DATA_DIR)
+    for symbol in ["QQQ", "SPY"]:
+        for column, expected in zip(
+            store.columns(symbol), full_store.columns(symbol, None, date)
+        ):
+            assert np.array_equal(column, expected)
+    assert len(store.columns("SPY")[0]) == len(columns[0]) + 19
+
+    # The CSV data is not ingested again unless it changed
+    assert store.ingest_csv(data_dir) == []
+
+    # Symbols without data are fetched from the first date of the other symbols,
+    # which precedes the data of DIA
+    store.write({"DIA": ([np.array([], np.int64)] + [np.array([])] * 4, {})})
+    assert await refresh_local_store(store, stock_updater, date) == ["DIA"]
+    for column, expected in zip(
+        store.columns("DIA"), full_store.columns("DIA", None, date)
+    ):
+        assert np.array_equal(column, expected)
+
+
+def test_main(store_dir, data_dir):
+    main([store_dir, "--csv", data_dir])
+    main(
+        [
+            store_dir,
+            "--stock-updater",
+            "csv",
+            "--stock-updater-config",
+            json.dumps(DATA_DIR),
+            "--date",
+            "2021-01-05",
+        ]
+    )
+    store = LocalMarketStore(store_dir)
+    assert store.symbols() == ["QQQ", "SPY"]
+    assert store.columns("SPY", dt.date(2021, 1, 1))[0][-1] == (
+        (dt.date(2021, 1, 4) - dt.date(1970, 1, 1)).days
+    )
@@ -0,0 +1,176 @@
+import datetime as dt
+import json
+import os
+import uuid
+
+import pytest
+from fakeredis.aioredis import FakeRedis
+from stock_market.core import StockMarket, Ticker
+from stock_market.ext.signal import (
+    DeathCrossSignalDetector,
+    GoldenCrossSignalDetector,
+    MonthlySignalDetector,
+)
+
+from stock_market_engine.common import get_stock_updater_factory
+from stock_market_engine.engine import Engine
+from stock_market_engine.engine_cache import get_engine_cache
+from stock_market_engine.engine_store import get_engine_view, store_engine
+from stock_market_engine.engine_view import EngineView
+from stock_market_engine.fetcher import CsvOHLCFetcher
+from stock_market_engine.ohlc_cache import get_ohlc_fetch_cache
+from stock_market_engine.scheduler import (
+    ENGINES_CHANNEL,
+    Scheduler,
+    get_subscription,
+    subscribe,
+)
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), os.pardir, "data")
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    get_engine_cache().clear()
+    get_ohlc_fetch_cache.cache_clear()
+
+
+@pytest.fixture
+def redis():
+    return FakeRedis()
+
+
+@pytest.fixture
+def fetch_requests(monkeypatch):
+    requests = []
+    fetch_ohlc = CsvOHLCFetcher.fetch_ohlc
+
+    async def counting_fetch_ohlc(self, ohlc_requests):
+        requests.extend(ohlc_requests)
+        return await fetch_ohlc(self, ohlc_requests)
+
+    monkeypatch.setattr(CsvOHLCFetcher, "fetch_ohlc", counting_fetch_ohlc)
+    return requests
+
+
+def create_scheduler(concurrency=2, batch_size=2):
+    return Scheduler(concurrency, dt.timedelta(minutes=1), dt.time(22, 30), batch_size)
+
+
+async def create_engine(symbols, date):
+    stock_updater = get_stock_updater_factory().create("csv", json.dumps(DATA_DIR))
+    engine = Engine(
+        StockMarket(dt.date(2021, 1, 1), [Ticker(s) for s in symbols]),
+        stock_updater,
+        [MonthlySignalDetector(1)],
+    )
+    return await engine.update(date)
+
+
+async def test_run(redis, fetch_requests):
+    engines = [
+        await create_engine(["SPY", "QQQ"], dt.date(2021, 1, 5)),
+        await create_engine(["SPY", "QQQ"], dt.date(2021, 1, 15)),
+        await create_engine(["SPY"], dt.date(2021, 1, 5)),
+        await create_engine(["SPY"], dt.date(2021, 3, 1)),
+    ]
+    subscription_ids = [
+        await subscribe(await store_engine(engine, redis), redis) for engine in engines
+    ]
+    pubsub = redis.pubsub()
+    await pubsub.subscribe(ENGINES_CHANNEL)
+    fetch_requests.clear()
+
+    date = dt.date(2021, 2, 1)
+    advanced = await create_scheduler().run(date, redis)
+
+    # The up to date engine isn't advanced
+    assert set(advanced) == set(subscription_ids[:3])
+    # Each ticker is fetched once, the engines on the same tickers and date share it
+    assert sorted(r[2].symbol for r in fetch_requests) == ["QQQ", "SPY"]
+    for subscription_id, engine in zip(subscription_ids, engines):
+        engine_id = await get_subscription(subscription_id, redis)
+        if subscription_id not in advanced:
+            assert engine_id == subscription_id
+            continue
+        assert engine_id == advanced[subscription_id]
+        view = await get_engine_view(uuid.UUID(engine_id), redis)
+        expected = await engine.update(date)
+        assert view.date == date
+        assert await view.signals() == expected.signals
+        assert await view.stock_market() == expected.stock_market
+
+    messages = []
+    for _ in range(10):
+        message = await pubsub.get_message(True, timeout=0.01)
+        if message is not None:
+            messages.append(json.loads(message["data"]))
+    assert {m["subscription_id"]: m["engine_id"] for m in messages} == advanced
+
+    # Runs once per date
+    assert await create_scheduler().run(date, redis) is None
+
+
+async def test_run_batches(redis, monkeypatch):
+    engines = [
+        await create_engine(["SPY"], dt.date(2021, 1, day)) for day in range(5, 10)
+    ]
+    for engine in engines:
+        await subscribe(await store_engine(engine, redis), redis)
+    get_engine_cache().clear()
+
+    loading = []
+    max_loading = 0
+    load_engine = EngineView.engine
+
+    async def counting_load_engine(self):
+        nonlocal max_loading
+        loading.append(self)
+        max_loading = max(max_loading, len(loading))
+        try:
+            return await load_engine(self)
+        finally:
+            loading.remove(self)
+
+    monkeypatch.setattr(EngineView, "engine", counting_load_engine)
+    date = dt.date(2021, 2, 1)
+    advanced = await create_scheduler(concurrency=1, batch_size=2).run(date, redis)
+    assert len(advanced) == len(engines)
+    # The engines of a group are loaded a batch at a time
+    assert max_loading == 2
+
+
+async def test_daily_runs(redis):
+    spy = Ticker("SPY")
+    engine = Engine(
+        StockMarket(dt.date(2005, 1, 1), [spy]),
+        get_stock_updater_factory().create("csv", json.dumps(DATA_DIR)),
+        [GoldenCrossSignalDetector(1, spy), DeathCrossSignalDetector(2, spy)],
+    )
+    subscription_id = await subscribe(
+        await store_engine(await engine.update(dt.date(2006, 7, 20)), redis), redis
+    )
+
+    # Advances to the next day daily, over the days of crosses
+    date = dt.date(2006, 7, 21)
+    while date <= dt.date(2006, 9, 1):
+        await create_scheduler().run(date, redis)
+        date += dt.timedelta(days=1)
+
+    engine_id = await get_subscription(subscription_id, redis)
+    view = await get_engine_view(uuid.UUID(engine_id), redis)
+    expected = await engine.update(dt.date(2006, 9, 1))
+    assert await view.signals() == expected.signals
+    assert len(expected.signals.signals) == 3
+
+
+async def test_run_unsubscribes_expired_engines(redis):
+    engine_id = await store_engine(
+        await create_engine(["SPY"], dt.date(2021, 1, 5)), redis
+    )
+    subscription_id = await subscribe(engine_id, redis)
+    await redis.delete(str(engine_id))
+    get_engine_cache().clear()
+
+    assert await create_scheduler().run(dt.date(2021, 2, 1), redis) == {}
+    assert await get_subscription(subscription_id, redis) is None